@@ -0,0 +1,67 @@
+"""
+Distance ranking benchmark: the previous calculate_distances (coordinates.json reloaded and one geodesic
+per relay, then a full sort) versus the current one (cached per-city unit vectors, heap top-k and
+geodesic refinement of the top candidates only).
+
+    python -m benchmarks.bench_distances [--size 700] [--repeat 50] [--top-k 10]
+"""
+import argparse
+from time import perf_counter
+from geopy.distance import geodesic
+from utils import server_distance_utilities
+from utils.server_distance_utilities import calculate_distances, load_coordinates
+from benchmarks.fleet import make_fleet
+
+LOCATION = (52.52, 13.405)  # Berlin
+
+
+def previous_calculate_distances(current_location, relays_data):
+    """calculate_distances as it was before the per-city cache and top-k selection."""
+    coordinates = load_coordinates()
+    distances = []
+    for relay in relays_data:
+        city_key = f"{relay['country_name']}-{relay['city_name']}"
+        if city_key in coordinates:
+            distance = geodesic(current_location, coordinates[city_key]).kilometers
+            distances.append((relay['hostname'], distance, relay['ipv4_addr_in']))
+    return sorted(distances, key=lambda x: x[1])
+
+
+def best_of(repeat, function):
+    """Run `function` `repeat` times and return the fastest run in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        timings.append((perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=700, help="number of synthetic relays")
+    parser.add_argument("--repeat", type=int, default=50, help="runs per measurement, the fastest is kept")
+    parser.add_argument("--top-k", type=int, default=10, help="number of closest relays to return")
+    args = parser.parse_args()
+
+    relays = make_fleet(args.size)
+    server_distance_utilities.print = lambda *a, **k: None  # Silence the "Loading coordinates" message
+
+    expected = [entry[0] for entry in previous_calculate_distances(LOCATION, relays)[:args.top_k]]
+    ranked = [entry[0] for entry in calculate_distances(LOCATION, relays, top_k=args.top_k)]
+    print(f"Top {args.top_k} identical to the previous ranking: {ranked == expected}")
+
+    results = {
+        "previous (geodesic, full sort)": best_of(args.repeat, lambda: previous_calculate_distances(LOCATION, relays)),
+        "all relays, exact": best_of(args.repeat, lambda: calculate_distances(LOCATION, relays)),
+        "all relays, great-circle": best_of(args.repeat, lambda: calculate_distances(LOCATION, relays, exact=False)),
+        f"top {args.top_k}, exact": best_of(args.repeat, lambda: calculate_distances(LOCATION, relays, top_k=args.top_k)),
+        f"top {args.top_k}, great-circle": best_of(args.repeat, lambda: calculate_distances(LOCATION, relays, top_k=args.top_k, exact=False)),
+    }
+    print(f"{args.size} relays, best of {args.repeat} runs")
+    for name, milliseconds in results.items():
+        print(f"{name:<34}{milliseconds:9.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
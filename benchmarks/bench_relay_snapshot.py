@@ -0,0 +1,60 @@
+"""
+Cold-start benchmark: loading the relay list and building the RelayCatalog from the JSON cache
+versus the binary snapshot.
+
+    python -m benchmarks.bench_relay_snapshot [--size 700] [--repeat 50]
+"""
+import os
+import json
+import argparse
+import tempfile
+from time import perf_counter, time
+from utils.relay_catalog import RelayCatalog
+from utils.relay_snapshot import writeSnapshot, loadSnapshot
+from benchmarks.fleet import make_fleet
+
+
+def best_of(repeat, function):
+    """Run `function` `repeat` times and return the fastest run in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        timings.append((perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=700, help="number of synthetic relays")
+    parser.add_argument("--repeat", type=int, default=50, help="runs per measurement, the fastest is kept")
+    args = parser.parse_args()
+
+    relays = make_fleet(args.size)
+    with tempfile.TemporaryDirectory() as directory:
+        json_file = os.path.join(directory, "relays.json")
+        snapshot_file = os.path.join(directory, "relays.snapshot")
+        with open(json_file, "w") as f:
+            json.dump({"version": 2, "timestamp": time(), "etag": None, "last_modified": None, "relays": relays}, f)
+        writeSnapshot(relays, time(), snapshot_file)
+
+        def load_json():
+            with open(json_file, "r") as f:
+                return json.loads(f.read())["relays"]
+
+        results = {
+            "json load": best_of(args.repeat, load_json),
+            "json load + catalog": best_of(args.repeat, lambda: RelayCatalog(load_json())),
+            "snapshot load": best_of(args.repeat, lambda: loadSnapshot(snapshot_file)),
+            "snapshot load + catalog": best_of(args.repeat, lambda: RelayCatalog(loadSnapshot(snapshot_file))),
+        }
+        sizes = {"json": os.path.getsize(json_file), "snapshot": os.path.getsize(snapshot_file)}
+
+    print(f"{args.size} relays, best of {args.repeat} runs")
+    print(f"File size: JSON {sizes['json'] / 1024:.1f} KiB, snapshot {sizes['snapshot'] / 1024:.1f} KiB")
+    for name, milliseconds in results.items():
+        print(f"{name:<26}{milliseconds:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
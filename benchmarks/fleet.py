@@ -0,0 +1,68 @@
+"""Synthetic relay fleet shaped like the /www/relays/all/ payload, for benchmarks without the real API."""
+import os
+import json
+import random
+import base64
+from utils.paths import DATA_DIR
+
+PROVIDERS = ["31173", "DataPacket", "M247", "xtom", "Tzulo", "Blix", "Creanova", "iRegister", "Leaseweb"]
+SPEEDS = [1, 10, 10, 10, 20, 40]
+TYPES = ["wireguard", "wireguard", "wireguard", "openvpn", "bridge"]
+
+
+def load_cities():
+    """Return (country, city, (lat, lon)) for every city in data/coordinates.json."""
+    with open(os.path.join(DATA_DIR, "coordinates.json"), "r") as f:
+        coordinates = json.load(f)
+    cities = []
+    for key, coords in coordinates.items():
+        country, city = key.split("-", 1)
+        cities.append((country, city, tuple(coords)))
+    return cities
+
+
+def loopback_address(index):
+    """Spread relays over 127.0.0.0/8 so each one has its own address on the loopback interface."""
+    index += 1
+    return f"127.{(index >> 16) & 0xFF}.{(index >> 8) & 0xFF}.{index & 0xFF}"
+
+
+def make_fleet(size=700, seed=1, loopback=True):
+    """
+    Build `size` relays spread over the known cities.
+    With `loopback`, ipv4_addr_in points into 127.0.0.0/8 (and ipv6_addr_in at ::1) so probes stay local.
+    """
+    rng = random.Random(seed)
+    cities = load_cities()
+    relays = []
+    for index in range(size):
+        country, city, _ = cities[index % len(cities)] if index < len(cities) else rng.choice(cities)
+        relay_type = rng.choice(TYPES)
+        country_code = country[:2].lower()
+        city_code = city.replace(" ", "")[:3].lower()
+        hostname = f"{country_code}-{city_code}-{relay_type[:2]}-{index:03d}"
+        relay = {
+            "hostname": hostname,
+            "country_code": country_code,
+            "country_name": country,
+            "city_code": city_code,
+            "city_name": city,
+            "fqdn": f"{hostname}.relays.mullvad.net",
+            "active": rng.random() > 0.03,
+            "owned": rng.random() < 0.35,
+            "provider": rng.choice(PROVIDERS),
+            "ipv4_addr_in": loopback_address(index) if loopback else f"198.18.{index >> 8 & 0xFF}.{index & 0xFF}",
+            "ipv6_addr_in": "::1" if loopback else f"2001:db8::{index:x}",
+            "network_port_speed": rng.choice(SPEEDS),
+            "stboot": rng.random() < 0.8,
+            "type": relay_type,
+            "status_messages": [],
+        }
+        if relay_type == "wireguard":
+            relay["pubkey"] = base64.b64encode(rng.randbytes(32)).decode()
+            relay["multihop_port"] = 3000 + index
+            relay["socks_name"] = f"{hostname}-socks5.relays.mullvad.net"
+            relay["socks_port"] = 1080
+            relay["daita"] = rng.random() < 0.3
+        relays.append(relay)
+    return relays
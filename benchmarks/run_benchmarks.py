@@ -0,0 +1,201 @@
+"""
+Benchmark suite: relay loading, index build and dropdown queries, calculate_distances, end-to-end
+scans of a synthetic fleet over a simulated loopback network (see benchmarks.simulated_network), a fleet
+scan against an ICMP exhaustive scan of the same loopback addresses, and path analysis through a simulated router chain with one congested transit router.
+Results are saved as JSON so runs can be compared.
+
+    python -m benchmarks.run_benchmarks [--size 700] [--repeat 20] [--output FILE] [--compare PREVIOUS.json]
+"""
+import io
+import os
+import sys
+import json
+import argparse
+import platform
+import tempfile
+import contextlib
+from datetime import datetime, timezone
+from time import perf_counter, time
+from utils.relay_catalog import RelayCatalog
+from utils.relay_snapshot import writeSnapshot, loadSnapshot
+from utils.server_distance_utilities import calculate_distances
+from utils.ping_utilities import probe_relays, set_probe_backend
+from utils.probe_scheduler import adaptive_probe_relays
+from utils.fleet_scan import fleet_probe_relays
+from utils.latency_stats import best_result
+from utils.path_analysis import trace_paths
+from utils.paths import BASE_DIR
+from benchmarks.fleet import make_fleet
+from benchmarks.bench_distances import best_of, LOCATION
+from benchmarks.simulated_network import SimulatedNetwork, SimulatedRouterChain, fleet_profiles, router_chain
+
+RESULTS_DIR = os.path.join(BASE_DIR, "benchmarks", "results")
+
+
+def bench_loading(relays, repeat):
+    with tempfile.TemporaryDirectory() as directory:
+        json_file = os.path.join(directory, "relays.json")
+        snapshot_file = os.path.join(directory, "relays.snapshot")
+        with open(json_file, "w") as f:
+            json.dump({"version": 2, "timestamp": time(), "etag": None, "last_modified": None, "relays": relays}, f)
+        writeSnapshot(relays, time(), snapshot_file)
+
+        def load_json():
+            with open(json_file, "r") as f:
+                return json.loads(f.read())["relays"]
+
+        return {
+            "load.json_ms": best_of(repeat, load_json),
+            "load.snapshot_ms": best_of(repeat, lambda: loadSnapshot(snapshot_file)),
+            "load.snapshot_catalog_ms": best_of(repeat, lambda: RelayCatalog(loadSnapshot(snapshot_file))),
+        }
+
+
+def bench_index(relays, repeat):
+    catalog = RelayCatalog(relays)
+    country, city = relays[0]["country_name"], relays[0]["city_name"]
+
+    def dropdowns():
+        # What the GUI asks for when a country and then a city is picked
+        catalog.countries()
+        catalog.cities(country, "wireguard")
+        catalog.providers(country, city)
+
+    return {
+        "index.build_ms": best_of(repeat, lambda: RelayCatalog(relays)),
+        "index.dropdowns_ms": best_of(repeat, dropdowns),
+        "index.query_city_ms": best_of(repeat, lambda: catalog.query(country=country, city=city, relay_type="wireguard")),
+        "index.query_fleet_ms": best_of(repeat, lambda: catalog.query(relay_type="wireguard", min_bandwidth=10)),
+    }
+
+
+def bench_distances(relays, repeat):
+    calculate_distances(LOCATION, relays)  # Build the city index outside the timings
+    return {
+        "distances.all_exact_ms": best_of(repeat, lambda: calculate_distances(LOCATION, relays)),
+        "distances.top10_exact_ms": best_of(repeat, lambda: calculate_distances(LOCATION, relays, top_k=10)),
+        "distances.top10_great_circle_ms": best_of(repeat, lambda: calculate_distances(LOCATION, relays, top_k=10, exact=False)),
+    }
+
+
+def bench_scans(relays, count, timeout, seed):
+    """Scan every relay over the simulated network, exhaustively and adaptively, and check the answers."""
+    profiles = fleet_profiles(relays, seed=seed)
+    reachable = {ip: profile for ip, profile in profiles.items() if profile.loss < 1}
+    true_best = min(reachable, key=lambda ip: reachable[ip].delay)
+    set_probe_backend("udp")
+    results = {}
+    try:
+        for name, scan in (("exhaustive", probe_relays), ("adaptive", adaptive_probe_relays)):
+            with SimulatedNetwork(profiles, seed=seed) as network:
+                start = perf_counter()
+                scanned = scan(relays, count=count, timeout=timeout)
+                elapsed = (perf_counter() - start) * 1000
+            errors = [abs(result.stats().median - profiles[result.ip].delay)
+                      for result in scanned.values() if result.stats().received]
+            best = best_result(scanned.values())
+            results[f"scan.{name}_ms"] = elapsed
+            results[f"scan.{name}_probes"] = network.received
+            results[f"scan.{name}_median_error_ms"] = sum(errors) / len(errors) if errors else None
+            results[f"scan.{name}_found_best"] = best is not None and best.ip == true_best
+    finally:
+        set_probe_backend("auto")
+    return results
+
+
+def bench_fleet(relays, count, timeout):
+    """
+    Scan every relay with one socket (fleet) and with the ICMP backend (exhaustive). The simulated network only
+    answers UDP, so both scans go to the fleet's 127.x addresses and are answered by the kernel instantly:
+    the times measure the probing overhead. Metrics are None when this system doesn't allow ICMP sockets.
+    """
+    results = {}
+    set_probe_backend("icmp")
+    try:
+        for name, scan in (("exhaustive", probe_relays), ("fleet", fleet_probe_relays)):
+            start = perf_counter()
+            try:
+                scanned = scan(relays, count=count, timeout=timeout)
+            except (OSError, RuntimeError):
+                scanned = None
+            elapsed = (perf_counter() - start) * 1000
+            results[f"fleet.{name}_ms"] = elapsed if scanned is not None else None
+            results[f"fleet.{name}_replies"] = (sum(result.stats().received for result in scanned.values())
+                                                if scanned is not None else None)
+    finally:
+        set_probe_backend("auto")
+    return results
+
+
+def bench_paths(relays, timeout, seed):
+    """Trace every relay through a simulated router chain, with and without the shared prefix cache."""
+    congested = relays[0]["country_name"]
+    paths, profiles = router_chain(relays, seed=seed, congested=congested)
+    congested_router = paths[relays[0]["ipv4_addr_in"]][2]
+    results = {}
+    for name, pilots in (("cached", 3), ("uncached", 0)):
+        with SimulatedRouterChain(paths, profiles, seed=seed) as network:
+            start = perf_counter()
+            tree = trace_paths(relays, count=1, timeout=timeout, pilots=pilots, hop_function=network.hop_probe)
+            elapsed = (perf_counter() - start) * 1000
+        bottlenecks = tree.bottlenecks(top=1)
+        results[f"paths.{name}_ms"] = elapsed
+        results[f"paths.{name}_probes"] = network.received
+        results[f"paths.{name}_found_bottleneck"] = bool(bottlenecks) and bottlenecks[0].address == congested_router
+    return results
+
+
+def compare(current, previous):
+    """Print the relative change of every numeric metric present in both runs."""
+    print(f"\nCompared with {previous['meta']['timestamp']}:")
+    for name, value in current["results"].items():
+        old = previous["results"].get(name)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not old:
+            continue
+        print(f"{name:<38}{old:12.3f} -> {value:12.3f}  ({(value - old) / old * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=700, help="number of synthetic relays")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per micro-benchmark, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the fleet and the simulated network")
+    parser.add_argument("--count", type=int, default=3, help="probes per relay in the scan benchmarks")
+    parser.add_argument("--timeout", type=int, default=200, help="probe timeout in ms in the scan benchmarks")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    relays = make_fleet(args.size, seed=args.seed)
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):  # Silence progress output of the code under test
+        results.update(bench_loading(relays, args.repeat))
+        results.update(bench_index(relays, args.repeat))
+        results.update(bench_distances(relays, args.repeat))
+        results.update(bench_scans(relays, args.count, args.timeout, args.seed))
+        results.update(bench_fleet(relays, args.count, args.timeout))
+        results.update(bench_paths(relays, args.timeout, args.seed))
+
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    report = {
+        "meta": {"timestamp": timestamp, "python": sys.version.split()[0], "platform": platform.platform(),
+                 "size": args.size, "repeat": args.repeat, "seed": args.seed, "count": args.count,
+                 "timeout": args.timeout},
+        "results": results,
+    }
+    for name, value in results.items():
+        print(f"{name:<38}{value!s:>12}" if not isinstance(value, float) else f"{name:<38}{value:12.3f}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{timestamp}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved to {output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Simulated relay network on the loopback interface.
+Every synthetic relay address (127.x.y.z, see benchmarks.fleet) gets a UDP responder on the port the
+"udp" probe backend uses, which answers each datagram after the host's configured delay and jitter,
+or drops it with the host's loss probability. Probing with backend="udp" then exercises the real probe
+path against reproducible network conditions.
+SimulatedRouterChain adds the routers on the way to each relay for TTL-limited probes (utils.path_analysis).
+"""
+import heapq
+import random
+import socket
+import selectors
+import threading
+from time import monotonic
+from utils.geo_utilities import great_circle_km, unit_vector
+from utils.probe_backends import DEFAULT_UDP_PORT, udp_probe
+from benchmarks.fleet import load_cities
+
+ORIGIN = (52.52, 13.405)  # Where the simulated client sits (Berlin)
+
+
+class HostProfile:
+    """Network conditions of one simulated host: mean one-way-and-back delay and jitter in ms, loss as a fraction."""
+
+    __slots__ = ("delay", "jitter", "loss")
+
+    def __init__(self, delay, jitter=0.0, loss=0.0):
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+
+    def as_dict(self):
+        return {"delay": self.delay, "jitter": self.jitter, "loss": self.loss}
+
+
+def fleet_profiles(relays, seed=1, origin=ORIGIN, scale=0.1, max_delay=None):
+    """
+    Derive a HostProfile for every relay from its distance to `origin`: 2 ms + 1 ms per 100 km (times `scale`),
+    up to 10% jitter and 0-5% loss, drawn from a seeded generator so runs are reproducible.
+    `scale` shortens the delays so a scan of the whole fleet doesn't take real-world seconds.
+    """
+    rng = random.Random(seed)
+    coordinates = {(country, city): coords for country, city, coords in load_cities()}
+    origin_vector = unit_vector(*origin)
+    profiles = {}
+    for relay in relays:
+        coords = coordinates.get((relay["country_name"], relay["city_name"]), origin)
+        delay = (2.0 + great_circle_km(origin_vector, unit_vector(*coords)) / 100.0) * scale
+        if max_delay is not None:
+            delay = min(delay, max_delay)
+        profiles[relay["ipv4_addr_in"]] = HostProfile(delay, jitter=delay * rng.uniform(0, 0.1),
+                                                      loss=rng.choice((0.0, 0.0, 0.0, 0.01, 0.05)))
+    return profiles
+
+
+class SimulatedNetwork:
+    """
+    UDP responders for a set of loopback addresses, all served by one thread.
+    Use as a context manager: `with SimulatedNetwork(profiles): probe_relays(..., backend="udp")`.
+    """
+
+    def __init__(self, profiles, port=DEFAULT_UDP_PORT, seed=1):
+        self.profiles = profiles
+        self.port = port
+        self.rng = random.Random(seed)
+        self.selector = selectors.DefaultSelector()
+        self.sockets = []
+        self.pending = []  # Heap of (send time, sequence, socket, data, address)
+        self.received = 0
+        self.dropped = 0
+        self._sequence = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def __enter__(self):
+        for address, profile in self.profiles.items():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            sock.bind((address, self.port))
+            self.selector.register(sock, selectors.EVENT_READ, profile)
+            self.sockets.append(sock)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        for sock in self.sockets:
+            self.selector.unregister(sock)
+            sock.close()
+        self.selector.close()
+        return False
+
+    def _serve(self):
+        while not self._stop.is_set():
+            timeout = 0.05
+            if self.pending:
+                timeout = min(timeout, max(0.0, self.pending[0][0] - monotonic()))
+            for key, _ in self.selector.select(timeout):
+                profile = key.data
+                while True:
+                    try:
+                        data, address = key.fileobj.recvfrom(2048)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    self.received += 1
+                    if self.rng.random() < profile.loss:
+                        self.dropped += 1
+                        continue
+                    delay = max(0.0, self.rng.gauss(profile.delay, profile.jitter)) / 1000
+                    self._sequence += 1
+                    heapq.heappush(self.pending, (monotonic() + delay, self._sequence, key.fileobj, data, address))
+
+            now = monotonic()
+            while self.pending and self.pending[0][0] <= now:
+                _, _, sock, data, address = heapq.heappop(self.pending)
+                try:
+                    sock.sendto(data, address)
+                except OSError:
+                    pass  # The prober gave up and closed its socket
+
+
+def router_chain(relays, seed=1, origin=ORIGIN, scale=0.1, congested=None, congestion=20.0):
+    """
+    Build the routers in front of a fleet: a home gateway and an ISP router shared by every path, then one
+    transit router per country and one router per city. Returns (paths, profiles): the router addresses on the
+    way to each relay address, and a HostProfile for every router and relay, where a router's delay is the
+    round trip to it. The transit router of country `congested` adds `congestion` ms to everything behind it.
+    """
+    profiles = fleet_profiles(relays, seed=seed, origin=origin, scale=scale)
+    gateway, isp = "127.200.0.1", "127.200.0.2"
+    profiles[gateway] = HostProfile(0.5 * scale)
+    profiles[isp] = HostProfile(1.5 * scale)
+    transit, city_routers, paths = {}, {}, {}
+    for relay in relays:
+        country, city, address = relay["country_name"], relay["city_name"], relay["ipv4_addr_in"]
+        extra = congestion if country == congested else 0.0
+        delay = profiles[address].delay
+        if country not in transit:
+            transit[country] = f"127.201.{len(transit) // 250}.{len(transit) % 250 + 1}"
+            profiles[transit[country]] = HostProfile(2.0 * scale + extra)
+        if (country, city) not in city_routers:
+            city_routers[(country, city)] = f"127.202.{len(city_routers) // 250}.{len(city_routers) % 250 + 1}"
+            profiles[city_routers[(country, city)]] = HostProfile(max(delay * 0.9, 2.5 * scale) + extra)
+        profiles[address] = HostProfile(max(delay, 3.0 * scale) + extra, profiles[address].jitter,
+                                        profiles[address].loss)
+        paths[address] = [gateway, isp, transit[country], city_routers[(country, city)]]
+    return paths, profiles
+
+
+class SimulatedRouterChain(SimulatedNetwork):
+    """
+    A SimulatedNetwork whose relays sit behind routers (see router_chain). A TTL-limited probe is answered by
+    the router at that TTL, or by the relay past the end of its path, through that host's loopback responder
+    so its delay, jitter and loss apply. Use `hop_probe` as the hop_function of utils.path_analysis.trace_paths.
+    """
+
+    def __init__(self, paths, profiles, port=DEFAULT_UDP_PORT, seed=1):
+        super().__init__(profiles, port=port, seed=seed)
+        self.paths = paths
+
+    def hop_probe(self, addr, ttl, count, timeout, ipv6=False):
+        path = self.paths.get(addr, [])
+        hop = path[ttl - 1] if ttl <= len(path) else addr
+        return [(hop, rtt, hop == addr) if rtt is not None else (None, None, False)
+                for rtt in udp_probe(hop, count, timeout, port=self.port)]
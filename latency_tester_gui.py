@@ -1,43 +1,108 @@
+from time import perf_counter_ns, time
+STARTUP = perf_counter_ns()  # Taken before the other imports so the time to first paint includes them
 import tkinter as tk
 from tkinter import ttk, messagebox
 import os
 import threading
-import utils.server_distance_utilities as server_distance_utilities  
-from utils.relay_utilities import getRelays, COUNTRY_NAME, CITY_NAME, COUNTRY_CODE, CITY_CODE, PROVIDER, BANDWIDTH, TYPE, WIREGUARD, OPENVPN, BRIDGE
-from utils.ping_utilities import get_latency_for_relays
-
-# Function to load relays and sort countries alphabetically
-def load_dynamic_relays():
-    try:
-        relays = getRelays()
-        if not relays:
-            raise ValueError("No relays data found.")
-        countries = sorted({relay[COUNTRY_NAME] for relay in relays})  # Sort countries alphabetically
-        cities_by_country = {}
-        providers_by_country_city = {}
-
-        for relay in relays:
-            country_name = relay[COUNTRY_NAME]
-            city_name = relay[CITY_NAME]
-            provider_name = relay[PROVIDER]
-            
-            if country_name not in cities_by_country:
-                cities_by_country[country_name] = []
-            if city_name not in cities_by_country[country_name]:
-                cities_by_country[country_name].append(city_name)
-            
-            # Create providers mapping
-            if country_name not in providers_by_country_city:
-                providers_by_country_city[country_name] = {}
-            if city_name not in providers_by_country_city[country_name]:
-                providers_by_country_city[country_name][city_name] = []
-            if provider_name not in providers_by_country_city[country_name][city_name]:
-                providers_by_country_city[country_name][city_name].append(provider_name)
-
-        return relays, countries, cities_by_country, providers_by_country_city
-    except Exception as e:
-        messagebox.showerror("Error", f"Failed to load relays: {e}")
-        return [], [], {}, {}
+from utils.relay_utilities import loadCachedRelays, refreshRelays, diffRelays, MAX_AGE, WIREGUARD, BRIDGE
+from utils.relay_catalog import RelayCatalog, SERVER_TYPES
+from utils.probe_scheduler import adaptive_probe_relays
+from utils.fleet_scan import fleet_probe_relays
+from utils.relay_health import guarded_probe
+from utils.latency_stats import best_result, SCORING_FUNCTIONS, DEFAULT_SCORING
+from utils.latency_history import get_history
+from utils.event_queue import EventQueue
+from utils.progress import emit
+from utils.results_table import ResultsTable
+from utils.tracing import span, record
+
+PUMP_INTERVAL = 50  # Milliseconds between drains of the worker event queue
+MAX_EVENTS_PER_PUMP = 5000  # Events handled per drain, so a flood of results can't freeze the window
+
+# Current location for the distance column; (None, None) once a lookup has failed
+current_location = None
+
+# Worker threads never touch widgets; they queue events that the Tk main loop applies in pump_events
+events = EventQueue()
+
+# Function to apply queued worker events on the Tk main loop, one update per console or table per batch
+def pump_events():
+    pending = {}
+
+    def flush():
+        for target, queued in pending.items():
+            if isinstance(target, ResultsTable):
+                target.apply([event.data["result"] for event in queued])
+            else:
+                target.insert(tk.END, "".join(event.message + "\n" for event in queued))
+                target.see(tk.END)  # Auto-scroll
+        pending.clear()
+
+    batch = events.drain(MAX_EVENTS_PER_PUMP)
+    with span("ui dispatch", events=len(batch)):
+        for target, event in batch:
+            if target is None:
+                flush()  # Keep calls ordered with the messages queued before them
+                function, args = event
+                function(*args)
+            else:
+                pending.setdefault(target, []).append(event)
+        flush()
+    # Come back right away while there is a backlog, otherwise poll at the normal interval
+    root.after(1 if len(batch) == MAX_EVENTS_PER_PUMP else PUMP_INTERVAL, pump_events)
+
+# Function to set the Start/Stop buttons from any thread
+def set_running(running):
+    events.call_soon(start_button.config, {"state": "disabled" if running else "normal"})
+    events.call_soon(stop_button.config, {"state": "normal" if running else "disabled"})
+
+# Function to load the relays on a worker thread: the cached list is shown right away, then replaced by a newer one from the API
+def load_relays_in_background():
+    def load():
+        relays = []
+        try:
+            relays, timestamp = loadCachedRelays()
+            if relays:
+                events.call_soon(set_catalog, RelayCatalog(relays))
+            if timestamp is None or time() - timestamp >= MAX_AGE:
+                events.call_soon(loading_label.config, {"text": "Checking for server updates..." if relays else "Downloading server list..."})
+                fresh, diff = refreshRelays()  # Falls back to the cached relays if the API can't be reached
+                if fresh and (not relays or any(diff.values())):
+                    events.call_soon(set_catalog, RelayCatalog(fresh))
+                relays = relays or fresh
+        except Exception as e:
+            print(f"Failed to load relays: {e}")
+        finally:
+            events.call_soon(finish_loading, bool(relays))
+
+    threading.Thread(target=load, daemon=True).start()
+
+# Function to swap in a newly loaded catalog, keeping the selected country and city if they still exist
+def set_catalog(new_catalog):
+    global catalog
+    catalog = new_catalog
+    country_dropdown.config(values=["Please select"] + catalog.countries(), state="readonly" if len(catalog) else "disabled")
+    if str(stop_button['state']) == 'disabled':  # Not while a scan is running
+        start_button['state'] = 'normal' if len(catalog) else 'disabled'
+
+    selected_city = city_var.get()
+    if country_var.get() != "Please select" and not catalog.country_code(country_var.get()):
+        country_var.set("Please select")
+    update_city_dropdown(None)
+    if selected_city in city_dropdown['values']:
+        city_var.set(selected_city)
+
+# Function to hide the loading indicator once the relays are loaded (or couldn't be)
+def finish_loading(found):
+    loading_bar.stop()
+    loading_frame.grid_remove()
+    if not found:
+        messagebox.showerror("Error", "No relays found. Please update the coordinates or check your connection.")
+
+# Function to record how long the window took to be drawn, shown in traces (run with MULLVAD_TRACE, see utils.tracing)
+def report_first_paint(event=None):
+    root.unbind("<Map>")  # Every widget's <Map> reaches the window's binding; only the first one counts
+    root.after_idle(lambda: record("first paint", STARTUP))
 
 # Function to update city dropdown and select the first city
 def update_city_dropdown(event):
@@ -45,55 +110,19 @@ def update_city_dropdown(event):
     selected_server_type = server_type_var.get()
     
     if selected_country_name != "Please select":
-        cities = cities_by_country[selected_country_name]
+        cities = catalog.cities(selected_country_name)
 
-        # Check if there are any Bridge servers in the selected country
-        bridge_available = any(
-            relay[TYPE] == BRIDGE and relay[COUNTRY_NAME] == selected_country_name for relay in relays
-        )
+        if selected_server_type == "Bridge" and not catalog.has_type(selected_country_name, BRIDGE):
+            messagebox.showinfo("Bridge Not Available", "Bridge servers are not available for the selected country.")
 
-        if selected_server_type == "Bridge":
-            # Filter cities based on Bridge server availability
-            bridge_cities = [
-                city for city in cities 
-                if any(relay[TYPE] == BRIDGE and relay[CITY_NAME] == city for relay in relays if relay[COUNTRY_NAME] == selected_country_name)
-            ]
-            
-            if not bridge_cities:  # If no bridge cities found, show info and disable city dropdown
-                messagebox.showinfo("Bridge Not Available", "Bridge servers are not available for the selected country.")
-                
-                # Disable Bridge option in the server type dropdown and switch to WireGuard/OpenVPN
-                server_type_dropdown.set("WireGuard" if bridge_available else "OpenVPN")
-                
-                # Filter cities based on the new selected server type (WireGuard or OpenVPN)
-                filtered_cities = [
-                    city for city in cities 
-                    if any(relay[TYPE] == server_type_var.get() and relay[CITY_NAME] == city for relay in relays if relay[COUNTRY_NAME] == selected_country_name)
-                ]
-
-                # If no cities for the new type, show all cities
-                cities = filtered_cities if filtered_cities else cities
-                
-                # Update city dropdown and select the first city
-                city_dropdown['state'] = 'readonly'
-                city_dropdown.config(values=cities)
-                if cities:
-                    city_var.set(cities[0])  # Set the first city as selected
-                else:
-                    city_var.set('')
-                    city_dropdown['state'] = 'disabled'
-                    city_dropdown.config(values=[])
-                update_provider_dropdown()
-                return
-            else:
-                cities = bridge_cities  # Use bridge cities if available
+            # Disable Bridge option in the server type dropdown and switch to WireGuard/OpenVPN
+            server_type_dropdown.set("WireGuard" if catalog.has_type(selected_country_name, WIREGUARD) else "OpenVPN")
 
-        # Filter cities based on the selected server type
-        if selected_server_type in [WIREGUARD, OPENVPN]:
-            cities = [
-                city for city in cities 
-                if any(relay[TYPE] == selected_server_type and relay[CITY_NAME] == city for relay in relays if relay[COUNTRY_NAME] == selected_country_name)
-            ]
+            # Filter cities based on the new selected server type; if there are none, show all cities
+            cities = catalog.cities(selected_country_name, SERVER_TYPES[server_type_var.get()]) or cities
+        elif selected_server_type in SERVER_TYPES:
+            # Filter cities based on the selected server type
+            cities = catalog.cities(selected_country_name, SERVER_TYPES[selected_server_type])
 
         city_dropdown['state'] = 'readonly'  # Enable city dropdown
         city_dropdown.config(values=cities)
@@ -120,19 +149,32 @@ def update_provider_dropdown(*args):
             provider_var.set("All Providers")
             provider_dropdown['state'] = 'disabled'
         else:
-            providers = sorted(providers_by_country_city[selected_country_name].get(selected_city_name, []))
+            providers = sorted(catalog.providers(selected_country_name, selected_city_name))
             provider_dropdown.config(values=["All Providers"] + providers)
             provider_var.set("All Providers")  # Set default value to "All Providers"
             provider_dropdown['state'] = 'readonly'  # Enable dropdown if not disabled        
 
 # Function to execute the script as a separate thread
 def run_mulping_thread():
+    # Tk variables and widgets may only be read on the Tk thread, so the settings are read here for the worker
+    settings = {
+        "country_name": country_var.get(),
+        "city_name": city_var.get(),
+        "server_type": server_type_var.get(),
+        "num_pings": num_pings_entry.get(),
+        "timeout": timeout_entry.get(),
+        "provider_filter": provider_var.get(),
+        "min_bandwidth": min_bandwidth_var.get(),
+        "rank_by": rank_by_var.get(),
+        "probe_mode": probe_mode_var.get(),
+        "owned": owned_var.get(),
+    }
     start_button['state'] = 'disabled'  # Disable Start button
     stop_button['state'] = 'normal'     # Enable Stop button
     stop_animation.clear()
     output_text.delete("1.0", tk.END)
     output_text.insert(tk.END, "Starting ping operations...\n")  # Display message in the console
-    threading.Thread(target=run_mulping).start()
+    threading.Thread(target=run_mulping, args=(settings, catalog)).start()
 
 # Function to stop the current operation
 def stop_mulping():
@@ -146,14 +188,23 @@ def update_coordinates_and_relays():
     output_text_closest.delete("1.0", tk.END)  # Clear the closest server console before starting
     output_text_closest.insert(tk.END, "Updating coordinates and relays...\n")
 
+    console = events.sink(output_text_closest)
+
     def update_coordinates_thread():
+        from utils.server_distance_utilities import update_coordinates  # Geocoding is only loaded when needed
         try:
-            relays_data = server_distance_utilities.fetchRelays()  # Use fetchRelays from mulping.py
-            server_distance_utilities.update_coordinates(relays_data, output_text_closest)  # Update coordinates
-            output_text_closest.insert(tk.END, "Coordinates and relays updated successfully.\n")
+            relays_data, _ = refreshRelays()  # Conditional download
+            # Diff against the relays shown, which may be older than the cache; the new catalog is swapped in on the Tk thread
+            current = catalog
+            diff = diffRelays(current.relays, relays_data)
+            emit(console, f"Relays: {len(diff['added'])} added, {len(diff['removed'])} removed, {len(diff['changed'])} changed.")
+            if any(diff.values()):
+                events.call_soon(set_catalog, current.apply_diff(diff))
+            update_coordinates(relays_data, console)  # Update coordinates
+            emit(console, "Coordinates and relays updated successfully.")
         except Exception as e:
-            messagebox.showerror("Error", str(e))
-            output_text_closest.insert(tk.END, f"Error: {str(e)}\n")
+            events.call_soon(messagebox.showerror, "Error", str(e))
+            emit(console, f"Error: {str(e)}")
 
     threading.Thread(target=update_coordinates_thread).start()
 
@@ -162,13 +213,14 @@ def find_closest_servers():
     output_text_closest.delete("1.0", tk.END)  # Clear previous output for closest server
     output_text_closest.insert(tk.END, "Finding the closest servers...\n")
 
+    console = events.sink(output_text_closest)
+
     def display_closest_servers():
         try:
-            result = server_distance_utilities.find_closest_servers(output_text_closest)
-            if result:
-                output_text_closest.insert(tk.END, result)
+            from utils.server_distance_utilities import find_closest_servers
+            find_closest_servers(console)
         except Exception as e:
-            output_text_closest.insert(tk.END, f"Error: {str(e)}\n")
+            emit(console, f"Error: {str(e)}")
 
     threading.Thread(target=display_closest_servers).start()
 
@@ -183,90 +235,126 @@ def update_owned_filter(*args):
         provider_dropdown['state'] = 'readonly'
     update_provider_dropdown()
 
-def run_mulping():
+# Function to get the distance of each relay from the current location, looked up once per session
+def get_relay_distances(relays, output_text=None):
+    from utils.server_distance_utilities import fetch_current_location, calculate_distances
+    global current_location
+    if current_location is None:
+        current_location = fetch_current_location(output_text)
+    if current_location == (None, None):
+        return {}
+    return {hostname: distance for hostname, distance, _ in calculate_distances(current_location, relays, exact=False)}
+
+def run_mulping(settings, catalog):
+    console = events.sink(output_text)  # Everything shown in the console goes through the event queue
+    table = events.sink(results_table)
+
+    # Per-host results go to the console and the results table
+    def progress(event):
+        console(event)
+        if event.kind == "result":
+            table(event)
+
     try:
-        country_name = country_var.get()
-        city_name = city_var.get()
-        server_type = server_type_var.get()  # Get the selected server type
-        num_pings = int(num_pings_entry.get())  # Ensure num_pings is an integer
-        timeout = int(timeout_entry.get())  # Ensure timeout is an integer
-        provider_filter = provider_var.get()
-        min_bandwidth = int(min_bandwidth_var.get())  # Get minimum bandwidth value
+        country_name = settings["country_name"]
+        city_name = settings["city_name"]
+        server_type = settings["server_type"]  # Get the selected server type
+        num_pings = int(settings["num_pings"])  # Ensure num_pings is an integer
+        timeout = int(float(settings["timeout"]) * 1000)  # Timeout is entered in seconds, probes take milliseconds
+        provider_filter = settings["provider_filter"]
+        min_bandwidth = int(settings["min_bandwidth"])  # Get minimum bandwidth value
+        rank_by = settings["rank_by"]  # Scoring function used to pick the best server
+        probe_mode = settings["probe_mode"]  # Exhaustive, Adaptive, Fleet or Stale Only
 
         # Use the value from owned_var to filter for Mullvad-owned servers
-        owned_filter = owned_var.get() == "True"
+        owned_filter = settings["owned"] == "True"
 
         if not country_name or country_name == "Please select" or not city_name:
-            messagebox.showerror("Error", "Please select a country and a city.")
+            events.call_soon(messagebox.showerror, "Error", "Please select a country and a city.")
             return
 
-        country_code = next((relay[COUNTRY_CODE] for relay in relays if relay[COUNTRY_NAME] == country_name), None)
-        city_code = next((relay[CITY_CODE] for relay in relays if relay[CITY_NAME] == city_name and relay[COUNTRY_NAME] == country_name), None)
-
-        if not country_code or not city_code:
-            messagebox.showerror("Error", "Failed to get country or city code.")
+        if not catalog.country_code(country_name) or not catalog.city_code(country_name, city_name):
+            events.call_soon(messagebox.showerror, "Error", "Failed to get country or city code.")
             return
 
-        # Filter relays by selected country and city
-        selected_relays = [relay for relay in relays if relay[COUNTRY_CODE] == country_code and relay[CITY_CODE] == city_code]
-
-        # Filter relays further by server type (WireGuard, OpenVPN, or Bridge)
-        if server_type == "WireGuard":
-            selected_relays = [relay for relay in selected_relays if relay.get(TYPE) == WIREGUARD]
-        elif server_type == "OpenVPN":
-            selected_relays = [relay for relay in selected_relays if relay.get(TYPE) == OPENVPN]
-        elif server_type == "Bridge":
-            selected_relays = [relay for relay in selected_relays if relay.get(TYPE) == BRIDGE]
+        # Filter relays by selected country, city, server type, provider, Mullvad ownership and minimum bandwidth
+        selected_relays = catalog.query(
+            country=country_name,
+            city=city_name,
+            relay_type=SERVER_TYPES.get(server_type),
+            # Filter by provider if a specific provider is selected and owned_var is not True
+            provider=provider_filter if provider_filter != "All Providers" and not owned_filter else None,
+            owned=True if owned_filter else None,
+            min_bandwidth=min_bandwidth,
+        )
 
-        # Filter by provider if a specific provider is selected and owned_var is not True
-        if provider_filter != "All Providers" and not owned_filter:
-            selected_relays = [relay for relay in selected_relays if relay.get(PROVIDER) == provider_filter]
+        if not selected_relays:
+            events.call_soon(messagebox.showerror, "Error", f"No servers found for {country_name} - {city_name} with type {server_type}, provider {provider_filter}, and minimum bandwidth {min_bandwidth} Mbps.")
+            return
 
-        # Filter by Mullvad-owned servers if the owned_var is True
-        if owned_filter:
-            selected_relays = [relay for relay in selected_relays if relay.get("owned")]
+        # Show what earlier runs already know about these servers
+        history = get_history()
+        cached_best = history.best([relay["hostname"] for relay in selected_relays])
+        if cached_best is not None:
+            emit(console, f"Cached best: {cached_best.hostname} (~{cached_best.latency:.2f} ms, {cached_best.loss:.0f}% loss)")
 
-        # Filter by minimum bandwidth
-        selected_relays = [relay for relay in selected_relays if relay.get(BANDWIDTH, 0) >= min_bandwidth]
+        # In Stale Only mode, servers with recent and consistent history are not probed again
+        if probe_mode == "Stale Only":
+            relays_to_probe = history.stale_relays(selected_relays)
+            emit(console, f"{len(selected_relays) - len(relays_to_probe)} server(s) answered from history.")
+        else:
+            relays_to_probe = selected_relays
 
-        if not selected_relays:
-            messagebox.showerror("Error", f"No servers found for {country_name} - {city_name} with type {server_type}, provider {provider_filter}, and minimum bandwidth {min_bandwidth} Mbps.")
-            return
+        emit(console, f"Starting {num_pings} ping iterations for each server...")
+        events.call_soon(results_table.start, relays_to_probe, get_relay_distances(relays_to_probe, console), SCORING_FUNCTIONS[rank_by])
 
-        output_text.insert(tk.END, f"Starting {num_pings} ping iterations for each server...\n")
-        output_text.see(tk.END)  # Auto-scroll
-        output_text.update_idletasks()  # Ensure the GUI updates
+        # Probe every server that isn't known to be down, keeping all round-trip samples, and update GUI console
+        if probe_mode == "Adaptive":
+            results = guarded_probe(relays_to_probe, count=num_pings, timeout=timeout, output_text=progress, stop_animation=stop_animation, probe_function=adaptive_probe_relays)
+        elif probe_mode == "Fleet":
+            results = guarded_probe(relays_to_probe, count=num_pings, timeout=timeout, output_text=progress, stop_animation=stop_animation, probe_function=fleet_probe_relays)
+        else:
+            results = guarded_probe(relays_to_probe, count=num_pings, timeout=timeout, output_text=progress, stop_animation=stop_animation)
+        history.record_results(results.values())
 
-        # Use the refactored function to get latency values for each server and update GUI console
-        server_latencies = get_latency_for_relays(selected_relays, count=num_pings, timeout=timeout, output_text=output_text, stop_animation=stop_animation)
+        if probe_mode == "Stale Only":
+            best = history.best([relay["hostname"] for relay in selected_relays])
+            if best is not None and not stop_animation.is_set():
+                final_message = "\n" + "#" * 40 + "\n"
+                final_message += "#{:^38}#\n".format("Best Server from History")
+                final_message += "#{:^38}#\n".format(f"Server: {best.hostname}")
+                final_message += "#{:^38}#\n".format(f"Estimated Latency: {best.latency:.3f} ms")
+                final_message += "#{:^38}#\n".format(f"Loss: {best.loss:.0f}%")
+                final_message += "#" * 40 + "\n"
+                final_message += "\nDONE!"
+                emit(console, final_message)
+            elif best is None:
+                emit(console, "\nNo server latency information found.")
+            return
 
-        if server_latencies:
-            # Find the server with the lowest latency
-            best_server = min(server_latencies, key=server_latencies.get)
-            average_latency = server_latencies[best_server]
+        best = best_result(results.values(), score=SCORING_FUNCTIONS[rank_by])
+        if best is not None and best.stats().received:
+            stats = best.stats()
 
             # Format and display the final message only if not stopped
             if not stop_animation.is_set():
                 final_message = "\n" + "#" * 40 + "\n"
-                final_message += "#{:^38}#\n".format("Best Server Based on Average Latency")
-                final_message += "#{:^38}#\n".format(f"Server: {best_server}")
-                final_message += "#{:^38}#\n".format(f"Average Latency: {average_latency:.3f} ms")
+                final_message += "#{:^38}#\n".format(f"Best Server by {rank_by}")
+                final_message += "#{:^38}#\n".format(f"Server: {best.hostname}")
+                final_message += "#{:^38}#\n".format(f"Average Latency: {stats.mean:.3f} ms")
+                final_message += "#{:^38}#\n".format(f"Median: {stats.median:.3f} ms, p90: {stats.p90:.3f} ms")
+                final_message += "#{:^38}#\n".format(f"Jitter: {stats.jitter:.3f} ms, Loss: {stats.loss:.0f}%")
                 final_message += "#" * 40 + "\n"
-                final_message += "\nDONE!\n"
-                output_text.insert(tk.END, final_message)
-                output_text.see(tk.END)  # Auto-scroll
-                output_text.update_idletasks()  # Ensure the GUI updates
+                final_message += "\nDONE!"
+                emit(console, final_message)
         else:
-            output_text.insert(tk.END, "\nNo server latency information found.\n")
-            output_text.see(tk.END)  # Auto-scroll
-            output_text.update_idletasks()  # Ensure the GUI updates
+            emit(console, "\nNo server latency information found.")
 
     except Exception as e:
-        messagebox.showerror("Error", str(e))
+        events.call_soon(messagebox.showerror, "Error", str(e))
     finally:
         stop_animation.set()
-        stop_button['state'] = 'disabled'  # Disable Stop button
-        start_button['state'] = 'normal'   # Enable Start button
+        set_running(False)  # Re-enable Start and disable Stop once the queued output is shown
 
 
 
@@ -294,11 +382,8 @@ country_var = tk.StringVar(value="Please select")  # Initialize with "Please sel
 city_var = tk.StringVar()
 server_type_var = tk.StringVar(value="WireGuard")  # Default to WireGuard
 
-# Load current relays
-relays, countries, cities_by_country, providers_by_country_city = load_dynamic_relays()
-if not relays:
-    messagebox.showerror("Error", "No relays found. Please update the coordinates or check your connection.")
-    root.destroy()  # Exit the program if no relays are found
+# Relays are loaded in the background once the window is up; the filters stay disabled until then
+catalog = RelayCatalog([])
 
 # --- Latency Test Tab ---
 # Define padding for consistent spacing
@@ -307,7 +392,7 @@ default_pady = 5
 
 # Dropdown menus for country and city selection
 ttk.Label(frame_main, text="Select Country:").grid(row=0, column=0, sticky="e", padx=default_padx, pady=default_pady)
-country_dropdown = ttk.Combobox(frame_main, textvariable=country_var, values=["Please select"] + list(countries), state="readonly")
+country_dropdown = ttk.Combobox(frame_main, textvariable=country_var, values=["Please select"], state="disabled")  # Enabled once the relays are loaded
 country_dropdown.grid(row=0, column=1, sticky="ew", padx=default_padx, pady=default_pady)
 country_dropdown.bind("<<ComboboxSelected>>", update_city_dropdown)  # Bind event to update cities
 
@@ -351,30 +436,58 @@ ttk.Label(frame_main, text="Min. Bandwidth (Gbps):").grid(row=7, column=0, stick
 min_bandwidth_entry = ttk.Entry(frame_main, textvariable=min_bandwidth_var)
 min_bandwidth_entry.grid(row=7, column=1, sticky="ew", padx=default_padx, pady=default_pady)
 
+# Dropdown for the scoring function used to rank servers
+rank_by_var = tk.StringVar(value=DEFAULT_SCORING)
+ttk.Label(frame_main, text="Rank By:").grid(row=8, column=0, sticky="e", padx=default_padx, pady=default_pady)
+rank_by_dropdown = ttk.Combobox(frame_main, textvariable=rank_by_var, values=list(SCORING_FUNCTIONS), state="readonly")
+rank_by_dropdown.grid(row=8, column=1, sticky="ew", padx=default_padx, pady=default_pady)
+
+# Dropdown for the probe mode: every server gets all pings, only those that can still win, all pings from one socket, or only those without recent history
+probe_mode_var = tk.StringVar(value="Exhaustive")
+ttk.Label(frame_main, text="Probe Mode:").grid(row=9, column=0, sticky="e", padx=default_padx, pady=default_pady)
+probe_mode_dropdown = ttk.Combobox(frame_main, textvariable=probe_mode_var, values=["Exhaustive", "Adaptive", "Fleet", "Stale Only"], state="readonly")
+probe_mode_dropdown.grid(row=9, column=1, sticky="ew", padx=default_padx, pady=default_pady)
+
+# Results table, kept sorted by the selected scoring function while results arrive (click a heading to sort)
+results_table = ResultsTable(frame_main)
+results_table.grid(row=10, column=0, columnspan=2, sticky="nsew", padx=default_padx, pady=default_pady)
+results_scrollbar = ttk.Scrollbar(frame_main, orient="vertical", command=results_table.tree.yview)
+results_scrollbar.grid(row=10, column=2, sticky="ns")
+results_table.tree["yscrollcommand"] = results_scrollbar.set
+
 # Output text field for main tab
-output_text = tk.Text(frame_main, wrap=tk.WORD, height=15, width=50)
-output_text.grid(row=8, column=0, columnspan=3, padx=default_padx, pady=default_pady)
+output_text = tk.Text(frame_main, wrap=tk.WORD, height=8, width=50)
+output_text.grid(row=11, column=0, columnspan=3, sticky="ew", padx=default_padx, pady=default_pady)
 
 # Output text field for main tab (disable user input)
-output_text = tk.Text(frame_main, wrap=tk.WORD, height=15, width=50, state="normal")  
-output_text.grid(row=8, column=0, columnspan=3, padx=default_padx, pady=default_pady)
+output_text = tk.Text(frame_main, wrap=tk.WORD, height=8, width=50, state="normal")  
+output_text.grid(row=11, column=0, columnspan=3, sticky="ew", padx=default_padx, pady=default_pady)
 
 # Scrollbar for the text field in the main tab
 scrollbar = ttk.Scrollbar(frame_main, orient="vertical", command=output_text.yview)
-scrollbar.grid(row=8, column=2, sticky="ns")
+scrollbar.grid(row=11, column=2, sticky="ns")
 output_text["yscrollcommand"] = scrollbar.set
 
 # Frame for Start and Stop buttons
 button_frame = ttk.Frame(frame_main)
-button_frame.grid(row=9, column=0, columnspan=3, pady=default_pady)  # Center the button frame
+button_frame.grid(row=12, column=0, columnspan=3, pady=default_pady)  # Center the button frame
 
 # Add Start and Stop buttons inside the button frame, closer together
-start_button = ttk.Button(button_frame, text="Start", command=run_mulping_thread)
+start_button = ttk.Button(button_frame, text="Start", command=run_mulping_thread, state='disabled')  # Enabled once the relays are loaded
 start_button.pack(side="left", padx=(default_padx, 5), pady=default_pady)
 
 stop_button = ttk.Button(button_frame, text="Stop", command=stop_mulping, state='disabled')
 stop_button.pack(side="left", padx=(5, default_padx), pady=default_pady)
 
+# Loading indicator, shown until the relays are loaded
+loading_frame = ttk.Frame(frame_main)
+loading_frame.grid(row=13, column=0, columnspan=3, pady=default_pady)
+loading_label = ttk.Label(loading_frame, text="Loading servers...")
+loading_label.pack(side="left", padx=(default_padx, 5))
+loading_bar = ttk.Progressbar(loading_frame, mode="indeterminate", length=150)
+loading_bar.pack(side="left", padx=(5, default_padx))
+loading_bar.start(10)
+
 
 
 # --- Closest Server Tab ---
@@ -397,5 +510,12 @@ update_button.grid(row=0, column=1, padx=5)
 # Animation stop flag
 stop_animation = threading.Event()
 
+# Apply worker output on the main loop
+root.after(PUMP_INTERVAL, pump_events)
+
+# Load the relays once the window is up
+root.bind("<Map>", report_first_paint)
+load_relays_in_background()
+
 # Start the GUI main loop
 root.mainloop()
@@ -0,0 +1,3 @@
+"""Headless API for the Mullvad latency tester; see mullvad_latency.cli for the command line."""
+from mullvad_latency.api import load_catalog, refresh, scan, matrix, paths, closest, MODES
+from utils.progress import ProgressEvent
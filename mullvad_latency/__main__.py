@@ -0,0 +1,4 @@
+from mullvad_latency.cli import main
+
+if __name__ == "__main__":
+    main()
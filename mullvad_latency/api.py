@@ -0,0 +1,276 @@
+"""
+Library entry points for scanning Mullvad relays without the GUI.
+Progress is reported through an optional `progress(event)` callback receiving utils.progress.ProgressEvent
+objects; nothing here imports tkinter, and requests/geopy are only imported when a network call needs them.
+The monitor, multi-vantage and path analysis modules are imported by the entry points that use them, so a plain
+scan starts without loading their servers and clients.
+"""
+import threading
+from utils.relay_utilities import (getRelays, refreshRelays, HOSTNAME, IPV4, IPV6, COUNTRY_NAME, CITY_NAME,
+                                   PROVIDER, WIREGUARD)
+from utils.relay_catalog import RelayCatalog
+from utils.ping_utilities import probe_relays
+from utils.probe_scheduler import adaptive_probe_relays
+from utils.fleet_scan import fleet_probe_relays
+from utils.relay_health import guarded_probe
+from utils.dual_stack import probe_dual_stack, preferred_family, FAMILIES as IP_FAMILIES, BEST
+from utils.latency_stats import score_balanced, score_result
+from utils.latency_history import get_history
+from utils.progress import emit
+from utils.tracing import span
+
+MODES = ("exhaustive", "adaptive", "stale", "fleet")
+FAMILIES = IP_FAMILIES + ("dual",)
+PREFERENCES = (BEST,) + IP_FAMILIES
+STAT_FIELDS = ("sent", "received", "loss", "min", "mean", "median", "p90", "p99", "stddev", "jitter")
+
+
+def load_catalog():
+    """Load the relay list (cache, snapshot or API) and index it."""
+    relays = getRelays()
+    if not relays:
+        raise RuntimeError("No relays data found.")
+    return RelayCatalog(relays)
+
+
+def _row(relay, **fields):
+    """Flat result row for JSON/CSV output: relay identity first, then the measurement fields."""
+    row = {
+        "hostname": relay[HOSTNAME],
+        "ip": relay.get(IPV4),
+        "country": relay.get(COUNTRY_NAME),
+        "city": relay.get(CITY_NAME),
+        "provider": relay.get(PROVIDER),
+    }
+    row.update(fields)
+    return row
+
+
+def _stats_fields(result):
+    if result is None:
+        return dict.fromkeys(STAT_FIELDS)
+    stats = result.stats().as_dict()
+    return {name: stats[name] for name in STAT_FIELDS}
+
+
+def _family_fields(families):
+    """Median and loss of each address family of a dual-stack result, so both RTTs appear in every row."""
+    fields = {}
+    for family in IP_FAMILIES:
+        stats = families[family].stats() if family in families else None
+        fields[f"{family}_median"] = stats.median if stats is not None and stats.received else None
+        fields[f"{family}_loss"] = stats.loss if stats is not None else None
+    return fields
+
+
+def refresh(progress=None, coordinates=False):
+    """
+    Revalidate the relay cache with the API. With `coordinates`, also geocode cities missing from coordinates.json.
+    Returns a summary dict with the relay count and the added/removed/changed hostnames.
+    """
+    relays, diff = refreshRelays()
+    summary = {"relays": len(relays)}
+    summary.update({change: [relay[HOSTNAME] for relay in changed] for change, changed in diff.items()})
+    emit(progress, f"Relays: {len(diff['added'])} added, {len(diff['removed'])} removed, {len(diff['changed'])} changed.",
+         kind="diff", diff=diff)
+    if coordinates:
+        from utils.server_distance_utilities import update_coordinates
+        update_coordinates(relays, progress)
+    return summary
+
+
+def scan(country=None, city=None, relay_type=WIREGUARD, provider=None, owned=None, min_bandwidth=0, count=5,
+         timeout=1000, mode="exhaustive", score=score_balanced, progress=None, stop_event=None, catalog=None,
+         family="ipv4", prefer=BEST):
+    """
+    Probe the relays matching the filters (see RelayCatalog.query) and return result rows ranked by `score`.
+    `mode` is "exhaustive" (every relay gets `count` probes), "adaptive" (successive elimination),
+    "stale" (relays with recent history are answered from it) or "fleet" (every relay gets `count` ICMP echo
+    requests from a single socket, see utils.fleet_scan). Results are recorded in the latency history.
+    `family` is "ipv4", "ipv6" or "dual"; a dual-stack scan probes both addresses of every relay at once
+    (see utils.dual_stack), reports both RTTs and ranks each relay by `prefer`: "best", "ipv4" or "ipv6".
+    The history is kept per family, so a dual-stack scan records the samples of each family separately.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode {mode!r}, expected one of {', '.join(MODES)}")
+    if family not in FAMILIES:
+        raise ValueError(f"Unknown address family {family!r}, expected one of {', '.join(FAMILIES)}")
+    if prefer not in PREFERENCES:
+        raise ValueError(f"Unknown family preference {prefer!r}, expected one of {', '.join(PREFERENCES)}")
+    if family == "dual" and mode in ("adaptive", "fleet"):
+        raise ValueError(f"{mode.capitalize()} mode probes a single address family; "
+                         "use exhaustive or stale with --family dual")
+    catalog = catalog or load_catalog()
+    relays = catalog.query(country=country, city=city, relay_type=relay_type, provider=provider, owned=owned,
+                           min_bandwidth=min_bandwidth)
+    if not relays:
+        raise ValueError("No servers match the given filters.")
+
+    history = get_history()
+    stop_event = stop_event or threading.Event()
+    families = IP_FAMILIES if family == "dual" else (family,)
+    to_probe = relays
+    if mode == "stale":
+        # History is kept per family; a dual-stack relay is probed again when either of its families is stale
+        stale = {relay[HOSTNAME] for name in families for relay in history.stale_relays(relays, family=name)}
+        to_probe = [relay for relay in relays if relay[HOSTNAME] in stale]
+    emit(progress, f"Probing {len(to_probe)} of {len(relays)} server(s), {count} ping(s) each...")
+    dual = {}
+    with span("scan", mode=mode, family=family, relays=len(to_probe)):
+        if family == "dual":
+            dual = guarded_probe(to_probe, count=count, timeout=timeout, output_text=progress,
+                                 stop_animation=stop_event, probe_function=probe_dual_stack, family="dual")
+            chosen = {hostname: preferred_family(probed, prefer, score) for hostname, probed in dual.items()}
+            results = {hostname: result for hostname, (_, result) in chosen.items() if result is not None}
+            for name in families:
+                history.record_results([probed[name] for probed in dual.values() if name in probed], family=name)
+        else:
+            probe_function = {"adaptive": adaptive_probe_relays, "fleet": fleet_probe_relays}.get(mode, probe_relays)
+            results = guarded_probe(to_probe, count=count, timeout=timeout, output_text=progress,
+                                    stop_animation=stop_event, family=family, probe_function=probe_function)
+            history.record_results(results.values(), family=family)
+
+    rows = []
+    estimates = {}  # Hostname -> (family, Estimate) of the relays answered from history
+    if mode == "stale":
+        for name in ((prefer,) if family == "dual" and prefer != BEST else families):
+            for hostname, estimate in history.estimates([relay[HOSTNAME] for relay in relays], family=name).items():
+                if hostname not in estimates or estimate.score < estimates[hostname][1].score:
+                    estimates[hostname] = (name, estimate)
+    for relay in relays:
+        result = results.get(relay[HOSTNAME])
+        if relay[HOSTNAME] in dual:
+            chosen_family, result = chosen[relay[HOSTNAME]]
+            rows.append(_row(relay, ip=result.ip if result else None, source="probe", family=chosen_family,
+                             score=score_result(result, score) if result else float('inf'),
+                             **_stats_fields(result), **_family_fields(dual[relay[HOSTNAME]])))
+        elif result is not None:
+            rows.append(_row(relay, ip=result.ip, source="probe", score=score_result(result, score),
+                             **_stats_fields(result)))
+        elif relay[HOSTNAME] in estimates:
+            estimated_family, estimate = estimates[relay[HOSTNAME]]
+            fields = dict.fromkeys(STAT_FIELDS)
+            fields.update(mean=estimate.latency, loss=estimate.loss)
+            if family == "dual":
+                fields.update(family=estimated_family, **_family_fields({}))
+            rows.append(_row(relay, source="history", score=estimate.score, **fields))
+    rows.sort(key=lambda row: row["score"])
+    return rows
+
+
+def monitor(country=None, city=None, relay_type=WIREGUARD, provider=None, owned=None, min_bandwidth=0, duration=None,
+            score=score_balanced, progress=None, stop_event=None, catalog=None, **options):
+    """
+    Keep re-probing the relays matching the filters until `stop_event` is set or `duration` seconds pass,
+    reporting "best_changed" events through `progress`. `options` are passed to utils.monitor.Monitor
+    (interval, rate, window, hysteresis, ...). Returns the final rolling-window rows, best first.
+    """
+    catalog = catalog or load_catalog()
+    relays = catalog.query(country=country, city=city, relay_type=relay_type, provider=provider, owned=owned,
+                           min_bandwidth=min_bandwidth)
+    if not relays:
+        raise ValueError("No servers match the given filters.")
+    from utils.monitor import Monitor
+    by_hostname = {relay[HOSTNAME]: relay for relay in relays}
+    emit(progress, f"Monitoring {len(relays)} server(s)...")
+    results = Monitor(relays, score=score, output_text=progress, **options).run(stop_event or threading.Event(), duration)
+    return [_row(by_hostname[result.hostname], source="monitor", score=score_result(result, score), **_stats_fields(result))
+            for result in results]
+
+
+def matrix(agents, country=None, city=None, relay_type=WIREGUARD, provider=None, owned=None, min_bandwidth=0,
+           count=5, timeout=1000, family="ipv4", score=score_balanced, progress=None, catalog=None, token=None):
+    """
+    Probe the relays matching the filters from every vantage point, through the agents at the given URLs
+    (see utils.distributed, `token` is sent to agents that require one), and return one row per relay with
+    the median, loss and score seen from each vantage.
+    Rows are ranked by their worst score across vantages, so the first relay is the best compromise for all sites.
+    """
+    if family not in IP_FAMILIES:
+        raise ValueError(f"Unknown address family {family!r}, expected one of {', '.join(IP_FAMILIES)}")
+    catalog = catalog or load_catalog()
+    relays = catalog.query(country=country, city=city, relay_type=relay_type, provider=provider, owned=owned,
+                           min_bandwidth=min_bandwidth)
+    if not relays:
+        raise ValueError("No servers match the given filters.")
+
+    from utils.distributed import Coordinator
+    coordinator = Coordinator(agents, output_text=progress, token=token)
+    emit(progress, f"Probing {len(relays)} server(s) from {len(agents)} agent(s), {count} ping(s) each...")
+    with span("matrix", agents=len(agents), relays=len(relays)):
+        results = coordinator.scan(relays, count=count, timeout=timeout, family=family)
+    vantages = sorted(set(coordinator.vantages.values()))
+
+    rows = []
+    for relay in relays:
+        by_vantage = results.get(relay[HOSTNAME], {})
+        fields, scores = {}, []
+        for vantage in vantages:
+            result = by_vantage.get(vantage)
+            stats = result.stats() if result is not None else None
+            fields[f"{vantage}_median"] = stats.median if stats is not None and stats.received else None
+            fields[f"{vantage}_loss"] = stats.loss if stats is not None else None
+            scores.append(score_result(result, score) if result is not None else float('inf'))
+        rows.append(_row(relay, source="agents", worst_score=max(scores, default=float('inf')), **fields))
+    rows.sort(key=lambda row: row["worst_score"])
+    return rows
+
+
+def paths(country=None, city=None, relay_type=WIREGUARD, provider=None, owned=None, min_bandwidth=0, count=1,
+          timeout=1000, max_hops=None, family="ipv4", progress=None, stop_event=None, catalog=None):
+    """
+    Trace the network paths to the relays matching the filters (see utils.path_analysis) and return one row per
+    hop of the merged hop tree, depth first: its median RTT, the latency its incoming segment adds and how many
+    relays are behind it. The tree and the shared hops adding the most latency are reported through `progress`.
+    `max_hops` defaults to utils.path_analysis.DEFAULT_MAX_HOPS.
+    """
+    if family not in IP_FAMILIES:
+        raise ValueError(f"Unknown address family {family!r}, expected one of {', '.join(IP_FAMILIES)}")
+    catalog = catalog or load_catalog()
+    relays = catalog.query(country=country, city=city, relay_type=relay_type, provider=provider, owned=owned,
+                           min_bandwidth=min_bandwidth)
+    if not relays:
+        raise ValueError("No servers match the given filters.")
+
+    from utils.path_analysis import trace_paths, DEFAULT_MAX_HOPS
+    max_hops = DEFAULT_MAX_HOPS if max_hops is None else max_hops
+    emit(progress, f"Tracing the paths to {len(relays)} server(s), up to {max_hops} hops...")
+    with span("paths", relays=len(relays), max_hops=max_hops):
+        tree = trace_paths(relays, count=count, timeout=timeout, max_hops=max_hops, family=family,
+                           output_text=progress, stop_animation=stop_event)
+    emit(progress, "\n".join(tree.render()))
+    emit(progress, f"{tree.probes} probes sent.")
+    for node in tree.bottlenecks():
+        emit(progress, f"Hop {node.ttl} ({node.address}) adds {node.segment:.2f} ms for {len(node.destinations)} server(s).")
+
+    hostnames = {relay.get(IPV6 if family == "ipv6" else IPV4): relay[HOSTNAME] for relay in relays}
+    rows = []
+    for node in tree.nodes():
+        stats = node.result.stats()
+        rows.append({
+            "ttl": node.ttl,
+            "hop": node.address,
+            "parent": node.parent.address if node.parent is not tree.root else None,
+            "server": hostnames.get(node.address),
+            "median": node.median,
+            "segment_ms": node.segment,
+            "loss": stats.loss if stats.sent else None,
+            "servers": len(node.destinations),
+        })
+    return rows
+
+
+def closest(location=None, top_k=10, count=1, timeout=1000, progress=None, stop_event=None):
+    """
+    Probe the `top_k` relays predicted to be fastest from `location` (lat, lon), by default the location
+    reported by Mullvad's API for this connection. Returns rows in predicted order.
+    """
+    from utils.server_distance_utilities import fetch_current_location, probe_closest_servers
+    if location is None:
+        location = fetch_current_location(progress)
+        if location == (None, None):
+            raise RuntimeError("Could not get current location.")
+    closest_servers = probe_closest_servers(location, getRelays(), top_k=top_k, count=count, timeout=timeout,
+                                            output_text=progress, stop_animation=stop_event)
+    return [_row(relay, source="probe", distance_km=distance, predicted_ms=predicted, **_stats_fields(result))
+            for relay, distance, predicted, result in closest_servers]
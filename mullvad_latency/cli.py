@@ -0,0 +1,237 @@
+"""
+Command line interface:
+
+    python -m mullvad_latency scan --country Sweden --city Gothenburg [--mode adaptive] [--format csv]
+    python -m mullvad_latency scan --country Sweden --family dual [--prefer ipv6]
+    python -m mullvad_latency closest [--top-k 10] [--location 52.52,13.405]
+    python -m mullvad_latency refresh [--coordinates]
+    python -m mullvad_latency monitor --country Sweden [--interval 30] [--rate 10] [--duration 3600]
+    python -m mullvad_latency paths --country Sweden --city Gothenburg [--max-hops 20]
+    python -m mullvad_latency agent --vantage stockholm [--host 0.0.0.0] [--port 8765] [--token SECRET]
+    python -m mullvad_latency matrix --agent http://10.0.0.5:8765 --agent http://10.0.1.7:8765 --country Sweden
+
+Results go to stdout (or --output) as JSON or CSV; progress messages go to stderr.
+monitor also writes one JSON line to stdout each time the best relay changes.
+"""
+import os
+import sys
+import socket
+import csv
+import json
+import math
+import argparse
+import contextlib
+from mullvad_latency import api
+from utils.relay_utilities import WIREGUARD, OPENVPN, BRIDGE
+from utils.ping_utilities import PROBE_BACKENDS, set_probe_backend
+from utils.latency_stats import score_mean, score_median, score_p90, score_balanced
+from utils.ping_utilities import DEFAULT_MAX_WORKERS
+from utils import tracing
+
+TOKEN_VARIABLE = "MULLVAD_LATENCY_AGENT_TOKEN"  # Default agent token, kept out of the process list
+RELAY_TYPES = {"wireguard": WIREGUARD, "openvpn": OPENVPN, "bridge": BRIDGE}
+SCORES = {"mean": score_mean, "median": score_median, "p90": score_p90, "balanced": score_balanced}
+MONITOR_OPTIONS = ("interval", "priority_interval", "rate", "hysteresis")  # Passed to utils.monitor.Monitor when set
+
+
+def parse_location(value):
+    try:
+        lat, lon = (float(part) for part in value.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected LAT,LON")
+    return lat, lon
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="mullvad_latency", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", choices=("json", "csv"), default="json", help="output format (default: json)")
+    parser.add_argument("--output", help="write results to this file instead of stdout")
+    parser.add_argument("-q", "--quiet", action="store_true", help="don't print progress to stderr")
+    parser.add_argument("--backend", choices=["auto"] + list(PROBE_BACKENDS), default="auto",
+                        help="probe backend (default: auto)")
+    parser.add_argument("--trace", metavar="FILE", help="write a Chrome trace of the run (and FILE.summary.json)")
+    parser.add_argument("--profile", metavar="FILE", help="run under cProfile and write the stats to FILE")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_filters(command, count):
+        command.add_argument("--country", help="country name, e.g. Sweden")
+        command.add_argument("--city", help="city name, requires --country")
+        command.add_argument("--type", choices=list(RELAY_TYPES), default="wireguard", help="server type")
+        command.add_argument("--provider", help="hosting provider")
+        command.add_argument("--owned", action="store_true", help="only Mullvad-owned servers")
+        command.add_argument("--min-bandwidth", type=int, default=0, help="minimum port speed in Gbps")
+        command.add_argument("--count", type=int, default=count, help="pings per server")
+        command.add_argument("--timeout", type=int, default=1000, help="timeout per ping in ms")
+        command.add_argument("--rank-by", choices=list(SCORES), default="balanced", help="scoring function")
+
+    scan = commands.add_parser("scan", help="probe the relays matching the filters and rank them")
+    add_filters(scan, count=5)
+    scan.add_argument("--mode", choices=api.MODES, default="exhaustive", help="probe mode")
+    scan.add_argument("--family", choices=api.FAMILIES, default="ipv4",
+                      help="address family to probe; dual probes IPv4 and IPv6 side by side (default: ipv4)")
+    scan.add_argument("--prefer", choices=api.PREFERENCES, default="best",
+                      help="family a dual-stack scan ranks by (default: best, whichever is faster)")
+
+    monitor = commands.add_parser("monitor", help="keep re-probing the matching relays and report best changes")
+    add_filters(monitor, count=1)
+    monitor.add_argument("--duration", type=float, help="stop after this many seconds (default: until Ctrl+C)")
+    # Options left unset take utils.monitor's defaults, so the monitor module is only loaded by this command
+    monitor.add_argument("--interval", type=float, help="seconds between probes of a server")
+    monitor.add_argument("--priority-interval", type=float, help="seconds between probes of the top servers")
+    monitor.add_argument("--rate", type=float, help="packets per second for all servers")
+    monitor.add_argument("--hysteresis", type=float, help="fraction by which a new best must beat the current one")
+    monitor.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port at /metrics")
+    monitor.add_argument("--metrics-host", default="127.0.0.1", help="address for the metrics endpoint")
+
+    closest = commands.add_parser("closest", help="probe the relays predicted to be fastest from here")
+    closest.add_argument("--location", type=parse_location, help="LAT,LON instead of the detected location")
+    closest.add_argument("--top-k", type=int, default=10, help="number of servers to probe")
+    closest.add_argument("--count", type=int, default=1, help="pings per server")
+    closest.add_argument("--timeout", type=int, default=1000, help="timeout per ping in ms")
+
+    matrix = commands.add_parser("matrix", help="probe the matching relays from several agents and merge the results")
+    add_filters(matrix, count=5)
+    matrix.add_argument("--agent", action="append", required=True, metavar="URL",
+                        help="base URL of an agent, e.g. http://10.0.0.5:8765 (repeat for each agent)")
+    matrix.add_argument("--family", choices=("ipv4", "ipv6"), default="ipv4", help="address family to probe")
+    matrix.add_argument("--token", default=os.environ.get(TOKEN_VARIABLE),
+                        help=f"token the agents require (default: ${TOKEN_VARIABLE})")
+
+    paths = commands.add_parser("paths", help="trace the network paths to the matching relays to find slow hops")
+    add_filters(paths, count=1)
+    paths.add_argument("--max-hops", type=int, help="highest TTL probed")
+    paths.add_argument("--family", choices=("ipv4", "ipv6"), default="ipv4", help="address family to trace")
+
+    agent = commands.add_parser("agent", help="serve probes for a matrix coordinator")
+    agent.add_argument("--vantage", default=socket.gethostname(), help="name of this site (default: host name)")
+    agent.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    agent.add_argument("--port", type=int, help="port to listen on")
+    agent.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS, help="probes in flight at once")
+    agent.add_argument("--token", default=os.environ.get(TOKEN_VARIABLE),
+                       help=f"token coordinators must send (default: ${TOKEN_VARIABLE})")
+
+    refresh = commands.add_parser("refresh", help="revalidate the cached relay list")
+    refresh.add_argument("--coordinates", action="store_true", help="also geocode cities missing from coordinates.json")
+    return parser
+
+
+def finite(value):
+    """Replace the inf/NaN scores of relays that never answered with None, which JSON has a literal for."""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: finite(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [finite(item) for item in value]
+    return value
+
+
+def write_rows(rows, file, output_format):
+    """Write a list of flat dicts (or one summary dict) as JSON or CSV. Rows are ranked before they get here."""
+    rows = finite(rows)
+    if output_format == "json":
+        json.dump(rows, file, indent=2, allow_nan=False)
+        file.write("\n")
+        return
+    if isinstance(rows, dict):
+        rows = [{key: ";".join(value) if isinstance(value, list) else value for key, value in rows.items()}]
+    if rows:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run(args, progress, stdout):
+    if args.command in ("scan", "monitor", "matrix", "paths") and args.city and not args.country:
+        raise ValueError("--city requires --country")
+    if args.command == "monitor":
+        def on_event(event):
+            if event.kind == "best_changed":
+                stats = event.data["result"].stats()
+                stdout.write(json.dumps(finite({"previous": event.data["previous"], "best": event.data["best"],
+                                                "median": stats.median, "loss": stats.loss}), allow_nan=False) + "\n")
+                stdout.flush()
+            if progress is not None:
+                progress(event)
+
+        metrics = None
+        if args.metrics_port is not None:
+            from utils.metrics import RelayMetrics, MetricsServer
+            metrics = RelayMetrics()
+            server = MetricsServer(metrics, args.metrics_host, args.metrics_port).start()
+            print(f"Serving metrics at http://{args.metrics_host}:{server.port}/metrics")  # Goes to the progress log
+        return api.monitor(country=args.country, city=args.city, relay_type=RELAY_TYPES[args.type],
+                           provider=args.provider, owned=True if args.owned else None,
+                           min_bandwidth=args.min_bandwidth, duration=args.duration, score=SCORES[args.rank_by],
+                           progress=on_event, count=args.count, timeout=args.timeout, metrics=metrics,
+                           **{option: getattr(args, option) for option in MONITOR_OPTIONS
+                              if getattr(args, option) is not None})
+    if args.command == "scan":
+        return api.scan(country=args.country, city=args.city, relay_type=RELAY_TYPES[args.type],
+                        provider=args.provider, owned=True if args.owned else None,
+                        min_bandwidth=args.min_bandwidth, count=args.count, timeout=args.timeout, mode=args.mode,
+                        score=SCORES[args.rank_by], progress=progress, family=args.family, prefer=args.prefer)
+    if args.command == "matrix":
+        return api.matrix(args.agent, country=args.country, city=args.city, relay_type=RELAY_TYPES[args.type],
+                          provider=args.provider, owned=True if args.owned else None,
+                          min_bandwidth=args.min_bandwidth, count=args.count, timeout=args.timeout,
+                          family=args.family, score=SCORES[args.rank_by], progress=progress, token=args.token)
+    if args.command == "paths":
+        return api.paths(country=args.country, city=args.city, relay_type=RELAY_TYPES[args.type],
+                         provider=args.provider, owned=True if args.owned else None,
+                         min_bandwidth=args.min_bandwidth, count=args.count, timeout=args.timeout,
+                         max_hops=args.max_hops, family=args.family, progress=progress)
+    if args.command == "agent":
+        from utils.distributed import ProbeAgent, DEFAULT_AGENT_PORT
+        port = DEFAULT_AGENT_PORT if args.port is None else args.port
+        agent = ProbeAgent(args.vantage, args.host, port, max_workers=args.max_workers, token=args.token).start()
+        print(f"Agent {args.vantage} listening on http://{args.host}:{agent.port}")  # Goes to the progress log
+        if args.token is None and args.host not in ("127.0.0.1", "::1", "localhost"):
+            print(f"Warning: no token set, anyone who can reach this agent can make it probe any address "
+                  f"(use --token or ${TOKEN_VARIABLE})")
+        try:
+            while agent.thread.is_alive():
+                agent.thread.join(0.5)
+        except KeyboardInterrupt:
+            agent.stop()
+        return {"vantage": agent.vantage, "scans": agent.scans, "probed": agent.probed}
+    if args.command == "closest":
+        return api.closest(location=args.location, top_k=args.top_k, count=args.count, timeout=args.timeout,
+                           progress=progress)
+    return api.refresh(progress=progress, coordinates=args.coordinates)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    set_probe_backend(args.backend)
+    stdout = sys.stdout
+
+    # Anything the utils print directly goes to stderr (or nowhere) so stdout only carries the results
+    log = open(os.devnull, "w") if args.quiet else sys.stderr
+    progress = None if args.quiet else lambda event: print(event.message, file=log)
+    if args.trace:
+        tracing.enable()
+    try:
+        with contextlib.redirect_stdout(log), (tracing.profile(args.profile) if args.profile else contextlib.nullcontext()):
+            rows = run(args, progress, stdout)
+    except (ValueError, RuntimeError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    finally:
+        if args.trace:
+            tracing.write_trace(args.trace)
+        if args.quiet:
+            log.close()
+
+    if args.output:
+        with open(args.output, "w", newline="", encoding="utf-8") as file:
+            write_rows(rows, file, args.format)
+    else:
+        write_rows(rows, stdout, args.format)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import latency_history, relay_health  # noqa: E402
+
+
+@pytest.fixture
+def stores(tmp_path, monkeypatch):
+    """Point the shared latency history and relay health stores at a temporary database."""
+    path = str(tmp_path / "history.sqlite3")
+    history = latency_history.LatencyHistory(path)
+    health = relay_health.RelayHealth(path)
+    monkeypatch.setattr(latency_history, "_history", history)
+    monkeypatch.setattr(relay_health, "_health", health)
+    yield history, health
+    history.close()
+    health.close()
+
+
+@pytest.fixture
+def relay(request):
+    """A minimal WireGuard relay dict; parametrize indirectly to override fields."""
+    fields = {
+        "hostname": "se-got-wg-001", "type": "wireguard", "country_code": "se", "country_name": "Sweden",
+        "city_code": "got", "city_name": "Gothenburg", "ipv4_addr_in": "127.0.0.1", "ipv6_addr_in": "::1",
+        "provider": "31173", "network_port_speed": 10, "owned": True, "active": True,
+    }
+    fields.update(getattr(request, "param", {}))
+    return fields
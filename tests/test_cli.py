@@ -0,0 +1,52 @@
+import io
+import os
+import csv
+import sys
+import json
+import subprocess
+import pytest
+from utils import ping_utilities
+from utils.relay_catalog import RelayCatalog
+from mullvad_latency import api
+from mullvad_latency.cli import write_rows
+
+
+def strict_loads(text):
+    def reject(constant):
+        raise ValueError(f"non-standard JSON constant {constant}")
+    return json.loads(text, parse_constant=reject)
+
+
+def test_write_rows_replaces_non_finite_values():
+    rows = [{"hostname": "a", "score": 1.5, "worst_score": 2.0},
+            {"hostname": "b", "score": float("inf"), "worst_score": float("nan")}]
+    out = io.StringIO()
+    write_rows(rows, out, "json")
+    assert strict_loads(out.getvalue()) == [{"hostname": "a", "score": 1.5, "worst_score": 2.0},
+                                            {"hostname": "b", "score": None, "worst_score": None}]
+    assert rows[1]["score"] == float("inf")  # The caller's rows are left alone
+
+    out = io.StringIO()
+    write_rows(rows, out, "csv")
+    assert list(csv.DictReader(io.StringIO(out.getvalue())))[1]["score"] == ""
+
+
+@pytest.mark.parametrize("relay", [{"hostname": "dead-001"}], indirect=True)
+def test_scan_of_dead_relay_writes_valid_json(stores, relay, monkeypatch):
+    alive = dict(relay, hostname="alive-001", ipv4_addr_in="127.0.0.2")
+    monkeypatch.setattr(ping_utilities, "probe",
+                        lambda addr, count, **options: [None] * count if addr == "127.0.0.1" else [5.0] * count)
+    rows = api.scan(count=2, catalog=RelayCatalog([relay, alive]), progress=lambda event: None)
+    assert [row["hostname"] for row in rows] == ["alive-001", "dead-001"]  # Ranked on the raw scores
+
+    out = io.StringIO()
+    write_rows(rows, out, "json")
+    assert strict_loads(out.getvalue())[1]["score"] is None
+
+
+def test_cli_import_leaves_optional_modules_unloaded():
+    modules = ("utils.distributed", "utils.path_analysis", "utils.monitor", "utils.metrics", "http.server")
+    code = f"import sys, mullvad_latency.cli; print([m for m in {modules!r} if m in sys.modules])"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    loaded = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+    assert loaded.stdout.strip() == "[]"
@@ -0,0 +1,89 @@
+import json
+import http.client
+import pytest
+from utils import distributed
+from utils.distributed import ProbeAgent, Coordinator, MAX_BODY
+from utils.latency_stats import ProbeResult
+
+TOKEN = "s3cret"
+
+
+@pytest.fixture
+def agents(monkeypatch):
+    """Starts ProbeAgents on free ports, probing through a fake probe_relays that answers in 1 ms."""
+    started = []
+    calls = []
+
+    def probe_relays(relays, count=1, timeout=1000, max_workers=None, backend=None, family="ipv4"):
+        calls.append([relay["hostname"] for relay in relays])
+        return {relay["hostname"]: ProbeResult(relay["hostname"], relay["ipv4_addr_in"], [1.0] * count)
+                for relay in relays}
+
+    monkeypatch.setattr(distributed, "probe_relays", probe_relays)
+
+    def start(vantage, **options):
+        agent = ProbeAgent(vantage, port=0, **options).start()
+        started.append(agent)
+        return agent, f"http://127.0.0.1:{agent.port}"
+
+    start.calls = calls
+    yield start
+    for agent in started:
+        agent.stop()
+
+
+def fleet(size):
+    return [{"hostname": f"se-got-wg-{index:03d}", "ipv4_addr_in": f"127.0.0.{index}"} for index in range(1, size + 1)]
+
+
+def post(agent, body, headers=None):
+    connection = http.client.HTTPConnection("127.0.0.1", agent.port, timeout=5)
+    try:
+        connection.request("POST", "/probe", body=body, headers=headers or {})
+        return connection.getresponse().status
+    finally:
+        connection.close()
+
+
+def test_scan_with_token(agents):
+    _, url = agents("stockholm", token=TOKEN)
+    matrix = Coordinator([url], token=TOKEN).scan(fleet(3), count=2)
+    assert sorted(matrix) == ["se-got-wg-001", "se-got-wg-002", "se-got-wg-003"]
+    assert list(matrix["se-got-wg-001"]["stockholm"].samples) == [1.0, 1.0]
+
+
+@pytest.mark.parametrize("token", [None, "wrong"])
+def test_requests_without_the_token_are_refused(agents, token):
+    agent, url = agents("stockholm", token=TOKEN)
+    messages = []
+    with pytest.raises(RuntimeError):
+        Coordinator([url], output_text=messages.append, token=token).scan(fleet(1))
+    assert "401" in str(messages[0])
+    body = json.dumps({"relays": fleet(1)})
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    assert post(agent, body, headers) == 401
+    assert not agents.calls
+
+
+def test_oversized_and_unsized_bodies_are_refused(agents):
+    agent, _ = agents("stockholm")
+    assert post(agent, b"x" * 16, {"Content-Length": str(MAX_BODY + 1)}) == 413
+    connection = http.client.HTTPConnection("127.0.0.1", agent.port, timeout=5)
+    try:
+        connection.putrequest("POST", "/probe")
+        connection.endheaders()
+        assert connection.getresponse().status == 411
+    finally:
+        connection.close()
+    assert not agents.calls
+
+
+def test_relays_per_request_are_capped(agents):
+    agent, url = agents("stockholm", max_relays=2)
+    assert post(agent, json.dumps({"relays": fleet(3)})) == 413
+    assert not agents.calls
+
+    # A coordinator splits its shard into requests the agent accepts
+    matrix = Coordinator([url]).scan(fleet(5))
+    assert len(matrix) == 5
+    assert sorted(len(call) for call in agents.calls) == [1, 2, 2]
@@ -0,0 +1,38 @@
+import pytest
+from utils import ping_utilities
+from utils.relay_catalog import RelayCatalog
+from mullvad_latency import api
+
+RTTS = {"127.0.0.1": 5.0, "::1": 50.0}
+
+
+@pytest.fixture
+def fake_probe(monkeypatch):
+    monkeypatch.setattr(ping_utilities, "probe", lambda addr, count, **options: [RTTS[addr]] * count)
+
+
+def test_dual_stack_scan_records_each_family(stores, relay, fake_probe):
+    rows = api.scan(count=2, family="dual", catalog=RelayCatalog([relay]), progress=lambda event: None)
+    assert rows[0]["family"] == "ipv4" and rows[0]["ipv6_median"] == 50.0
+    history, _ = stores
+    assert history.estimate(relay["hostname"], family="ipv4").latency == pytest.approx(5.0)
+    assert history.estimate(relay["hostname"], family="ipv6").latency == pytest.approx(50.0)
+
+
+@pytest.mark.parametrize("prefer, expected", [("best", ("ipv4", 5.0)), ("ipv6", ("ipv6", 50.0))])
+def test_stale_dual_stack_scan_answers_from_each_family(stores, relay, fake_probe, prefer, expected):
+    catalog = RelayCatalog([relay])
+    for _ in range(2):  # Enough samples for the history to be trusted
+        api.scan(count=2, family="dual", catalog=catalog, progress=lambda event: None)
+    rows = api.scan(count=2, family="dual", mode="stale", prefer=prefer, catalog=catalog,
+                    progress=lambda event: None)
+    assert rows[0]["source"] == "history"
+    assert rows[0]["family"] == expected[0] and rows[0]["mean"] == pytest.approx(expected[1])
+
+
+def test_ipv6_scan_does_not_answer_ipv4_stale_scan(stores, relay, fake_probe):
+    catalog = RelayCatalog([relay])
+    for _ in range(2):
+        api.scan(count=2, family="ipv6", catalog=catalog, progress=lambda event: None)
+    rows = api.scan(count=2, family="ipv4", mode="stale", catalog=catalog, progress=lambda event: None)
+    assert rows[0]["source"] == "probe" and rows[0]["median"] == 5.0
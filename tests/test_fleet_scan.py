@@ -0,0 +1,35 @@
+import pytest
+from utils.fleet_scan import fleet_probe_relays, open_sweep_socket
+from utils.relay_catalog import RelayCatalog
+from mullvad_latency import api
+
+
+def icmp_allowed():
+    try:
+        sock, _ = open_sweep_socket()
+    except OSError:
+        return False
+    sock.close()
+    return True
+
+
+needs_icmp = pytest.mark.skipif(not icmp_allowed(), reason="ICMP sockets are not allowed here")
+
+
+@needs_icmp
+def test_fleet_probe_relays_pings_loopback(relay):
+    results = fleet_probe_relays([relay], count=2, timeout=500)
+    assert results[relay["hostname"]].stats().received == 2
+
+
+@needs_icmp
+def test_scan_fleet_mode(stores, relay):
+    rows = api.scan(count=2, timeout=500, mode="fleet", catalog=RelayCatalog([relay]), progress=lambda event: None)
+    assert rows[0]["hostname"] == relay["hostname"] and rows[0]["received"] == 2
+    history, _ = stores
+    assert history.best([relay["hostname"]]) is not None
+
+
+def test_scan_fleet_mode_is_single_stack(relay):
+    with pytest.raises(ValueError):
+        api.scan(mode="fleet", family="dual", catalog=RelayCatalog([relay]))
@@ -0,0 +1,190 @@
+import json
+import threading
+import pytest
+from time import monotonic
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils import geocoding, server_distance_utilities
+from utils.geocoding import NominatimGeocoder, GeocodingError
+from utils.rate_limiter import TokenBucket
+
+PLACES = {"Gothenburg": (57.7, 11.97), "Malmö": (55.6, 13.0)}
+
+
+class FakeNominatim:
+    """
+    Answers Nominatim searches for PLACES. `failures[city]` lists the statuses sent before the real answer
+    (e.g. [429, 503]); cities in `broken` always get a 500. Every request is logged as (`clock()`, city).
+    """
+
+    def __init__(self):
+        self.failures = {}
+        self.broken = set()
+        self.requests = []
+        self.clock = monotonic
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                city = parse_qs(urlparse(self.path).query)["city"][0]
+                fake.requests.append((fake.clock(), city))
+                pending = fake.failures.get(city)
+                if city in fake.broken or pending:
+                    self.send_error(pending.pop(0) if pending else 500)
+                    return
+                places = [{"lat": str(PLACES[city][0]), "lon": str(PLACES[city][1])}] if city in PLACES else []
+                body = json.dumps(places).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/search"
+
+    def cities(self):
+        return [city for _, city in self.requests]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeClock:
+    """Monotonic time that only moves when something sleeps, so pacing is checked without waiting."""
+
+    def __init__(self):
+        self.now = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self.now += seconds
+
+
+@pytest.fixture
+def nominatim():
+    fake = FakeNominatim()
+    yield fake
+    fake.close()
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    """Records the retry delays of NominatimGeocoder instead of sleeping."""
+    delays = []
+    monkeypatch.setattr(geocoding, "sleep", delays.append)
+    return delays
+
+
+def test_geocode(nominatim):
+    assert NominatimGeocoder(url=nominatim.url, rate=100).geocode("Gothenburg", "Sweden") == (57.7, 11.97)
+
+
+@pytest.mark.parametrize("statuses", [[429], [500, 503], [429, 502, 504]])
+def test_geocode_retries_rate_limits_and_server_errors(nominatim, backoffs, statuses):
+    nominatim.failures["Gothenburg"] = list(statuses)
+    geocoder = NominatimGeocoder(url=nominatim.url, rate=100, retries=3, backoff=1.0)
+    assert geocoder.geocode("Gothenburg", "Sweden") == (57.7, 11.97)
+    assert len(nominatim.requests) == len(statuses) + 1
+    # Exponential backoff with jitter: 1 s, 2 s, 4 s, each scaled by 0.5 to 1.5
+    assert [0.5 * 2 ** attempt <= delay <= 1.5 * 2 ** attempt for attempt, delay in enumerate(backoffs)] == \
+           [True] * len(statuses)
+
+
+def test_geocode_gives_up_after_the_last_retry(nominatim, backoffs):
+    nominatim.broken.add("Gothenburg")
+    with pytest.raises(GeocodingError):
+        NominatimGeocoder(url=nominatim.url, rate=100, retries=2).geocode("Gothenburg", "Sweden")
+    assert len(nominatim.requests) == 3 and len(backoffs) == 2
+
+
+def test_unknown_cities_and_client_errors_are_not_retried(nominatim, backoffs):
+    geocoder = NominatimGeocoder(url=nominatim.url, rate=100)
+    assert geocoder.geocode("Atlantis", "Sweden") is None
+    nominatim.failures["Malmö"] = [404]
+    with pytest.raises(Exception) as error:
+        geocoder.geocode("Malmö", "Sweden")
+    assert not isinstance(error.value, GeocodingError)
+    assert len(nominatim.requests) == 2 and not backoffs
+
+
+def test_geocoder_requests_are_paced(nominatim):
+    clock = nominatim.clock = FakeClock()
+    geocoder = NominatimGeocoder(url=nominatim.url, limiter=TokenBucket(20, clock=clock, sleep=clock.sleep))
+    for _ in range(4):
+        geocoder.geocode("Gothenburg", "Sweden")
+    assert [ts for ts, _ in nominatim.requests] == pytest.approx([0.0, 0.05, 0.1, 0.15])
+
+
+def test_token_bucket_paces_callers():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=50, burst=1, clock=clock, sleep=clock.sleep)
+    granted = []
+    for _ in range(6):
+        assert bucket.acquire()
+        granted.append(clock())
+    assert granted == pytest.approx([0.0, 0.02, 0.04, 0.06, 0.08, 0.1])
+    assert not bucket.try_acquire()
+
+
+def test_token_bucket_burst_and_threads():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=40, burst=3, clock=clock, sleep=clock.sleep)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+    granted = []
+    threads = [threading.Thread(target=lambda: bucket.acquire() and granted.append(clock())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # However the threads interleave, the bucket never hands out more than its burst plus what it refilled
+    assert len(granted) == 4
+    assert all(taken <= 3 + 40 * ts + 1e-9 for taken, ts in enumerate(sorted(granted), start=4))
+
+
+def test_token_bucket_acquire_stops():
+    bucket = TokenBucket(rate=0.1, burst=1)
+    bucket.acquire()
+    stop = threading.Event()
+    stop.set()
+    assert bucket.acquire(stop_event=stop) is False
+
+
+def test_update_coordinates_saves_each_city(nominatim, tmp_path, monkeypatch):
+    path = tmp_path / "coordinates.json"
+    path.write_text(json.dumps({"Sweden-Stockholm": [59.3, 18.1]}))
+    monkeypatch.setattr(server_distance_utilities, "COORDINATES_FILE", str(path))
+    monkeypatch.setattr(geocoding, "sleep", lambda seconds: None)
+    saved = []
+    save = server_distance_utilities.save_coordinates
+
+    def spy(coordinates, output_text=None):
+        save(coordinates, output_text)
+        saved.append(json.loads(path.read_text()))
+
+    monkeypatch.setattr(server_distance_utilities, "save_coordinates", spy)
+    nominatim.broken.add("Umeå")
+    relays = [{"country_name": "Sweden", "city_name": city}
+              for city in ("Stockholm", "Gothenburg", "Gothenburg", "Malmö", "Umeå", "Atlantis")]
+    messages = []
+    server_distance_utilities.update_coordinates(relays, messages.append,
+                                                 geocoder=NominatimGeocoder(url=nominatim.url, rate=100, retries=1))
+
+    assert "Stockholm" not in nominatim.cities()  # Already known
+    assert nominatim.cities().count("Gothenburg") == 1  # Deduplicated
+    # One save per city found, each holding everything found so far
+    assert [len(coordinates) for coordinates in saved] == [2, 3]
+    assert json.loads(path.read_text()) == {"Sweden-Stockholm": [59.3, 18.1], "Sweden-Gothenburg": [57.7, 11.97],
+                                            "Sweden-Malmö": [55.6, 13.0]}
+    assert any("Failed to fetch coordinates for Sweden-Umeå" in str(message) for message in messages)
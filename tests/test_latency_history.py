@@ -0,0 +1,47 @@
+import sqlite3
+import pytest
+from time import time
+from utils.latency_history import LatencyHistory
+from utils.latency_stats import ProbeResult
+
+
+def count(history):
+    return history._conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+
+
+def test_records_are_evicted_periodically(tmp_path):
+    history = LatencyHistory(str(tmp_path / "history.sqlite3"), max_samples=10, evict_every=20)
+    try:
+        now = time()
+        for run in range(5):
+            history.record_results([ProbeResult(f"host-{run}", "127.0.0.1", [1.0] * 8)], ts=now + run)
+        assert count(history) == 26  # Evicted down to 10 after the third run (24 samples), 16 stored since
+        history.record_results([ProbeResult("host-5", "127.0.0.1", [1.0] * 4)], ts=now + 5)
+        assert count(history) == 10
+        assert history.estimate("host-5") is not None and history.estimate("host-0") is None  # Oldest go first
+    finally:
+        history.close()
+
+
+def test_expired_samples_are_evicted_while_recording(tmp_path):
+    history = LatencyHistory(str(tmp_path / "history.sqlite3"), ttl=3600, evict_every=1)
+    try:
+        history.record(ProbeResult("old", "127.0.0.1", [1.0, None]), ts=time() - 7200)
+        history.record(ProbeResult("new", "127.0.0.1", [2.0]))
+        assert set(history.estimates()) == {"new"}
+    finally:
+        history.close()
+
+
+def test_samples_from_before_families_count_as_ipv4(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE samples (hostname TEXT NOT NULL, ts REAL NOT NULL, rtt REAL)")
+        conn.execute("INSERT INTO samples VALUES ('se-got-wg-001', ?, 7.0)", (time(),))
+    conn.close()
+    history = LatencyHistory(path)
+    try:
+        assert history.estimate("se-got-wg-001").latency == pytest.approx(7.0)
+        assert history.estimate("se-got-wg-001", family="ipv6") is None
+    finally:
+        history.close()
@@ -0,0 +1,117 @@
+import threading
+import pytest
+from benchmarks.simulated_network import SimulatedRouterChain, HostProfile
+from utils.path_analysis import trace_paths
+
+GATEWAY, ISP = "127.210.0.1", "127.210.0.2"
+TRANSIT, CONGESTED = "127.210.1.1", "127.210.1.2"
+OTHER_GATEWAY, OTHER_ISP = "127.210.2.1", "127.210.2.2"  # The way a multihomed relay is reached
+PORT = 33500
+
+
+def relay(index):
+    return {"hostname": f"se-got-wg-{index:03d}", "ipv4_addr_in": f"127.211.0.{index}"}
+
+
+def topology():
+    """
+    Nine relays: 1-6 behind TRANSIT (8 ms), 7-8 behind CONGESTED (40 ms), all through GATEWAY and ISP,
+    and relay 9 behind TRANSIT through other routers. Returns the relays, their router paths and the host profiles.
+    """
+    relays = [relay(index) for index in range(1, 10)]
+    profiles = {GATEWAY: HostProfile(1.0), ISP: HostProfile(2.0), TRANSIT: HostProfile(5.0),
+                CONGESTED: HostProfile(30.0), OTHER_GATEWAY: HostProfile(1.0), OTHER_ISP: HostProfile(2.0)}
+    paths = {}
+    for entry in relays[:6]:
+        paths[entry["ipv4_addr_in"]] = [GATEWAY, ISP, TRANSIT]
+        profiles[entry["ipv4_addr_in"]] = HostProfile(8.0)
+    for entry in relays[6:8]:
+        paths[entry["ipv4_addr_in"]] = [GATEWAY, ISP, CONGESTED]
+        profiles[entry["ipv4_addr_in"]] = HostProfile(40.0)
+    paths[relays[8]["ipv4_addr_in"]] = [OTHER_GATEWAY, OTHER_ISP, TRANSIT]
+    profiles[relays[8]["ipv4_addr_in"]] = HostProfile(8.0)
+    return relays, paths, profiles
+
+
+@pytest.fixture
+def chain():
+    relays, paths, profiles = topology()
+    with SimulatedRouterChain(paths, profiles, port=PORT) as network:
+        yield relays, network
+
+
+def addresses(tree, hostname):
+    return [node.address for node in tree.paths[hostname]]
+
+
+def test_paths_are_traced(chain):
+    relays, network = chain
+    tree = trace_paths(relays, count=2, timeout=300, hop_function=network.hop_probe)
+    assert addresses(tree, "se-got-wg-001") == [GATEWAY, ISP, TRANSIT, "127.211.0.1"]
+    assert addresses(tree, "se-got-wg-007") == [GATEWAY, ISP, CONGESTED, "127.211.0.7"]
+    assert set(tree.paths) == {entry["hostname"] for entry in relays}
+
+
+def test_shared_prefix_is_measured_once(chain):
+    relays, network = chain
+    cached = trace_paths(relays, count=1, timeout=300, pilots=3, hop_function=network.hop_probe)
+    cached_probes = network.received
+    uncached = trace_paths(relays, count=1, timeout=300, pilots=0, hop_function=network.hop_probe)
+    assert cached_probes < network.received - cached_probes
+    assert cached.probes == cached_probes
+
+    # The gateway is only probed by the pilots, yet every relay that goes through it is counted behind it
+    gateway = cached.root.children[GATEWAY]
+    assert gateway.result.stats().sent == 3
+    assert gateway.destinations == {entry["hostname"] for entry in relays[:8]}
+    assert uncached.root.children[GATEWAY].result.stats().sent == 8
+    assert {hostname: addresses(cached, hostname) for hostname in cached.paths} == \
+           {hostname: addresses(uncached, hostname) for hostname in uncached.paths}
+
+
+def test_diverted_relays_are_traced_in_full(chain):
+    relays, network = chain
+    tree = trace_paths(relays, count=1, timeout=300, hop_function=network.hop_probe)
+    assert addresses(tree, "se-got-wg-009") == [OTHER_GATEWAY, OTHER_ISP, TRANSIT, "127.211.0.9"]
+    assert tree.root.children[OTHER_GATEWAY].destinations == {"se-got-wg-009"}
+    assert "se-got-wg-009" not in tree.root.children[GATEWAY].destinations
+
+
+def test_segments_attribute_latency_to_hops():
+    relays, paths, profiles = topology()
+
+    def hop_probe(addr, ttl, count, timeout, ipv6=False):
+        # Answers like SimulatedRouterChain.hop_probe, with each host's exact delay instead of a measured one
+        hop = paths[addr][ttl - 1] if ttl <= len(paths[addr]) else addr
+        return [(hop, profiles[hop].delay, hop == addr)] * count
+
+    tree = trace_paths(relays, count=3, timeout=300, hop_function=hop_probe)
+    isp = tree.root.children[GATEWAY].children[ISP]
+    congested, transit = isp.children[CONGESTED], isp.children[TRANSIT]
+    assert congested.segment == pytest.approx(28.0)  # 30 ms at the router minus 2 ms at the ISP
+    assert transit.segment == pytest.approx(3.0)
+    assert congested.children["127.211.0.7"].segment == pytest.approx(10.0)
+    assert [node.address for node in tree.bottlenecks(top=1)] == [CONGESTED]
+
+
+def test_stop_request_is_honored(chain):
+    relays, network = chain
+    stop = threading.Event()
+    calls = []
+
+    def hop_probe(*args):
+        calls.append(args)
+        if len(calls) == 10:
+            stop.set()
+        return network.hop_probe(*args)
+
+    tree = trace_paths(relays, count=1, timeout=300, hop_function=hop_probe, stop_animation=stop, max_workers=2)
+    full = trace_paths(relays, count=1, timeout=300, hop_function=network.hop_probe)
+    assert len(calls) < full.probes
+    # Relays whose own hops were never probed are left out rather than given the shared prefix alone
+    probed = {args[0] for args in calls}
+    assert tree.paths and all(entry["ipv4_addr_in"] in probed for entry in relays if entry["hostname"] in tree.paths)
+    assert len(tree.paths) < len(relays)
+
+    stop.set()
+    assert trace_paths(relays, hop_function=network.hop_probe, stop_animation=stop).paths == {}
@@ -0,0 +1,136 @@
+import socket
+import struct
+import threading
+import pytest
+from utils import probe_backends
+from utils.probe_backends import (checksum, build_echo_request, parse_echo_reply, icmp_probe, udp_probe,
+                                  icmp_available, ICMP_ECHO_REPLY, ICMPV6_ECHO_REPLY)
+
+
+def as_reply(request, ipv6=False):
+    """The echo reply a host sends back for `request`."""
+    return bytes([ICMPV6_ECHO_REPLY if ipv6 else ICMP_ECHO_REPLY]) + request[1:]
+
+
+def test_checksum():
+    assert checksum(bytes.fromhex("0001f203f4f5f6f7")) == 0x220D  # The example of RFC 1071
+    assert checksum(b"\x01") == checksum(b"\x01\x00")  # Odd lengths are padded
+    assert checksum(b"") == 0xFFFF
+
+
+def test_echo_request_checksum_verifies():
+    request = build_echo_request(0x1234, 7)
+    assert request[0] == 8 and checksum(request) == 0
+    assert struct.unpack("!HH", request[4:8]) == (0x1234, 7)
+    assert build_echo_request(0x1234, 7, ipv6=True)[2:4] == b"\x00\x00"  # Left to the kernel
+
+
+@pytest.mark.parametrize("ipv6", [False, True])
+def test_parse_echo_reply(ipv6):
+    request = build_echo_request(0xBEEF, 0x10001, ipv6=ipv6)  # The sequence wraps to 16 bits
+    assert parse_echo_reply(as_reply(request, ipv6), ipv6) == (0xBEEF, 1)
+    assert parse_echo_reply(request, ipv6) is None  # Our own request, e.g. on a raw socket
+    assert parse_echo_reply(as_reply(request, ipv6)[:7], ipv6) is None
+
+
+def test_parse_echo_reply_skips_the_ip_header():
+    ip_header = bytes([0x45]) + bytes(19)
+    options_header = bytes([0x46]) + bytes(23)  # IHL of 6 words
+    reply = as_reply(build_echo_request(1, 2))
+    assert parse_echo_reply(ip_header + reply) == (1, 2)
+    assert parse_echo_reply(options_header + reply) == (1, 2)
+
+
+class FakeIcmpSocket:
+    """An ICMP socket whose recv returns the queued packets, then times out."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.sent = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def connect(self, address):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def send(self, packet):
+        self.sent.append(packet)
+
+    def recv(self, size):
+        if not self.replies:
+            raise socket.timeout()
+        reply = self.replies.pop(0)
+        return reply(self.sent[-1]) if callable(reply) else reply
+
+
+def test_icmp_probe_matches_replies_by_sequence(monkeypatch):
+    stray = as_reply(build_echo_request(1, 99))  # Another session's reply
+    replies = [stray, as_reply, lambda request: b"junk", as_reply]
+    monkeypatch.setattr(probe_backends, "open_icmp_socket", lambda ipv6=False: FakeIcmpSocket(replies))
+    samples = icmp_probe("192.0.2.1", 2, 1000)
+    assert len(samples) == 2 and all(sample is not None and sample >= 0 for sample in samples)
+
+
+def test_icmp_probe_timeout(monkeypatch):
+    replies = [as_reply(build_echo_request(1, 99))]  # Only a reply that isn't ours
+    monkeypatch.setattr(probe_backends, "open_icmp_socket", lambda ipv6=False: FakeIcmpSocket(replies))
+    assert icmp_probe("192.0.2.1", 3, 10) == [None, None, None]
+
+
+@pytest.mark.skipif(not icmp_available(), reason="unprivileged ICMP sockets are not allowed here")
+def test_icmp_probe_loopback():
+    samples = icmp_probe("127.0.0.1", 3, 1000)
+    assert len(samples) == 3 and all(sample is not None for sample in samples)
+
+
+@pytest.fixture
+def udp_server():
+    """A UDP socket on 127.0.0.1; `echo` says whether it answers the datagrams it gets."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(0.05)
+    server = {"port": sock.getsockname()[1], "echo": True, "received": 0}
+    done = threading.Event()
+
+    def serve():
+        while not done.is_set():
+            try:
+                data, address = sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            server["received"] += 1
+            if server["echo"]:
+                sock.sendto(data, address)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield server
+    done.set()
+    thread.join()
+    sock.close()
+
+
+def test_udp_probe_reply(udp_server):
+    samples = udp_probe("127.0.0.1", 3, 1000, port=udp_server["port"])
+    assert udp_server["received"] == 3 and all(sample is not None for sample in samples)
+
+
+def test_udp_probe_port_unreachable():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()  # Nothing listens on the port any more, the kernel answers with port unreachable
+    samples = udp_probe("127.0.0.1", 2, 1000, port=port)
+    assert all(sample is not None for sample in samples)
+
+
+def test_udp_probe_timeout(udp_server):
+    udp_server["echo"] = False
+    assert udp_probe("127.0.0.1", 2, 20, port=udp_server["port"]) == [None, None]
@@ -0,0 +1,48 @@
+import itertools
+import pytest
+from utils.relay_catalog import RelayCatalog
+
+CITIES = [("Sweden", "se", "Gothenburg", "got"), ("Sweden", "se", "Stockholm", "sto"),
+          ("Norway", "no", "Oslo", "osl"), ("Canada", "ca", "Stockholm", "sth")]  # Two cities named Stockholm
+
+
+@pytest.fixture
+def catalog(relay):
+    relays = []
+    for index, ((country, country_code, city, city_code), bandwidth, owned) in enumerate(
+            itertools.product(CITIES, (1, 10, 20), (True, False))):
+        relays.append(dict(relay, hostname=f"{city_code}-wg-{index:03d}", country_name=country,
+                           country_code=country_code, city_name=city, city_code=city_code,
+                           network_port_speed=bandwidth, owned=owned))
+    return RelayCatalog(relays)
+
+
+def brute_force(catalog, country=None, city=None, owned=None, min_bandwidth=None):
+    return [relay for relay in catalog
+            if (country is None or relay["country_name"] == country) and (city is None or relay["city_name"] == city)
+            and (owned is None or relay["owned"] == owned)
+            and (not min_bandwidth or relay["network_port_speed"] >= min_bandwidth)]
+
+
+@pytest.mark.parametrize("country", [None, "Sweden", "Canada"])
+@pytest.mark.parametrize("city", [None, "Stockholm", "Oslo"])
+@pytest.mark.parametrize("owned", [None, True])
+@pytest.mark.parametrize("min_bandwidth", [None, 10, 30])
+def test_query_matches_every_filter(catalog, country, city, owned, min_bandwidth):
+    assert catalog.query(country=country, city=city, owned=owned, min_bandwidth=min_bandwidth) == \
+           brute_force(catalog, country, city, owned, min_bandwidth)
+
+
+def test_city_without_country_is_honored(catalog):
+    assert {relay["country_name"] for relay in catalog.query(city="Stockholm")} == {"Sweden", "Canada"}
+    assert catalog.query(city="Atlantis") == []
+
+
+def test_bandwidth_positions_are_only_gathered_when_most_selective(catalog, monkeypatch):
+    gathered = []
+    original = catalog._bandwidth_positions
+    monkeypatch.setattr(catalog, "_bandwidth_positions", lambda minimum: gathered.append(minimum) or original(minimum))
+    catalog.query(country="Sweden", city="Oslo", min_bandwidth=10)  # The city matches fewer relays
+    assert gathered == []
+    catalog.query(owned=True, min_bandwidth=20)
+    assert gathered == [20]
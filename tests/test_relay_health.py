@@ -0,0 +1,244 @@
+import sqlite3
+from utils import relay_health, ping_utilities
+from utils.dual_stack import probe_dual_stack
+from utils.relay_health import RelayHealth, guarded_probe, CLOSED, OPEN, HALF_OPEN, COOLDOWN, MAX_COOLDOWN
+from utils.latency_stats import ProbeResult
+
+NOW = 1_000_000.0
+OTHER = "se-got-wg-999"  # Answers in every batch, so failures of the relay under test are counted
+
+
+def reply(hostname, ip="127.0.0.1"):
+    return ProbeResult(hostname, ip, [1.0])
+
+
+def lost(hostname, ip="127.0.0.1"):
+    return ProbeResult(hostname, ip, [None])
+
+
+def fail(health, hostname, now=NOW, family="ipv4"):
+    health.record_results([lost(hostname), reply(OTHER)], now=now, family=family)
+
+
+def open_breaker(health, hostname, family="ipv4", now=NOW):
+    for _ in range(health.failure_threshold):
+        fail(health, hostname, now, family)
+
+
+def state(health, hostname, now, family="ipv4"):
+    return health.states([hostname], now, family)[hostname]
+
+
+def test_breaker_state_transitions(stores):
+    _, health = stores
+    hostname = "se-got-wg-001"
+    fail(health, hostname)
+    assert state(health, hostname, NOW) == CLOSED  # Below the failure threshold
+    fail(health, hostname)
+    assert state(health, hostname, NOW) == OPEN
+    assert state(health, hostname, NOW + COOLDOWN - 1) == OPEN
+    assert state(health, hostname, NOW + COOLDOWN) == HALF_OPEN
+
+    # A failed trial opens the breaker again, for twice as long
+    fail(health, hostname, now=NOW + COOLDOWN)
+    assert state(health, hostname, NOW + 3 * COOLDOWN - 1) == OPEN
+    assert state(health, hostname, NOW + 3 * COOLDOWN) == HALF_OPEN
+
+    # Any reply closes it
+    health.record_results([reply(hostname)], now=NOW + 3 * COOLDOWN)
+    assert state(health, hostname, NOW + 3 * COOLDOWN) == CLOSED
+    fail(health, hostname, now=NOW + 3 * COOLDOWN)
+    assert state(health, hostname, NOW + 3 * COOLDOWN) == CLOSED  # The failure count started over
+
+
+def test_cooldown_is_capped(stores):
+    _, health = stores
+    hostname = "se-got-wg-001"
+    open_breaker(health, hostname)
+    now, cooldown = NOW, COOLDOWN
+    while cooldown < MAX_COOLDOWN:
+        now += cooldown
+        fail(health, hostname, now=now)
+        cooldown = min(cooldown * 2, MAX_COOLDOWN)
+    now += cooldown
+    fail(health, hostname, now=now)
+    assert state(health, hostname, now + MAX_COOLDOWN - 1) == OPEN
+    assert state(health, hostname, now + MAX_COOLDOWN) == HALF_OPEN
+
+
+def test_a_failure_between_replies_does_not_open(stores):
+    _, health = stores
+    fail(health, "se-got-wg-001")
+    health.record_results([reply("se-got-wg-001")], now=NOW)
+    fail(health, "se-got-wg-001")
+    assert state(health, "se-got-wg-001", NOW) == CLOSED
+
+
+def test_batches_without_any_reply_are_ignored(stores):
+    _, health = stores
+    hostnames = ["se-got-wg-001", "se-got-wg-002"]
+    for _ in range(health.failure_threshold + 1):
+        health.record_results([lost(hostname) for hostname in hostnames], now=NOW)
+    assert health.states(hostnames, NOW) == dict.fromkeys(hostnames, CLOSED)
+
+    # A half-open relay stays half-open rather than having its cooldown doubled
+    open_breaker(health, hostnames[0])
+    health.record_results([lost(hostnames[0])], now=NOW + COOLDOWN)
+    assert state(health, hostnames[0], NOW + COOLDOWN) == HALF_OPEN
+
+
+def test_inactive_relays_are_skipped(stores, relay):
+    _, health = stores
+    inactive = dict(relay, hostname="se-got-wg-002", active=False)
+    assert health.plan([relay, inactive], NOW) == ([relay], [], [inactive])
+
+
+def test_breakers_are_kept_per_family(stores, relay):
+    _, health = stores
+    open_breaker(health, relay["hostname"], family="ipv6")
+    assert state(health, relay["hostname"], NOW, "ipv6") == OPEN
+    assert state(health, relay["hostname"], NOW, "ipv4") == CLOSED
+    assert health.plan([relay], NOW, "ipv4") == ([relay], [], [])
+    assert health.plan([relay], NOW, "ipv6") == ([], [], [relay])
+    assert health.plan([relay], NOW, "dual") == ([relay], [], [])  # Its IPv4 address still answers
+
+    open_breaker(health, relay["hostname"], family="ipv4")
+    assert health.plan([relay], NOW, "dual") == ([], [], [relay])
+
+
+def test_breakers_from_before_families_are_dropped(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE relay_health (hostname TEXT PRIMARY KEY, failures INTEGER NOT NULL, "
+                     "opened_at REAL, cooldown REAL)")
+        conn.execute("INSERT INTO relay_health VALUES ('se-got-wg-001', 2, ?, 900)", (NOW,))
+    conn.close()
+    health = RelayHealth(path)
+    try:
+        assert state(health, "se-got-wg-001", NOW) == CLOSED
+    finally:
+        health.close()
+
+
+class FakeNetwork:
+    """Stands in for probe_relays: relays in `alive` answer, the others don't; every call is logged."""
+
+    def __init__(self, alive):
+        self.alive = set(alive)
+        self.calls = []
+
+    def __call__(self, relays, count=1, timeout=1000, output_text=None, stop_animation=None, backend=None,
+                 family="ipv4"):
+        self.calls.append(([relay["hostname"] for relay in relays], family, backend, output_text))
+        address = "ipv6_addr_in" if family == "ipv6" else "ipv4_addr_in"
+        return {relay["hostname"]: (reply if relay["hostname"] in self.alive else lost)(relay["hostname"],
+                                                                                         relay[address])
+                for relay in relays}
+
+
+def test_trial_uses_the_scan_family_backend_and_output(stores, relay, monkeypatch):
+    _, health = stores
+    open_breaker(health, relay["hostname"], family="ipv6")
+    network = FakeNetwork([relay["hostname"]])
+    monkeypatch.setattr(relay_health, "probe_relays", network)
+    monkeypatch.setattr(relay_health, "time", lambda: NOW + COOLDOWN)
+    output = []
+    results = guarded_probe([relay], family="ipv6", backend="udp", output_text=output.append, health=health,
+                            probe_function=network)
+    assert [call[1:] for call in network.calls] == [("ipv6", "udp", output.append)] * 2  # Trial, then scan
+    assert relay["hostname"] in results
+    assert state(health, relay["hostname"], NOW + COOLDOWN, "ipv6") == CLOSED
+
+
+def test_failed_trial_reopens_when_others_answer(stores, relay, monkeypatch):
+    _, health = stores
+    other = dict(relay, hostname=OTHER)
+    open_breaker(health, relay["hostname"])
+    network = FakeNetwork([OTHER])
+    monkeypatch.setattr(relay_health, "probe_relays", network)
+    monkeypatch.setattr(relay_health, "time", lambda: NOW + COOLDOWN)
+    results = guarded_probe([relay, other], health=health, probe_function=network)
+    assert network.calls[0][0] == [relay["hostname"]] and network.calls[1][0] == [OTHER]
+    assert list(results) == [OTHER]  # The failed trial isn't probed in full
+    assert state(health, relay["hostname"], NOW + 3 * COOLDOWN - 1) == OPEN
+
+
+def test_nothing_is_counted_while_offline(stores, relay, monkeypatch):
+    _, health = stores
+    relays = [relay, dict(relay, hostname=OTHER)]
+    network = FakeNetwork([])
+    for _ in range(health.failure_threshold + 1):
+        guarded_probe(relays, health=health, probe_function=network)
+    assert health.plan(relays) == (relays, [], [])
+
+
+def test_dual_stack_scans_update_both_breakers(stores, relay):
+    _, health = stores
+    hostname = relay["hostname"]
+
+    def fake_dual_stack(relays, count=1, timeout=1000, output_text=None, stop_animation=None, families=None):
+        return {hostname: {"ipv4": reply(hostname), "ipv6": lost(hostname, "::1")},
+                OTHER: {"ipv4": reply(OTHER), "ipv6": reply(OTHER, "::1")}}
+
+    for _ in range(health.failure_threshold):
+        guarded_probe([relay, dict(relay, hostname=OTHER)], family="dual", health=health,
+                      probe_function=fake_dual_stack)
+    assert state(health, hostname, None, "ipv4") == CLOSED
+    assert state(health, hostname, None, "ipv6") == OPEN
+
+
+def test_dual_stack_scans_skip_open_families(stores, relay, monkeypatch):
+    _, health = stores
+    hostname = relay["hostname"]
+    other = dict(relay, hostname=OTHER, ipv4_addr_in="127.0.0.2", ipv6_addr_in="::2")
+    open_breaker(health, hostname, family="ipv6")
+    probes = []
+
+    def probe(addr, count, timeout=1000, ipv6=False, backend=None):
+        probes.append((addr, count))
+        return [None] * count if addr == "::1" else [1.0] * count  # Only the relay's IPv6 address is down
+
+    monkeypatch.setattr(ping_utilities, "probe", probe)
+    monkeypatch.setattr(relay_health, "time", lambda: NOW + COOLDOWN - 1)
+    for _ in range(3):
+        results = guarded_probe([relay, other], count=3, family="dual", health=health,
+                                probe_function=probe_dual_stack)
+        assert list(results[hostname]) == ["ipv4"]
+    assert ("::1", 3) not in probes and probes.count(("127.0.0.1", 3)) == 3  # The open IPv6 address isn't probed
+    assert state(health, hostname, NOW + COOLDOWN, "ipv6") == HALF_OPEN  # Nor is its cooldown extended
+
+    # Once half-open, the IPv6 address gets a single trial probe instead of a full scan
+    probes.clear()
+    monkeypatch.setattr(relay_health, "time", lambda: NOW + COOLDOWN)
+    results = guarded_probe([relay, other], count=3, family="dual", health=health, probe_function=probe_dual_stack)
+    assert list(results[hostname]) == ["ipv4"]
+    assert sorted(probe for probe in probes if probe[0] in ("127.0.0.1", "::1")) == [("127.0.0.1", 3), ("::1", 1)]
+    assert state(health, hostname, NOW + 3 * COOLDOWN - 1, "ipv6") == OPEN  # The failed trial doubled it
+    assert state(health, hostname, NOW + 3 * COOLDOWN, "ipv6") == HALF_OPEN
+    assert state(health, hostname, NOW + COOLDOWN, "ipv4") == CLOSED
+
+
+def test_dual_stack_trial_that_answers_is_probed_in_full(stores, relay, monkeypatch):
+    _, health = stores
+    hostname = relay["hostname"]
+    open_breaker(health, hostname, family="ipv6")
+    probes = []
+
+    def probe(addr, count, timeout=1000, ipv6=False, backend=None):
+        probes.append((addr, count))
+        return [1.0] * count
+
+    monkeypatch.setattr(ping_utilities, "probe", probe)
+    monkeypatch.setattr(relay_health, "time", lambda: NOW + COOLDOWN)
+    results = guarded_probe([relay], count=3, family="dual", health=health, probe_function=probe_dual_stack)
+    assert sorted(results[hostname]) == ["ipv4", "ipv6"]
+    assert sorted(probes) == [("127.0.0.1", 3), ("::1", 1), ("::1", 3)]
+    assert state(health, hostname, NOW + COOLDOWN, "ipv6") == CLOSED
+
+
+def test_open_breakers_are_only_extended_by_trials(stores):
+    _, health = stores
+    hostname = "se-got-wg-001"
+    open_breaker(health, hostname)
+    fail(health, hostname, now=NOW + COOLDOWN - 1)  # Probed while still open, e.g. outside guarded_probe
+    assert state(health, hostname, NOW + COOLDOWN, "ipv4") == HALF_OPEN
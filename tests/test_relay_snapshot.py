@@ -0,0 +1,60 @@
+import pytest
+from utils.relay_snapshot import writeSnapshot, loadSnapshot
+from utils.relay_utilities import diffRelays, ACTIVE, OWNED, BANDWIDTH
+from utils.relay_catalog import RelayCatalog
+
+
+@pytest.fixture
+def round_trip(tmp_path):
+    def write_and_load(relays):
+        path = str(tmp_path / "relays.snapshot")
+        writeSnapshot(relays, 1234.5, path)
+        return loadSnapshot(path)
+    return write_and_load
+
+
+def test_round_trip(round_trip, relay):
+    relays = round_trip([relay, dict(relay, hostname="se-got-wg-002", owned=False, active=False)])
+    assert relays.snapshot.timestamp == 1234.5
+    assert [dict(loaded) for loaded in relays] == [relay, dict(relay, hostname="se-got-wg-002", owned=False,
+                                                               active=False)]
+    assert relays[1][ACTIVE] is False and relays[0][BANDWIDTH] == 10
+
+
+@pytest.mark.parametrize("field", [ACTIVE, OWNED, BANDWIDTH])
+def test_absent_fields_stay_absent(round_trip, relay, field):
+    del relay[field]
+    loaded = round_trip([relay])[0]
+    assert field not in loaded
+    with pytest.raises(KeyError):
+        loaded[field]
+    assert dict(loaded) == relay
+    assert not any(diffRelays([relay], [loaded]).values())
+
+
+def test_missing_active_means_active(round_trip, relay, stores):
+    del relay[ACTIVE]
+    loaded = round_trip([relay])[0]
+    assert loaded.get(ACTIVE, True) is True
+    _, health = stores
+    probe, trial, skipped = health.plan([loaded])
+    assert probe == [loaded] and not skipped
+
+
+@pytest.mark.parametrize("fields", [{OWNED: None}, {ACTIVE: 1}, {BANDWIDTH: None}, {BANDWIDTH: 2.5}])
+def test_values_that_dont_fit_a_column_are_kept(round_trip, relay, fields):
+    relay.update(fields)
+    loaded = round_trip([relay])[0]
+    assert dict(loaded) == relay
+    for name, value in fields.items():
+        assert loaded[name] == value and type(loaded[name]) is type(value)
+
+
+def test_catalog_from_snapshot_matches_dicts(round_trip, relay):
+    relays = [relay, dict(relay, hostname="se-got-wg-002", owned=False), dict(relay, hostname="se-got-wg-003")]
+    del relays[2][OWNED], relays[2][BANDWIDTH]
+    from_snapshot, from_dicts = RelayCatalog(round_trip(relays)), RelayCatalog(relays)
+    for catalog in (from_snapshot, from_dicts):
+        assert [r["hostname"] for r in catalog.query(country="Sweden", owned=True)] == ["se-got-wg-001"]
+        assert [r["hostname"] for r in catalog.query(country="Sweden", min_bandwidth=1)] == ["se-got-wg-001",
+                                                                                         "se-got-wg-002"]
@@ -0,0 +1,152 @@
+import json
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils import relay_utilities, relay_snapshot
+from utils.relay_utilities import (diffRelays, readCache, writeCache, refreshRelays, loadCachedRelays,
+                                   CACHE_VERSION)
+
+ETAG = '"v1"'
+LAST_MODIFIED = "Wed, 14 Oct 2026 08:00:00 GMT"
+
+
+class RelayAPI:
+    """Serves a relay list with an ETag and a Last-Modified date, answering 304 to a matching If-None-Match."""
+
+    def __init__(self):
+        self.relays = []
+        self.status = None  # Forced status, e.g. 500
+        self.requests = []  # Headers of every request
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                api.requests.append(dict(self.headers))
+                if api.status is not None:
+                    self.send_error(api.status)
+                    return
+                if self.headers.get("If-None-Match") == ETAG:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                body = json.dumps(api.relays).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", ETAG)
+                self.send_header("Last-Modified", LAST_MODIFIED)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/relays/"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def relay_api(tmp_path, monkeypatch):
+    """A local relay API, with the relay cache and snapshot in a temporary directory."""
+    api = RelayAPI()
+    monkeypatch.setattr(relay_utilities, "RELAYS_LINK", api.url)
+    monkeypatch.setattr(relay_utilities, "RELAYS_FILE", str(tmp_path / "relays.json"))
+    monkeypatch.setattr(relay_snapshot, "SNAPSHOT_FILE", str(tmp_path / "relays.snapshot"))
+    monkeypatch.setattr(relay_utilities, "_session", None)
+    yield api
+    api.close()
+
+
+def test_diff_relays(relay):
+    moved = dict(relay, hostname="se-got-wg-002")
+    gone = dict(relay, hostname="se-got-wg-003")
+    new = dict(relay, hostname="se-got-wg-004")
+    diff = diffRelays([relay, moved, gone], [relay, dict(moved, city_name="Malmö"), new])
+    assert diff["added"] == [new]
+    assert diff["removed"] == [gone]
+    assert diff["changed"] == [dict(moved, city_name="Malmö")]
+    assert diffRelays([relay], [dict(relay)]) == {"added": [], "removed": [], "changed": []}
+
+
+def test_refresh_downloads_and_caches(relay_api, relay):
+    relay_api.relays = [relay]
+    relays, diff = refreshRelays()
+    assert relays == [relay] and diff["added"] == [relay]
+    assert "If-None-Match" not in relay_api.requests[0]
+
+    cache = readCache()
+    assert cache["etag"] == ETAG and cache["last_modified"] == LAST_MODIFIED and cache["relays"] == [relay]
+    snapshot_relays, timestamp = loadCachedRelays()  # The snapshot is written along with the cache
+    assert list(map(dict, snapshot_relays)) == [relay] and timestamp == cache["timestamp"]
+
+
+def test_refresh_revalidates_with_etag(relay_api, relay):
+    relay_api.relays = [relay]
+    refreshRelays()
+    relays, diff = refreshRelays()
+    assert relay_api.requests[1]["If-None-Match"] == ETAG
+    assert relay_api.requests[1]["If-Modified-Since"] == LAST_MODIFIED
+    assert relays == [relay] and not any(diff.values())
+    assert readCache()["etag"] == ETAG  # Kept although the 304 carried no ETag
+
+
+def test_refresh_reports_changes(relay_api, relay):
+    writeCache({"version": CACHE_VERSION, "timestamp": 1.0, "etag": '"v0"', "last_modified": None,
+                "relays": [relay]})
+    new = dict(relay, hostname="se-got-wg-002")
+    relay_api.relays = [new]
+    relays, diff = refreshRelays()
+    assert relay_api.requests[0]["If-None-Match"] == '"v0"'
+    assert relays == [new] and diff == {"added": [new], "removed": [relay], "changed": []}
+
+
+def test_unexpected_304_without_cache(relay_api):
+    relay_api.status = 304  # Nothing cached to fall back on, so there is nothing to return either
+    assert refreshRelays() == ([], {"added": [], "removed": [], "changed": []})
+    with pytest.raises(OSError):
+        readCache()
+
+
+def test_refresh_falls_back_to_cache_when_api_fails(relay_api, relay):
+    writeCache({"version": CACHE_VERSION, "timestamp": 1.0, "etag": None, "last_modified": None,
+                "relays": [relay]})
+    relay_api.status = 500
+    relays, diff = refreshRelays()
+    assert relays == [relay] and not any(diff.values())
+    assert readCache()["timestamp"] == 1.0  # Not marked as fresh
+
+
+def test_refresh_without_cache_or_api(relay_api):
+    relay_api.status = 503
+    assert refreshRelays() == ([], {"added": [], "removed": [], "changed": []})
+
+
+def test_read_cache_migrates_version_1(relay_api, relay):
+    with open(relay_utilities.RELAYS_FILE, "w") as f:
+        json.dump([1234.5, relay], f)
+    assert readCache() == {"version": CACHE_VERSION, "timestamp": 1234.5, "etag": None, "last_modified": None,
+                           "relays": [relay]}
+
+    relay_api.relays = [relay]
+    relays, diff = refreshRelays()  # The old cache is revalidated without validators and rewritten
+    assert "If-None-Match" not in relay_api.requests[0]
+    assert not any(diff.values())
+    with open(relay_utilities.RELAYS_FILE) as f:
+        assert json.load(f)["version"] == CACHE_VERSION
+
+
+@pytest.mark.parametrize("content", [[], ["not a timestamp"], {"version": CACHE_VERSION + 1, "relays": []}])
+def test_read_cache_rejects_unknown_formats(relay_api, content):
+    with open(relay_utilities.RELAYS_FILE, "w") as f:
+        json.dump(content, f)
+    with pytest.raises(ValueError):
+        readCache()
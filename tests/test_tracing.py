@@ -0,0 +1,22 @@
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+from utils.tracing import profile
+
+
+def work_in_worker(n):
+    return sum(i * i for i in range(n))
+
+
+def work_in_caller(n):
+    return sum(range(n))
+
+
+def test_profile_includes_worker_threads(tmp_path):
+    path = str(tmp_path / "run.prof")
+    with profile(path):
+        work_in_caller(1000)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(work_in_worker, [1000] * 6))
+    calls = {function: stats[1] for (_, _, function), stats in pstats.Stats(path).stats.items()}
+    assert calls["work_in_caller"] == 1
+    assert calls["work_in_worker"] == 6
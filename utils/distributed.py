@@ -0,0 +1,256 @@
+"""
+Multi-vantage scanning: probe agents run at each site, a coordinator shards the relay list across them and
+merges their answers into a latency matrix with one column per vantage point.
+
+Agents speak JSON over HTTP:
+    GET  /info   -> {"vantage": "stockholm", "backend": "auto", "max_workers": 32}
+    POST /probe  <- {"relays": [{"hostname", "ipv4_addr_in", "ipv6_addr_in"}], "count": 5, "timeout": 1000,
+                     "family": "ipv4"}
+                 -> {"vantage": "stockholm", "elapsed": 1.2, "results": [{"hostname", "ip", "samples"}]}
+Samples are round-trip times in milliseconds, null for lost probes.
+An agent started with a token only answers requests carrying it as "Authorization: Bearer <token>".
+"""
+import hmac
+import json
+import math
+import threading
+import urllib.request
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.relay_utilities import HOSTNAME, IPV4, IPV6
+from utils.ping_utilities import probe_relays, DEFAULT_MAX_WORKERS
+from utils.latency_stats import ProbeResult
+from utils.progress import emit
+
+DEFAULT_AGENT_PORT = 8765
+MAX_COUNT = 100  # Probes per relay an agent accepts in one request
+MAX_RELAYS = 2000  # Relays an agent accepts in one request; coordinators split larger shards
+MAX_BODY = 1024 * 1024  # Bytes of request body an agent reads at most
+REQUEST_OVERHEAD = 30  # Seconds allowed on top of the expected probe time before an agent request times out
+
+
+def _relay_payload(relay):
+    """The part of a relay dict an agent needs: its hostname and addresses."""
+    return {HOSTNAME: relay[HOSTNAME], IPV4: relay.get(IPV4), IPV6: relay.get(IPV6)}
+
+
+def _chunks(relays, size):
+    return [relays[start:start + size] for start in range(0, len(relays), size)] or [relays]
+
+
+def _samples_payload(result):
+    return [None if math.isnan(sample) else sample for sample in result.samples]
+
+
+class ProbeAgent:
+    """
+    Probes the relays a coordinator sends it from this machine, reporting results as vantage point `vantage`.
+    Several agents may share a vantage (e.g. one host running a few agents) to split its scans between them.
+    Listens on localhost by default; an agent will probe whatever addresses it is sent, so one reachable from
+    other hosts should be given a `token` that its coordinators share.
+    """
+
+    def __init__(self, vantage, host="127.0.0.1", port=DEFAULT_AGENT_PORT, backend=None,
+                 max_workers=DEFAULT_MAX_WORKERS, token=None, max_relays=MAX_RELAYS):
+        self.vantage = vantage
+        self.backend = backend
+        self.max_workers = max_workers
+        self.token = token
+        self.max_relays = max_relays
+        self.scans = 0
+        self.probed = 0
+        self._lock = threading.Lock()
+        agent = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                if self.path != "/info":
+                    self.send_error(404)
+                    return
+                self._reply({"vantage": agent.vantage, "backend": agent.backend or "auto",
+                             "max_workers": agent.max_workers, "max_relays": agent.max_relays})
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+                if self.path != "/probe":
+                    self.send_error(404)
+                    return
+                try:
+                    length = int(self.headers["Content-Length"])
+                except (KeyError, TypeError, ValueError):
+                    self.send_error(411)
+                    return
+                if not 0 <= length <= MAX_BODY:
+                    self.send_error(413, f"Request bodies are limited to {MAX_BODY} bytes")
+                    return
+                try:
+                    request = json.loads(self.rfile.read(length))
+                    if len(request["relays"]) > agent.max_relays:
+                        self.send_error(413, f"At most {agent.max_relays} relays per request")
+                        return
+                    relays = [_relay_payload(relay) for relay in request["relays"]]
+                    count = max(1, min(int(request.get("count", 1)), MAX_COUNT))
+                    timeout = max(1, int(request.get("timeout", 1000)))
+                    family = request.get("family", "ipv4")
+                    if family not in ("ipv4", "ipv6"):
+                        raise ValueError(f"Unknown address family {family!r}")
+                except (ValueError, KeyError, TypeError) as e:
+                    self.send_error(400, str(e))
+                    return
+                self._reply(agent.probe(relays, count, timeout, family))
+
+            def _authorized(self):
+                """Check the request's token; answers 401 and returns False if it is missing or wrong."""
+                if agent.token is None:
+                    return True
+                expected = f"Bearer {agent.token}".encode("utf-8")
+                if hmac.compare_digest(self.headers.get("Authorization", "").encode("utf-8"), expected):
+                    return True
+                self.send_error(401)
+                return False
+
+            def _reply(self, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Every result is already printed by probe_relays
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def probe(self, relays, count, timeout, family="ipv4"):
+        """Probe the relays and return the /probe response payload."""
+        start = perf_counter()
+        results = probe_relays(relays, count=count, timeout=timeout, max_workers=self.max_workers,
+                               backend=self.backend, family=family)
+        with self._lock:
+            self.scans += 1
+            self.probed += len(results)
+        return {
+            "vantage": self.vantage,
+            "elapsed": perf_counter() - start,
+            "results": [{"hostname": result.hostname, "ip": result.ip, "samples": _samples_payload(result)}
+                        for result in results.values()],
+        }
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _request(url, payload=None, timeout=REQUEST_OVERHEAD, token=None):
+    """GET `url`, or POST `payload` to it as JSON, and return the decoded JSON response."""
+    data = None if payload is None else json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json"}
+    if token is not None:
+        headers["Authorization"] = f"Bearer {token}"
+    request = urllib.request.Request(url, data=data, headers=headers)
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+class Coordinator:
+    """
+    Drives a set of agents given by base URL (e.g. "http://10.0.0.5:8765"). Every vantage point measures every
+    relay; the relays are sharded across the agents of the same vantage so they finish roughly
+    len(agents) times sooner. A shard whose agent fails is retried once on another agent of that vantage.
+    `token` is sent to agents that require one.
+    """
+
+    def __init__(self, agents, output_text=None, token=None):
+        self.agents = [agent.rstrip("/") for agent in agents]
+        self.output_text = output_text
+        self.token = token
+        self.vantages = {}  # Agent URL -> vantage name
+        self.workers = {}  # Agent URL -> probes it runs at once
+        self.max_relays = {}  # Agent URL -> relays it accepts per request
+
+    def discover(self):
+        """Ask every agent for its vantage; agents that don't answer are left out. Returns {vantage: [urls]}."""
+        self.vantages = {}
+        for agent in self.agents:
+            try:
+                info = _request(f"{agent}/info", token=self.token)
+                self.vantages[agent] = info["vantage"]
+                self.workers[agent] = max(1, int(info.get("max_workers", DEFAULT_MAX_WORKERS)))
+                self.max_relays[agent] = max(1, int(info.get("max_relays", MAX_RELAYS)))
+            except (OSError, ValueError, KeyError) as e:
+                emit(self.output_text, f"Agent {agent} is unavailable: {e}")
+        groups = {}
+        for agent, vantage in self.vantages.items():
+            groups.setdefault(vantage, []).append(agent)
+        return groups
+
+    def shards(self, relays):
+        """Split the relays across the agents of each vantage: a list of (vantage, agent URL, relays)."""
+        shards = []
+        for vantage, agents in self.discover().items():
+            for index, agent in enumerate(agents):
+                # Interleaved so near and far relays, and with them the slow timeouts, are spread evenly
+                shard = relays[index::len(agents)]
+                if shard:
+                    shards.append((vantage, agent, shard))
+        return shards
+
+    def _probe_shard(self, vantage, agent, relays, count, timeout, family):
+        siblings = [other for other, name in self.vantages.items() if name == vantage and other != agent]
+        for attempt in [agent] + siblings[:1]:
+            response = {"vantage": vantage, "elapsed": 0.0, "results": []}
+            try:
+                # Shards larger than the agent accepts at once are sent in several requests
+                for chunk in _chunks(relays, self.max_relays[attempt]):
+                    payload = {"relays": [_relay_payload(relay) for relay in chunk], "count": count,
+                               "timeout": timeout, "family": family}
+                    # Agents probe up to max_workers relays at once; allow for a request of timeouts plus some slack
+                    expected = math.ceil(len(chunk) / self.workers[attempt]) * count * timeout / 1000
+                    answer = _request(f"{attempt}/probe", payload, timeout=expected + REQUEST_OVERHEAD,
+                                      token=self.token)
+                    response["vantage"] = answer["vantage"]
+                    response["elapsed"] += answer["elapsed"]
+                    response["results"] += answer["results"]
+                return attempt, response
+            except (OSError, ValueError, KeyError) as e:
+                emit(self.output_text, f"Agent {attempt} ({vantage}) failed: {e}")
+        return agent, None
+
+    def scan(self, relays, count=1, timeout=1000, family="ipv4"):
+        """
+        Probe the relays from every vantage point at once.
+        Returns a dictionary with hostname as the key and a {vantage: ProbeResult} dictionary as the value.
+        """
+        matrix = {}
+        shards = self.shards(relays)
+        if not shards:
+            raise RuntimeError("No agent is reachable.")
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            futures = [executor.submit(self._probe_shard, vantage, agent, shard, count, timeout, family)
+                       for vantage, agent, shard in shards]
+            for future in as_completed(futures):
+                agent, response = future.result()
+                if response is None:
+                    continue
+                vantage = response["vantage"]
+                for entry in response["results"]:
+                    result = ProbeResult(entry["hostname"], entry["ip"], entry["samples"])
+                    matrix.setdefault(result.hostname, {})[vantage] = result
+                emit(self.output_text, f"Agent {agent} ({vantage}): {len(response['results'])} server(s) "
+                                       f"in {response['elapsed']:.1f} s.")
+        return matrix
@@ -0,0 +1,46 @@
+from utils.ping_utilities import probe_targets, relay_target, DEFAULT_MAX_WORKERS
+from utils.latency_stats import score_balanced, score_result
+
+FAMILIES = ("ipv4", "ipv6")
+BEST = "best"  # Rank each relay by whichever of its families scores better
+
+
+def probe_dual_stack(relays, count=1, timeout=1000, output_text=None, stop_animation=None,
+                     max_workers=DEFAULT_MAX_WORKERS, on_result=None, backend=None, families=None):
+    """
+    Probe the IPv4 and the IPv6 address of every relay concurrently, through one pool of at most `max_workers`
+    probes shared by both families, so a dual-stack scan waits on the network no longer than a single-stack one
+    as long as the pool has room. Both addresses of a relay are queued next to each other.
+    Returns a dictionary with hostname as the key and a {family: ProbeResult} dictionary as the value;
+    a family is missing when the relay has no address for it. `on_result(family, result)` is called as each finishes.
+    `families` maps hostnames to the families to probe them over (e.g. those whose circuit breaker isn't open);
+    relays not in it are probed over both.
+    """
+    targets = []
+    for relay in relays:
+        for family in FAMILIES if families is None else families.get(relay_target(relay)[0], FAMILIES):
+            hostname, ip = relay_target(relay, family)
+            if ip:
+                targets.append(((hostname, family), hostname, ip, family == "ipv6"))
+
+    callback = None
+    if on_result is not None:
+        callback = lambda key, result: on_result(key[1], result)
+    results = {}
+    for (hostname, family), result in probe_targets(targets, count=count, timeout=timeout, output_text=output_text,
+                                                    stop_animation=stop_animation, max_workers=max_workers,
+                                                    on_result=callback, backend=backend).items():
+        results.setdefault(hostname, {})[family] = result
+    return results
+
+
+def preferred_family(families, family=BEST, score=score_balanced):
+    """
+    Return (family, ProbeResult) for one relay's {family: ProbeResult}: the requested family,
+    or with BEST the one that scores better (IPv4 on a tie). Returns (None, None) if the family wasn't probed.
+    """
+    if family != BEST:
+        return (family, families[family]) if family in families else (None, None)
+    return min(((name, families[name]) for name in FAMILIES if name in families),
+               key=lambda item: score_result(item[1], score), default=(None, None))
+
@@ -0,0 +1,35 @@
+from queue import SimpleQueue, Empty
+
+
+class EventQueue:
+    """
+    Hand-off between worker threads and the Tk main loop, which must be the only thread touching widgets.
+    Workers only append to a lock-free queue (`sink(target)` callbacks for progress events, `call_soon`
+    for anything else), so probing never waits for the GUI. The main loop takes them off in batches with drain().
+    """
+
+    def __init__(self):
+        self._queue = SimpleQueue()
+
+    def sink(self, target):
+        """Return a progress callback (see utils.progress) that queues its events for `target`, e.g. a text widget."""
+        put = self._queue.put
+        return lambda event: put((target, event))
+
+    def call_soon(self, function, *args):
+        """Queue `function(*args)` to run on the thread that drains the queue."""
+        self._queue.put((None, (function, args)))
+
+    def drain(self, limit):
+        """Return up to `limit` queued (target, event) pairs in order; target None marks a (function, args) call."""
+        batch = []
+        get = self._queue.get_nowait
+        try:
+            while len(batch) < limit:
+                batch.append(get())
+        except Empty:
+            pass
+        return batch
+
+    def empty(self):
+        return self._queue.empty()
@@ -0,0 +1,164 @@
+import socket
+import select
+from collections import deque
+from time import perf_counter
+from utils.probe_backends import build_echo_request, parse_echo_reply, open_icmp_socket, next_identifier
+from utils.ping_utilities import relay_target, report_result, STOP_POLL_INTERVAL
+from utils.latency_stats import ProbeResult
+from utils.progress import emit
+
+DEFAULT_RATE = 1000  # Echo requests sent per second across the whole fleet
+SEQUENCE_SPACE = 0x10000  # ICMP sequence numbers are 16 bits
+
+
+def open_sweep_socket(ipv6=False):
+    """
+    Open the single socket used for a sweep.
+    Prefers an unprivileged datagram socket and falls back to a raw socket (root/administrator).
+    """
+    try:
+        return open_icmp_socket(ipv6), False
+    except OSError:
+        proto = socket.IPPROTO_ICMPV6 if ipv6 else socket.IPPROTO_ICMP
+        family = socket.AF_INET6 if ipv6 else socket.AF_INET
+        return socket.socket(family, socket.SOCK_RAW, proto), True
+
+
+def sweep(addresses, count=1, timeout=1000, rate=DEFAULT_RATE, ipv6=False, stop_animation=None, on_host_done=None):
+    """
+    Send `count` echo requests to every address over one socket, paced at `rate` packets per second.
+    Replies are matched by sequence number (and identifier on raw sockets) in a single receive loop.
+    Returns a list with one sample list per address, in the order of `addresses`
+    (round-trip times in milliseconds, None for lost probes).
+    `on_host_done(index, samples)` is called as soon as all probes of an address are resolved.
+    """
+    samples = [[None] * count for _ in addresses]
+    remaining = [count] * len(addresses)
+    if not addresses:
+        return samples
+
+    interval = 1.0 / max(rate, 1)
+    timeout_s = max(timeout, 1) / 1000.0
+    # Probes are sent round by round so consecutive packets to the same host are spread out
+    schedule = ((index, probe) for probe in range(count) for index in range(len(addresses)))
+    outstanding = {}  # sequence -> (index, probe, sent_at)
+    expiry = deque()  # sequences in send order; they also expire in that order
+    sequence = 0
+    next_send = perf_counter()
+    exhausted = False
+
+    sock, raw = open_sweep_socket(ipv6)
+    identifier = next_identifier()
+    sock.setblocking(False)
+
+    def resolve(seq, rtt):
+        index, probe, _ = outstanding.pop(seq)
+        samples[index][probe] = rtt
+        remaining[index] -= 1
+        if remaining[index] == 0 and on_host_done is not None:
+            on_host_done(index, samples[index])
+
+    try:
+        while not exhausted or outstanding:
+            if stop_animation is not None and stop_animation.is_set():
+                break
+            now = perf_counter()
+
+            # Send every probe that is due, unless that would reuse a sequence still in flight
+            while not exhausted and now >= next_send and sequence not in outstanding:
+                item = next(schedule, None)
+                if item is None:
+                    exhausted = True
+                    break
+                index, probe = item
+                try:
+                    sock.sendto(build_echo_request(identifier, sequence, ipv6=ipv6), (addresses[index], 0))
+                    outstanding[sequence] = (index, probe, perf_counter())
+                    expiry.append(sequence)
+                except OSError:
+                    outstanding[sequence] = (index, probe, now)
+                    resolve(sequence, None)
+                sequence = (sequence + 1) % SEQUENCE_SPACE
+                next_send += interval
+                now = perf_counter()
+
+            # Expire probes that have waited longer than the timeout
+            while expiry and (expiry[0] not in outstanding or now - outstanding[expiry[0]][2] >= timeout_s):
+                seq = expiry.popleft()
+                if seq in outstanding:
+                    resolve(seq, None)
+
+            # Sleep until a reply arrives, the next probe is due or the oldest probe expires
+            wake = now + STOP_POLL_INTERVAL
+            if not exhausted:
+                wake = min(wake, next_send)
+            if expiry:
+                wake = min(wake, outstanding[expiry[0]][2] + timeout_s)
+            readable, _, _ = select.select([sock], [], [], max(0.0, wake - now))
+            if not readable:
+                continue
+
+            # Drain every reply that has arrived
+            while True:
+                try:
+                    packet, source = sock.recvfrom(2048)
+                except (BlockingIOError, InterruptedError):
+                    break
+                received_at = perf_counter()
+                reply = parse_echo_reply(packet, ipv6)
+                if reply is None:
+                    continue
+                reply_identifier, seq = reply
+                # Datagram sockets rewrite the identifier to the socket's port and only deliver our replies
+                if raw and reply_identifier != identifier:
+                    continue
+                entry = outstanding.get(seq)
+                if entry is None or addresses[entry[0]] != source[0]:
+                    continue
+                resolve(seq, (received_at - entry[2]) * 1000)
+    finally:
+        sock.close()
+    return samples
+
+
+def fleet_probe_relays(relays, count=1, timeout=1000, output_text=None, stop_animation=None,
+                       rate=DEFAULT_RATE, on_result=None, family="ipv4"):
+    """
+    Fleet scan mode for probe_relays: probe every relay from a single socket, over its `family` address.
+    Returns a dictionary with hostname as the key and a ProbeResult as the value.
+    Raises RuntimeError if no ICMP socket can be opened (neither unprivileged nor raw).
+    """
+    targets = [relay_target(relay, family) for relay in relays]
+    targets = [(hostname, ip) for hostname, ip in targets if ip]  # Skip relays without an IP to ping
+    results = {}
+
+    def host_done(index, host_samples):
+        hostname, ip = targets[index]
+        result = ProbeResult(hostname, ip, host_samples)
+        results[hostname] = result
+        report_result(result, output_text=output_text)
+        if on_result is not None:
+            on_result(result)
+
+    try:
+        sweep([ip for _, ip in targets], count=count, timeout=timeout, rate=rate, ipv6=family == "ipv6",
+              stop_animation=stop_animation, on_host_done=host_done)
+    except PermissionError as e:
+        raise RuntimeError(f"Fleet scan needs an ICMP socket, which this system doesn't allow: {e}")
+    if stop_animation is not None and stop_animation.is_set():
+        emit(output_text, "Fleet scan stopped by user.")
+    return results
+
+
+def fleet_scan_relays(relays, count=1, timeout=1000, output_text=None, stop_animation=None,
+                      rate=DEFAULT_RATE, on_result=None):
+    """
+    Fleet scan mode for get_latency_for_relays: ping every relay from a single socket.
+    Returns a dictionary with hostname as the key and average latency as the value.
+    """
+    callback = None
+    if on_result is not None:
+        callback = lambda result: on_result(result.hostname, result.latency)
+    results = fleet_probe_relays(relays, count=count, timeout=timeout, output_text=output_text,
+                                 stop_animation=stop_animation, rate=rate, on_result=callback)
+    return {hostname: result.latency for hostname, result in results.items()}
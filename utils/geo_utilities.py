@@ -0,0 +1,27 @@
+import math
+
+EARTH_RADIUS_KM = 6371.0088  # Mean Earth radius
+# Great-circle distances on the mean sphere are within about 0.56% of WGS-84 geodesic distances
+SPHERE_ERROR = 0.0056
+
+
+def unit_vector(lat, lon):
+    """Convert latitude/longitude in degrees to a 3D unit vector."""
+    lat, lon = math.radians(lat), math.radians(lon)
+    cos_lat = math.cos(lat)
+    return cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat)
+
+
+def chord_to_km(chord):
+    """Convert the straight-line distance between two unit vectors to a great-circle distance in km."""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(chord / 2, 1.0))
+
+
+def km_to_chord(km):
+    """Inverse of chord_to_km, for radius queries on unit vectors."""
+    return 2 * math.sin(min(km / EARTH_RADIUS_KM, math.pi) / 2)
+
+
+def great_circle_km(a, b):
+    """Great-circle distance in km between two unit vectors (numerically stable for short distances too)."""
+    return chord_to_km(math.dist(a, b))
@@ -0,0 +1,144 @@
+import os
+import csv
+import json
+import random
+from time import sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils.rate_limiter import TokenBucket
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+NOMINATIM_RATE = 1.0  # Requests per second allowed by the Nominatim usage policy
+USER_AGENT = "mullvad-latency-tester (https://github.com/h4us91/mullvad-latency-tester)"
+REQUEST_TIMEOUT = 5  # Seconds per geocoding request
+RETRIES = 3  # Extra attempts after a failed request
+BACKOFF = 1.0  # Seconds before the first retry, doubled on each further retry
+MAX_WORKERS = 4  # Requests in flight at once; the rate limiter still decides how often one starts
+
+
+class GeocodingError(Exception):
+    """A geocoding request failed in a way that may succeed when retried."""
+
+
+def city_key(country, city):
+    """Key used in coordinates.json for a city."""
+    return f"{country}-{city}"
+
+
+class NominatimGeocoder:
+    """Geocoder backed by the Nominatim API (or a compatible server), sharing one session and rate limit."""
+
+    def __init__(self, url=NOMINATIM_URL, rate=NOMINATIM_RATE, retries=RETRIES, backoff=BACKOFF,
+                 timeout=REQUEST_TIMEOUT, session=None, limiter=None):
+        import requests
+        self.url = url
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = limiter or TokenBucket(rate)  # Pass a shared TokenBucket to pace several geocoders together
+        self.session = session or requests.Session()
+        self.session.headers.setdefault("User-Agent", USER_AGENT)
+
+    def _request(self, city, country):
+        self.limiter.acquire()
+        try:
+            response = self.session.get(self.url, params={"city": city, "country": country, "format": "json"},
+                                        timeout=self.timeout)
+        except Exception as e:
+            raise GeocodingError(str(e)) from e
+        if response.status_code == 429 or response.status_code >= 500:
+            raise GeocodingError(f"HTTP {response.status_code}")
+        response.raise_for_status()
+        data = response.json()
+        if data:
+            return float(data[0]["lat"]), float(data[0]["lon"])
+        return None  # The service doesn't know the city; retrying won't help
+
+    def geocode(self, city, country):
+        """Return (lat, lon) for a city, or None if it is unknown. Raises GeocodingError after the last retry."""
+        for attempt in range(self.retries + 1):
+            try:
+                return self._request(city, country)
+            except GeocodingError:
+                if attempt == self.retries:
+                    raise
+                sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+class GazetteerGeocoder:
+    """
+    Offline geocoder reading a local gazetteer file: either JSON in the coordinates.json format
+    ({"Country-City": [lat, lon]}) or CSV with country, city, lat and lon columns.
+    """
+
+    def __init__(self, path):
+        self.places = {}
+        if os.path.splitext(path)[1].lower() == ".csv":
+            with open(path, "r", newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    self.places[city_key(row["country"], row["city"]).lower()] = (float(row["lat"]), float(row["lon"]))
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                for key, (lat, lon) in json.load(f).items():
+                    self.places[key.lower()] = (float(lat), float(lon))
+
+    def geocode(self, city, country):
+        return self.places.get(city_key(country, city).lower())
+
+
+class ChainGeocoder:
+    """Try several geocoders in order, e.g. the offline gazetteer first and Nominatim for the rest."""
+
+    def __init__(self, *geocoders):
+        self.geocoders = geocoders
+
+    def geocode(self, city, country):
+        error = None
+        for geocoder in self.geocoders:
+            try:
+                coords = geocoder.geocode(city, country)
+            except GeocodingError as e:
+                error = e
+                continue
+            if coords:
+                return coords
+        if error is not None:
+            raise error
+        return None
+
+
+def geocode_cities(cities, geocoder, max_workers=MAX_WORKERS, on_result=None, stop_event=None):
+    """
+    Geocode (country, city) pairs concurrently, each distinct city only once.
+    `on_result(key, coords, error)` is called from the calling thread as each city finishes; coords is None
+    when the city is unknown or failed (then error holds the exception). Returns {key: coords} of the successes.
+    """
+    unique = {}
+    for country, city in cities:
+        unique.setdefault(city_key(country, city), (country, city))
+
+    found = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(geocoder.geocode, city, country): key for key, (country, city) in unique.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            if stop_event is not None and stop_event.is_set():
+                for pending in futures:
+                    pending.cancel()
+                break
+            try:
+                coords, error = future.result(), None
+            except Exception as e:
+                coords, error = None, e
+            if coords:
+                found[key] = coords
+            if on_result is not None:
+                on_result(key, coords, error)
+    return found
+
+
+def write_json_atomic(path, data):
+    """Write JSON to a temporary file next to `path` and move it into place, so readers never see half a file."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(data, file, indent=4)
+    os.replace(tmp_path, path)
@@ -0,0 +1,171 @@
+import os
+import math
+import sqlite3
+import threading
+from time import time
+from utils.paths import DATA_DIR
+from utils.latency_stats import LOSS_PENALTY
+
+HISTORY_FILE = os.path.join(DATA_DIR, "latency_history.sqlite3")
+HALF_LIFE = 6 * 3600  # Seconds after which a measurement counts half as much
+MAX_AGE = 3600  # Hosts without a measurement in the last hour are stale
+MIN_WEIGHT = 2.0  # Hosts with less decayed sample weight than this are uncertain
+TTL = 30 * 24 * 3600  # Measurements older than 30 days are evicted
+MAX_SAMPLES = 200000  # Upper bound on stored samples, the oldest are evicted first
+EVICT_EVERY = 10000  # Samples stored between evictions, so long-running monitors stay within the bounds
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    hostname TEXT NOT NULL,
+    ts REAL NOT NULL,
+    rtt REAL,  -- NULL for a lost probe
+    family TEXT NOT NULL DEFAULT 'ipv4'  -- Address family that was probed, "ipv4" or "ipv6"
+);
+CREATE INDEX IF NOT EXISTS samples_host_ts ON samples (hostname, ts);
+CREATE INDEX IF NOT EXISTS samples_ts ON samples (ts);
+"""
+
+
+class Estimate:
+    """Time-decayed latency estimate of one host built from its stored samples."""
+    __slots__ = ("hostname", "latency", "loss", "weight", "samples", "last_seen")
+
+    def __init__(self, hostname, latency, loss, weight, samples, last_seen):
+        self.hostname = hostname
+        self.latency = latency  # Decayed mean RTT in ms, None if no probe was ever answered
+        self.loss = loss  # Decayed loss in percent
+        self.weight = weight  # Sum of the decay weights, the effective number of recent samples
+        self.samples = samples
+        self.last_seen = last_seen
+
+    @property
+    def score(self):
+        """Ranking score like the balanced stats score: latency plus a loss penalty, lower is better."""
+        if self.latency is None:
+            return float('inf')
+        return self.latency + LOSS_PENALTY * self.loss
+
+
+class LatencyHistory:
+    """
+    On-disk history of every probe sample, keyed by hostname and address family, since a relay's IPv4 and IPv6
+    round-trip times can differ a lot and must not be averaged together.
+    Estimates weight each sample by 0.5 ** (age / half_life), so recent runs dominate but old ones still count.
+    """
+
+    def __init__(self, path=HISTORY_FILE, half_life=HALF_LIFE, ttl=TTL, max_samples=MAX_SAMPLES,
+                 evict_every=EVICT_EVERY):
+        self.path = path
+        self.half_life = half_life
+        self.ttl = ttl
+        self.max_samples = max_samples
+        self.evict_every = evict_every
+        self._since_evict = 0  # Samples stored since the last eviction
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.create_function("decay", 1, self._decay, deterministic=True)
+        self._conn.executescript(SCHEMA)
+        if "family" not in [row[1] for row in self._conn.execute("PRAGMA table_info(samples)")]:
+            with self._conn:  # Samples stored before families were kept apart are all IPv4
+                self._conn.execute("ALTER TABLE samples ADD COLUMN family TEXT NOT NULL DEFAULT 'ipv4'")
+        self.evict()
+
+    def _decay(self, age):
+        return 0.5 ** (max(age, 0.0) / self.half_life)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def record(self, result, ts=None, family="ipv4"):
+        """Store every sample of a ProbeResult of the `family` address."""
+        self.record_results([result], ts, family)
+
+    def record_results(self, results, ts=None, family="ipv4"):
+        """
+        Store every sample of several ProbeResults of the `family` address in one transaction,
+        evicting every `evict_every` samples.
+        """
+        ts = time() if ts is None else ts
+        rows = [(result.hostname, ts, None if math.isnan(sample) else sample, family)
+                for result in results for sample in result.samples]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT INTO samples (hostname, ts, rtt, family) VALUES (?, ?, ?, ?)", rows)
+            self._since_evict += len(rows)
+            due = self._since_evict >= self.evict_every
+        if due:
+            self.evict()
+
+    def estimates(self, hostnames=None, now=None, family="ipv4"):
+        """Return a dictionary with hostname as the key and an Estimate of its `family` address as the value."""
+        now = time() if now is None else now
+        query = """
+            SELECT hostname,
+                   SUM(decay(? - ts) * rtt) / NULLIF(SUM(CASE WHEN rtt IS NOT NULL THEN decay(? - ts) END), 0),
+                   100.0 * SUM(CASE WHEN rtt IS NULL THEN decay(? - ts) ELSE 0 END) / SUM(decay(? - ts)),
+                   SUM(decay(? - ts)),
+                   COUNT(*),
+                   MAX(ts)
+            FROM samples WHERE family = ? {where} GROUP BY hostname
+        """
+        params = [now] * 5 + [family]
+        where = ""
+        if hostnames is not None:
+            hostnames = list(hostnames)
+            if not hostnames:
+                return {}
+            where = f"AND hostname IN ({', '.join('?' * len(hostnames))})"
+            params += hostnames
+        with self._lock:
+            rows = self._conn.execute(query.format(where=where), params).fetchall()
+        return {row[0]: Estimate(*row) for row in rows}
+
+    def estimate(self, hostname, now=None, family="ipv4"):
+        return self.estimates([hostname], now, family).get(hostname)
+
+    def best(self, hostnames, now=None, family="ipv4"):
+        """Return the Estimate of the best host among `hostnames` from stored data alone, or None."""
+        estimates = [estimate for estimate in self.estimates(hostnames, now, family).values()
+                     if estimate.latency is not None]
+        return min(estimates, key=lambda estimate: estimate.score, default=None)
+
+    def needs_probe(self, hostnames, max_age=MAX_AGE, min_weight=MIN_WEIGHT, now=None, family="ipv4"):
+        """Return the hostnames whose data is missing, older than `max_age` seconds or too thin to trust."""
+        now = time() if now is None else now
+        estimates = self.estimates(hostnames, now, family)
+        return [hostname for hostname in hostnames
+                if hostname not in estimates
+                or now - estimates[hostname].last_seen > max_age
+                or estimates[hostname].weight < min_weight]
+
+    def stale_relays(self, relays, max_age=MAX_AGE, min_weight=MIN_WEIGHT, now=None, family="ipv4"):
+        """Filter relay dicts down to the ones that need probing over `family`."""
+        stale = set(self.needs_probe([relay["hostname"] for relay in relays], max_age, min_weight, now, family))
+        return [relay for relay in relays if relay["hostname"] in stale]
+
+    def evict(self, now=None):
+        """Drop samples older than the TTL, then the oldest samples beyond the size bound."""
+        now = time() if now is None else now
+        with self._lock, self._conn:
+            self._since_evict = 0
+            self._conn.execute("DELETE FROM samples WHERE ts < ?", (now - self.ttl,))
+            excess = self._conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0] - self.max_samples
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM samples WHERE rowid IN (SELECT rowid FROM samples ORDER BY ts LIMIT ?)", (excess,))
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history():
+    """Return the shared history store of the application, opening it on first use."""
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = LatencyHistory()
+        return _history
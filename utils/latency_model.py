@@ -0,0 +1,89 @@
+from utils.relay_utilities import HOSTNAME, COUNTRY_CODE, PROVIDER
+
+# Prior used before anything was measured: light in fibre covers ~200 km per ms one way, paths are
+# roughly 1.5x longer than the great circle, plus a few ms of fixed access/processing delay
+PRIOR_BASE = 5.0  # ms
+PRIOR_SLOPE = 0.015  # ms per km of great-circle distance
+MIN_REGION_POINTS = 3  # Hosts needed in a region before it gets its own line
+SHRINKAGE = 2.0  # Pseudo-count pulling sparse region lines and provider offsets towards the global fit
+
+
+def _weighted_line(points):
+    """Weighted least squares fit of rtt = base + slope * distance; points are (distance, rtt, weight)."""
+    total = sum(weight for _, _, weight in points)
+    mean_x = sum(distance * weight for distance, _, weight in points) / total
+    mean_y = sum(rtt * weight for _, rtt, weight in points) / total
+    sxx = sum(weight * (distance - mean_x) ** 2 for distance, _, weight in points)
+    sxy = sum(weight * (distance - mean_x) * (rtt - mean_y) for distance, rtt, weight in points)
+    slope = sxy / sxx if sxx > 0 else PRIOR_SLOPE
+    slope = max(slope, 0.0)  # Latency never falls with distance; a negative slope is noise
+    return mean_y - slope * mean_x, slope
+
+
+class LatencyModel:
+    """
+    Predicts a relay's RTT from its great-circle distance: one least-squares line per region (relay country)
+    plus a per-provider offset, both shrunk towards the global fit when a region or provider has few hosts.
+    """
+
+    def __init__(self):
+        self.base, self.slope = PRIOR_BASE, PRIOR_SLOPE
+        self.regions = {}  # country code -> (base, slope)
+        self.providers = {}  # provider -> offset in ms
+        self.points = 0
+
+    def fit(self, observations):
+        """
+        Fit from (relay, distance_km, rtt_ms, weight) observations, e.g. history estimates of probed relays.
+        Returns the model for chaining.
+        """
+        observations = [entry for entry in observations if entry[2] is not None and entry[3] > 0]
+        self.points = len(observations)
+        self.regions, self.providers = {}, {}
+        if len(observations) < 2:
+            return self
+
+        self.base, self.slope = _weighted_line([(distance, rtt, weight) for _, distance, rtt, weight in observations])
+
+        by_region = {}
+        for relay, distance, rtt, weight in observations:
+            by_region.setdefault(relay[COUNTRY_CODE], []).append((distance, rtt, weight))
+        for region, points in by_region.items():
+            if len(points) >= MIN_REGION_POINTS:
+                base, slope = _weighted_line(points)
+                share = len(points) / (len(points) + SHRINKAGE)
+                self.regions[region] = (share * base + (1 - share) * self.base, share * slope + (1 - share) * self.slope)
+
+        residuals = {}
+        for relay, distance, rtt, weight in observations:
+            residuals.setdefault(relay.get(PROVIDER), []).append(rtt - self._line(relay, distance))
+        for provider, values in residuals.items():
+            self.providers[provider] = sum(values) / (len(values) + SHRINKAGE)
+        return self
+
+    def _line(self, relay, distance):
+        base, slope = self.regions.get(relay[COUNTRY_CODE], (self.base, self.slope))
+        return base + slope * distance
+
+    def predict(self, relay, distance):
+        """Expected RTT in ms for a relay at `distance` km."""
+        return self._line(relay, distance) + self.providers.get(relay.get(PROVIDER), 0.0)
+
+
+def fit_from_history(history, relays, distances):
+    """
+    Fit a LatencyModel from the history store. `distances` maps hostname -> km from the current location.
+    Each host's decayed estimate is one observation, weighted by its decayed sample weight.
+    """
+    relays = [relay for relay in relays if relay[HOSTNAME] in distances]
+    estimates = history.estimates([relay[HOSTNAME] for relay in relays])
+    observations = [(relay, distances[relay[HOSTNAME]], estimates[relay[HOSTNAME]].latency, estimates[relay[HOSTNAME]].weight)
+                    for relay in relays if relay[HOSTNAME] in estimates]
+    return LatencyModel().fit(observations)
+
+
+def rank_by_prediction(model, relays, distances):
+    """Return [(relay, distance, predicted ms)] for relays with a known distance, most promising first."""
+    ranked = [(relay, distances[relay[HOSTNAME]], model.predict(relay, distances[relay[HOSTNAME]]))
+              for relay in relays if relay[HOSTNAME] in distances]
+    return sorted(ranked, key=lambda entry: entry[2])
@@ -0,0 +1,153 @@
+import math
+from array import array
+
+LOST = math.nan  # Marker stored in the sample array for a probe that got no reply
+LOSS_PENALTY = 10.0  # Milliseconds added to the balanced score per percent of packet loss
+
+
+class LatencyStats:
+    """Summary statistics of the probes sent to one host. Latencies are in milliseconds, loss in percent."""
+    __slots__ = ("sent", "received", "loss", "min", "max", "mean", "median", "p90", "p99", "stddev", "jitter")
+
+    def __init__(self, sent, received, loss, min=None, max=None, mean=None, median=None,
+                 p90=None, p99=None, stddev=None, jitter=None):
+        self.sent = sent
+        self.received = received
+        self.loss = loss
+        self.min = min
+        self.max = max
+        self.mean = mean
+        self.median = median
+        self.p90 = p90
+        self.p99 = p99
+        self.stddev = stddev
+        self.jitter = jitter
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ProbeResult:
+    """Raw round-trip samples of one host, kept in a compact array with NaN for lost probes."""
+    __slots__ = ("hostname", "ip", "samples", "_stats")
+
+    def __init__(self, hostname, ip, samples=()):
+        self.hostname = hostname
+        self.ip = ip
+        self.samples = array("d", (LOST if sample is None else sample for sample in samples))
+        self._stats = None
+
+    def add_samples(self, samples):
+        """Append more probe samples (None for lost probes)."""
+        self.samples.extend(LOST if sample is None else sample for sample in samples)
+        self._stats = None
+
+    def merge(self, other):
+        """Append the samples of another result for the same host."""
+        self.samples.extend(other.samples)
+        self._stats = None
+
+    def stats(self):
+        if self._stats is None:
+            self._stats = compute_stats(self.samples)
+        return self._stats
+
+    @property
+    def latency(self):
+        """Average latency, or float('inf') if the host never answered (the historical latency dict value)."""
+        mean = self.stats().mean
+        return mean if mean is not None else float('inf')
+
+
+def _percentile(ordered, fraction):
+    """Linear interpolation percentile of an already sorted sequence."""
+    position = (len(ordered) - 1) * fraction
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def compute_stats(samples):
+    """
+    Compute loss, mean, median, p90/p99, standard deviation and jitter from a sample array.
+    Jitter is the mean absolute difference between successive received samples (RFC 3550 style, unsmoothed).
+    Mean, variance and jitter are accumulated in one pass over the samples.
+    """
+    sent = len(samples)
+    count = 0
+    total = 0.0
+    total_squares = 0.0
+    jitter_total = 0.0
+    previous = None
+    for sample in samples:
+        if sample != sample:  # NaN marks a lost probe
+            continue
+        count += 1
+        total += sample
+        total_squares += sample * sample
+        if previous is not None:
+            jitter_total += abs(sample - previous)
+        previous = sample
+
+    loss = 100.0 * (sent - count) / sent if sent else 100.0
+    if not count:
+        return LatencyStats(sent, 0, loss)
+
+    mean = total / count
+    ordered = sorted(sample for sample in samples if sample == sample)
+    return LatencyStats(
+        sent, count, loss,
+        min=ordered[0],
+        max=ordered[-1],
+        mean=mean,
+        median=_percentile(ordered, 0.5),
+        p90=_percentile(ordered, 0.9),
+        p99=_percentile(ordered, 0.99),
+        stddev=math.sqrt(max(total_squares / count - mean * mean, 0.0)),
+        jitter=jitter_total / (count - 1) if count > 1 else 0.0,
+    )
+
+
+def score_mean(stats):
+    return stats.mean
+
+
+def score_median(stats):
+    return stats.median
+
+
+def score_p90(stats):
+    return stats.p90
+
+
+def score_balanced(stats):
+    """Median latency plus jitter, with a penalty for packet loss."""
+    return stats.median + stats.jitter + LOSS_PENALTY * stats.loss
+
+
+# Scoring functions for ranking servers; lower is better
+SCORING_FUNCTIONS = {
+    "Average Latency": score_mean,
+    "Median Latency": score_median,
+    "90th Percentile": score_p90,
+    "Median + Jitter + Loss": score_balanced,
+}
+DEFAULT_SCORING = "Median + Jitter + Loss"
+
+
+def score_result(result, score=score_balanced):
+    """Score a probe result; hosts that never answered rank last."""
+    stats = result.stats()
+    if not stats.received:
+        return float('inf')
+    return score(stats)
+
+
+def rank_results(results, score=score_balanced):
+    """Return the probe results sorted from best to worst according to `score`."""
+    return sorted(results, key=lambda result: score_result(result, score))
+
+
+def best_result(results, score=score_balanced):
+    """Return the best probe result according to `score`, or None if there are no results."""
+    return min(results, key=lambda result: score_result(result, score), default=None)
@@ -0,0 +1,159 @@
+import threading
+from array import array
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils.relay_utilities import HOSTNAME, COUNTRY_CODE, CITY_CODE, TYPE, PROVIDER, OWNED
+
+# Upper bounds of the RTT histogram buckets in milliseconds (+Inf is implied)
+BUCKETS_MS = (5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000, 2000)
+LABEL_FIELDS = (("hostname", HOSTNAME), ("country_code", COUNTRY_CODE), ("city_code", CITY_CODE), ("type", TYPE),
+                ("provider", PROVIDER), ("owned", OWNED))
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(pairs):
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+
+class RelaySeries:
+    """Counters of one relay, with every label string it is rendered with built once at registration."""
+
+    __slots__ = ("labels", "bucket_labels", "buckets", "rtt_sum", "received", "sent")
+
+    def __init__(self, relay):
+        pairs = [(name, relay.get(field)) for name, field in LABEL_FIELDS]
+        pairs = [(name, str(value).lower() if isinstance(value, bool) else value) for name, value in pairs
+                 if value is not None]
+        self.labels = format_labels(pairs)
+        self.bucket_labels = [format_labels(pairs + [("le", bound)]) for bound in BUCKETS_MS + ("+Inf",)]
+        self.buckets = array("q", bytes(8 * (len(BUCKETS_MS) + 1)))  # Per bucket, made cumulative when rendered
+        self.rtt_sum = 0.0
+        self.received = 0
+        self.sent = 0
+
+
+class RelayMetrics:
+    """
+    Metrics registry for relay probing: per-relay RTT histograms, probe and loss counters, scan durations
+    and gauges of the probe engine. Samples are folded into bucket counters as they arrive, so a scrape
+    only formats counters and never walks raw samples.
+    """
+
+    def __init__(self):
+        self.series = {}
+        self.gauges = {}  # name -> (help, function returning the current value)
+        self.scan_count = 0
+        self.scan_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def register_relays(self, relays):
+        with self._lock:
+            for relay in relays:
+                if relay[HOSTNAME] not in self.series:
+                    self.series[relay[HOSTNAME]] = RelaySeries(relay)
+
+    def add_gauge(self, name, help_text, function):
+        self.gauges[name] = (help_text, function)
+
+    def observe(self, hostname, samples):
+        """Count the samples of one probe (ms, None for lost probes)."""
+        with self._lock:
+            series = self.series.get(hostname)
+            if series is None:
+                series = self.series[hostname] = RelaySeries({HOSTNAME: hostname})
+            for sample in samples:
+                series.sent += 1
+                if sample is None or sample != sample:
+                    continue
+                series.received += 1
+                series.rtt_sum += sample
+                series.buckets[bisect_left(BUCKETS_MS, sample)] += 1
+
+    def observe_scan(self, seconds):
+        with self._lock:
+            self.scan_count += 1
+            self.scan_seconds += seconds
+
+    def render(self, openmetrics=False):
+        """Render every metric in the Prometheus text format, or OpenMetrics when `openmetrics` is set."""
+        lines = []
+
+        def family(name, help_text, metric_type):
+            # OpenMetrics names counter families without the _total suffix their samples carry
+            family_name = name[:-len("_total")] if openmetrics and name.endswith("_total") else name
+            lines.append(f"# HELP {family_name} {help_text}")
+            lines.append(f"# TYPE {family_name} {metric_type}")
+
+        with self._lock:
+            series = list(self.series.values())
+            family("mullvad_relay_rtt_milliseconds", "Round-trip time of answered probes.", "histogram")
+            for relay in series:
+                total = 0
+                for labels, count in zip(relay.bucket_labels, relay.buckets):
+                    total += count
+                    lines.append(f"mullvad_relay_rtt_milliseconds_bucket{labels} {total}")
+                lines.append(f"mullvad_relay_rtt_milliseconds_sum{relay.labels} {relay.rtt_sum}")
+                lines.append(f"mullvad_relay_rtt_milliseconds_count{relay.labels} {relay.received}")
+
+            family("mullvad_relay_probes_sent_total", "Probes sent.", "counter")
+            lines.extend(f"mullvad_relay_probes_sent_total{relay.labels} {relay.sent}" for relay in series)
+            family("mullvad_relay_probes_lost_total", "Probes that got no reply.", "counter")
+            lines.extend(f"mullvad_relay_probes_lost_total{relay.labels} {relay.sent - relay.received}" for relay in series)
+            family("mullvad_relay_loss_ratio", "Fraction of probes lost since the exporter started.", "gauge")
+            lines.extend(f"mullvad_relay_loss_ratio{relay.labels} {(relay.sent - relay.received) / relay.sent}"
+                         for relay in series if relay.sent)
+
+            family("mullvad_scan_duration_seconds", "Time to probe every watched relay once.", "summary")
+            lines.append(f"mullvad_scan_duration_seconds_sum {self.scan_seconds}")
+            lines.append(f"mullvad_scan_duration_seconds_count {self.scan_count}")
+
+        for name, (help_text, function) in self.gauges.items():
+            family(name, help_text, "gauge")
+            lines.append(f"{name} {function()}")
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves a RelayMetrics registry at /metrics from a background thread."""
+
+    def __init__(self, metrics, host="127.0.0.1", port=9101):
+        registry = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+                body = registry.render(openmetrics).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes every few seconds would flood the console
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
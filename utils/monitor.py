@@ -0,0 +1,232 @@
+import heapq
+import random
+import threading
+from array import array
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
+from utils.ping_utilities import probe, relay_target, report_result, DEFAULT_MAX_WORKERS
+from utils.latency_stats import LOST, ProbeResult, compute_stats, score_balanced, score_result
+from utils.latency_history import get_history
+from utils.rate_limiter import TokenBucket
+from utils.ranking import IncrementalRanking
+from utils.progress import emit
+
+INTERVAL = 30.0  # Seconds between probes of a host outside the top of the ranking
+PRIORITY_INTERVAL = 10.0  # Seconds between probes of the top hosts
+PRIORITY_HOSTS = 3  # Hosts at the top of the ranking probed at PRIORITY_INTERVAL
+JITTER = 0.2  # Intervals are spread by +-20% so hosts don't fall into lockstep
+RATE = 10.0  # Packets per second across the whole monitor
+WINDOW = 60  # Samples kept per host
+HYSTERESIS = 0.1  # A new best must score at least 10% lower than the current one...
+MIN_IMPROVEMENT = 2.0  # ...and at least this many ms lower
+
+
+class RingBuffer:
+    """Fixed-size buffer of the most recent float samples; the oldest sample is overwritten when full."""
+
+    __slots__ = ("values", "size", "start", "count")
+
+    def __init__(self, size):
+        self.values = array("d", bytes(8 * size))
+        self.size = size
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, value):
+        end = (self.start + self.count) % self.size
+        self.values[end] = value
+        if self.count < self.size:
+            self.count += 1
+        else:
+            self.start = (self.start + 1) % self.size
+
+    def ordered(self):
+        """The samples from oldest to newest."""
+        end = self.start + self.count
+        if end <= self.size:
+            return self.values[self.start:end]
+        return self.values[self.start:] + self.values[:end - self.size]
+
+
+class RollingResult:
+    """Probe result over the last `size` samples of a host; usable wherever a ProbeResult is read."""
+
+    __slots__ = ("hostname", "ip", "window", "_stats")
+
+    def __init__(self, hostname, ip, size=WINDOW):
+        self.hostname = hostname
+        self.ip = ip
+        self.window = RingBuffer(size)
+        self._stats = None
+
+    @property
+    def samples(self):
+        return self.window.ordered()
+
+    def add_samples(self, samples):
+        for sample in samples:
+            self.window.append(LOST if sample is None else sample)
+        self._stats = None
+
+    def stats(self):
+        if self._stats is None:
+            self._stats = compute_stats(self.window.ordered())
+        return self._stats
+
+    @property
+    def latency(self):
+        mean = self.stats().mean
+        return mean if mean is not None else float('inf')
+
+
+class Monitor:
+    """
+    Re-probes a set of relays on a schedule and keeps rolling statistics for each.
+    Every host is due again after a jittered interval, shorter for the `priority_hosts` best ranked ones;
+    all probes draw from one packet-rate budget. A "best_changed" event is emitted through `output_text`
+    (see utils.progress) when another relay beats the current best by the hysteresis margin, and a
+    "result" event after every probe.
+    With `metrics` (a utils.metrics.RelayMetrics), every probe is counted there and the scheduler's queue
+    depth and in-flight probes are exported as gauges.
+    """
+
+    def __init__(self, relays, count=1, timeout=1000, interval=INTERVAL, priority_interval=PRIORITY_INTERVAL,
+                 priority_hosts=PRIORITY_HOSTS, jitter=JITTER, rate=RATE, window=WINDOW, hysteresis=HYSTERESIS,
+                 min_improvement=MIN_IMPROVEMENT, score=score_balanced, output_text=None, backend=None,
+                 max_workers=DEFAULT_MAX_WORKERS, record=True, metrics=None):
+        self.targets = {}
+        for relay in relays:
+            hostname, ip = relay_target(relay)
+            if ip:
+                self.targets[hostname] = ip
+        self.count = count
+        self.timeout = timeout
+        self.interval = interval
+        self.priority_interval = priority_interval
+        self.priority_hosts = priority_hosts
+        self.jitter = jitter
+        self.budget = TokenBucket(rate, burst=max(rate, count))
+        self.hysteresis = hysteresis
+        self.min_improvement = min_improvement
+        self.score = score
+        self.output_text = output_text
+        self.backend = backend
+        self.max_workers = max_workers
+        self.record = record
+        self.results = {hostname: RollingResult(hostname, ip, window) for hostname, ip in self.targets.items()}
+        self.ranking = IncrementalRanking()
+        self.best = None
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._random = random.Random()
+        self._due = []  # Heap of (due time, hostname)
+        self._cycle_start = None
+        self._cycle_hosts = set()  # Hosts probed since the current cycle (one probe of every host) started
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.register_relays(relays)
+            metrics.add_gauge("mullvad_probe_queue_depth", "Hosts due for a probe but not yet started.", self.queue_depth)
+            metrics.add_gauge("mullvad_probes_in_flight", "Probes sent and waiting for a reply or timeout.",
+                              lambda: len(self._in_flight))
+
+    def queue_depth(self):
+        """Hosts whose probe is due but still waiting for the packet budget or a worker."""
+        now = monotonic()
+        return sum(1 for when, _ in list(self._due) if when <= now)
+
+    def _next_due(self, hostname, now):
+        with self._lock:
+            top = hostname in self.top_hosts()
+        interval = self.priority_interval if top else self.interval
+        return now + interval * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def top_hosts(self):
+        """Hostnames currently ranked in the priority band."""
+        hosts = []
+        for hostname in self.ranking:
+            if len(hosts) == self.priority_hosts:
+                break
+            hosts.append(hostname)
+        return hosts
+
+    def _probe(self, hostname):
+        try:
+            samples = probe(self.targets[hostname], self.count, timeout=self.timeout, backend=self.backend)
+        except Exception as e:
+            emit(self.output_text, f"Error during ping of {hostname}: {e}")
+            samples = [None] * self.count
+        if self.record:
+            get_history().record(ProbeResult(hostname, self.targets[hostname], samples))
+        if self.metrics is not None:
+            self.metrics.observe(hostname, samples)
+
+        with self._lock:
+            self._in_flight.discard(hostname)
+            result = self.results[hostname]
+            result.add_samples(samples)
+            self.ranking.update(hostname, score_result(result, self.score))
+            changed = self._check_best()
+            cycle_time = self._end_cycle(hostname)
+        if cycle_time is not None and self.metrics is not None:
+            self.metrics.observe_scan(cycle_time)
+        report_result(result, output_text=self.output_text)
+        if changed is not None:
+            previous, best = changed
+            emit(self.output_text, f"Best relay changed: {previous or 'none'} -> {best}", kind="best_changed",
+                 previous=previous, best=best, result=self.results[best])
+
+    def _end_cycle(self, hostname):
+        """Track probed hosts; returns the cycle duration in seconds once every host was probed, else None."""
+        self._cycle_hosts.add(hostname)
+        if len(self._cycle_hosts) < len(self.targets):
+            return None
+        now = monotonic()
+        duration = now - self._cycle_start
+        self._cycle_start = now
+        self._cycle_hosts = set()
+        return duration
+
+    def _check_best(self):
+        """Switch the best relay if the leader beats it by the hysteresis margin; returns (previous, new) or None."""
+        leader = next(iter(self.ranking), None)
+        if leader is None or leader == self.best:
+            return None
+        leader_score = score_result(self.results[leader], self.score)
+        if leader_score == float('inf'):
+            return None
+        if self.best is not None:
+            best_score = score_result(self.results[self.best], self.score)
+            if best_score - leader_score < max(best_score * self.hysteresis, self.min_improvement):
+                return None
+        previous, self.best = self.best, leader
+        return previous, leader
+
+    def run(self, stop_event, duration=None):
+        """Probe until `stop_event` is set or `duration` seconds have passed. Returns the hosts from best to worst."""
+        start = self._cycle_start = monotonic()
+        # Spread the first round over one priority interval instead of sending everything at once
+        due = self._due = [(start + self._random.uniform(0, self.priority_interval), hostname) for hostname in self.targets]
+        heapq.heapify(due)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while due and not stop_event.is_set():
+                if duration is not None and monotonic() - start >= duration:
+                    break
+                when, hostname = due[0]
+                wait = when - monotonic()
+                if wait > 0:
+                    stop_event.wait(min(wait, 1.0))  # Wake up now and then to check the duration
+                    continue
+                heapq.heappop(due)
+                if hostname in self._in_flight:  # Still waiting for the previous probe's timeout
+                    heapq.heappush(due, (self._next_due(hostname, monotonic()), hostname))
+                    continue
+                if not self.budget.acquire(self.count, stop_event):
+                    break
+                with self._lock:
+                    self._in_flight.add(hostname)
+                executor.submit(self._probe, hostname)
+                heapq.heappush(due, (self._next_due(hostname, monotonic()), hostname))
+        return [self.results[hostname] for hostname in self.ranking]
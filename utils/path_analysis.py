@@ -0,0 +1,252 @@
+"""
+Path analysis: TTL-limited probes towards many relays at once, merged into one hop tree so the latency
+can be attributed to hop segments (our uplink, a transit hop, or the relay itself).
+
+Every TTL of a relay is probed concurrently instead of hop by hop. A few pilot relays are traced in full
+first; the hops they all share are measured once and reused for the other relays, which are only probed
+from the last shared hop on (that hop is probed again to check the path really goes through it), and only
+up to a little beyond the longest pilot path; relays not reached by then get the remaining TTLs afterwards.
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.probe_backends import hop_probe
+from utils.ping_utilities import relay_target, DEFAULT_MAX_WORKERS, STOP_POLL_INTERVAL
+from utils.latency_stats import ProbeResult
+from utils.progress import emit
+
+DEFAULT_MAX_HOPS = 20
+DEFAULT_PILOTS = 3  # Relays traced in full to find the shared path prefix
+MIN_SHARED = 2  # Relays a hop must lead to before it is reported as a bottleneck
+HORIZON_MARGIN = 2  # TTLs probed beyond the longest pilot path before the rest waits for a second pass
+
+
+class HopNode:
+    """One hop of the merged tree: the router at `ttl` on the way to every relay in `destinations`."""
+
+    __slots__ = ("ttl", "address", "parent", "children", "destinations", "result", "_measurements")
+
+    def __init__(self, ttl, address, parent=None):
+        self.ttl = ttl
+        self.address = address  # None for a hop that never answered
+        self.parent = parent
+        self.children = {}
+        self.destinations = set()
+        self.result = ProbeResult(address or "*", address)
+        self._measurements = set()
+
+    def add(self, hostname, result):
+        """Count `hostname` as routed through this hop; a measurement shared by several relays is merged once."""
+        self.destinations.add(hostname)
+        if id(result) not in self._measurements:
+            self._measurements.add(id(result))
+            self.result.merge(result)
+
+    @property
+    def median(self):
+        stats = self.result.stats()
+        return stats.median if stats.received else None
+
+    @property
+    def segment(self):
+        """Latency added by the link into this hop: its median minus that of the closest answering hop before it."""
+        if self.median is None:
+            return None
+        previous = self.parent
+        while previous is not None and previous.median is None:
+            previous = previous.parent
+        return max(0.0, self.median - (previous.median if previous is not None else 0.0))
+
+
+class HopTree:
+    """Merged paths to the traced relays, rooted at this machine (ttl 0)."""
+
+    def __init__(self):
+        self.root = HopNode(0, None)
+        self.root.result = ProbeResult("local", None, [0.0])
+        self.paths = {}  # Hostname -> list of HopNodes from the first hop to the relay (or the last answering hop)
+        self.probes = 0  # Probes sent to build the tree
+
+    def add_path(self, hostname, hops):
+        """Insert the (address, ProbeResult) hops of a relay, ordered by TTL."""
+        node, path = self.root, []
+        for ttl, (address, result) in enumerate(hops, start=1):
+            child = node.children.get(address)
+            if child is None:
+                child = node.children[address] = HopNode(ttl, address, node)
+            child.add(hostname, result)
+            path.append(child)
+            node = child
+        self.paths[hostname] = path
+
+    def nodes(self):
+        """Every hop, depth first."""
+        stack = list(reversed(list(self.root.children.values())))
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(list(node.children.values())))
+
+    def bottlenecks(self, top=5, min_shared=MIN_SHARED):
+        """The hops on the way to at least `min_shared` relays that add the most latency, worst first."""
+        shared = [node for node in self.nodes() if node.segment is not None and len(node.destinations) >= min_shared]
+        return sorted(shared, key=lambda node: -node.segment)[:top]
+
+    def render(self):
+        """The tree as text lines: TTL, address, median RTT, the segment's share and the relays behind each hop."""
+        lines = []
+        for node in self.nodes():
+            median = f"{node.median:8.2f} ms" if node.median is not None else "       * ms"
+            segment = f"+{node.segment:.2f} ms" if node.segment is not None else ""
+            lines.append(f"{'  ' * (node.ttl - 1)}{node.ttl:>2}  {node.address or '*':<{40 - 2 * node.ttl}}"
+                         f"{median} {segment:>11}  {len(node.destinations)} relay(s)")
+        return lines
+
+
+def _summarize(replies, hostname):
+    """Reduce the (responder, rtt, final) replies of one TTL to (address, ProbeResult, final)."""
+    answered = Counter(responder for responder, _, _ in replies if responder is not None)
+    if not answered:
+        return None, ProbeResult(hostname, None, [None] * len(replies)), False
+    address = answered.most_common(1)[0][0]  # Load-balanced paths can answer from several routers
+    samples = [rtt if responder == address else None for responder, rtt, _ in replies]
+    final = any(final for responder, _, final in replies if responder == address)
+    return address, ProbeResult(address, address, samples), final
+
+
+def probe_ttls(tasks, count=1, timeout=1000, hop_function=hop_probe, ipv6=False, output_text=None,
+               stop_animation=None, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Probe (hostname, ip, ttl) tasks concurrently, at most `max_workers` at once. Tasks of a relay beyond the TTL
+    at which it was reached are skipped if they haven't started yet.
+    Returns a dictionary with (hostname, ttl) as the key and (address, ProbeResult, final) as the value.
+    """
+    results = {}
+    final_ttl = {}
+    if not tasks:
+        return results
+
+    def stopped():
+        return stop_animation is not None and stop_animation.is_set()
+
+    max_workers = max(1, min(max_workers, len(tasks)))
+    pending = iter(tasks)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit_next():
+            for hostname, ip, ttl in pending:
+                if ttl <= final_ttl.get(hostname, ttl):
+                    in_flight[executor.submit(hop_function, ip, ttl, count, timeout, ipv6)] = (hostname, ttl)
+                    return
+
+        for _ in range(max_workers):
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, timeout=STOP_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            if stopped():
+                emit(output_text, "Path analysis stopped by user.")
+                for future in in_flight:
+                    future.cancel()
+                break
+
+            for future in done:
+                hostname, ttl = in_flight.pop(future)
+                try:
+                    replies = future.result()
+                except Exception as e:
+                    print(f"Error during hop probe of {hostname} (TTL {ttl}): {e}")
+                    replies = [(None, None, False)] * count
+                results[(hostname, ttl)] = _summarize(replies, hostname)
+                if results[(hostname, ttl)][2]:
+                    final_ttl[hostname] = min(ttl, final_ttl.get(hostname, ttl))
+                submit_next()
+    return results
+
+
+def _hops(results, hostname, first, last):
+    """The (address, ProbeResult) hops of a relay from TTL `first` up to the one where it was reached."""
+    hops = []
+    for ttl in range(first, last + 1):
+        if (hostname, ttl) not in results:
+            break
+        address, result, final = results[(hostname, ttl)]
+        hops.append((address, result))
+        if final:
+            break
+    return hops
+
+
+def trace_paths(relays, count=1, timeout=1000, max_hops=DEFAULT_MAX_HOPS, pilots=DEFAULT_PILOTS, family="ipv4",
+                hop_function=hop_probe, output_text=None, stop_animation=None, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Trace the paths to the relays with `count` TTL-limited probes per hop and merge them into a HopTree.
+    With `pilots` > 0 the hops shared by the first traced relays are measured once for all of them.
+    `hop_function(ip, ttl, count, timeout, ipv6)` sends the probes (see probe_backends.hop_probe).
+    """
+    targets = [relay_target(relay, family) for relay in relays]
+    targets = [(hostname, ip) for hostname, ip in targets if ip]
+    ipv6 = family == "ipv6"
+    tree = HopTree()
+    if not targets:
+        return tree
+
+    def run(tasks):
+        if stop_animation is not None and stop_animation.is_set():
+            return {}
+        results = probe_ttls(tasks, count=count, timeout=timeout, hop_function=hop_function, ipv6=ipv6,
+                             output_text=output_text, stop_animation=stop_animation, max_workers=max_workers)
+        tree.probes += len(results) * count
+        return results
+
+    # Trace a few relays spread over the list in full, all TTLs at once
+    step = max(1, len(targets) // max(pilots, 1))
+    pilot_targets = targets[::step][:pilots] if pilots else targets
+    results = run([(hostname, ip, ttl) for hostname, ip in pilot_targets for ttl in range(1, max_hops + 1)])
+
+    # The hops every pilot went through are measured once for every relay
+    shared = []
+    for ttl in range(1, max_hops + 1):
+        hops = [results.get((hostname, ttl)) for hostname, _ in pilot_targets]
+        if not pilots or any(hop is None or hop[0] is None or hop[2] for hop in hops):
+            break
+        if len({hop[0] for hop in hops}) > 1:
+            break
+        merged = ProbeResult(hops[0][0], hops[0][0])
+        for hop in hops:
+            merged.merge(hop[1])
+        shared.append((hops[0][0], merged))
+    if shared:
+        emit(output_text, f"{len(shared)} hop(s) shared by every path, measured once for all {len(targets)} relay(s).")
+
+    # Paths to the same fleet are of similar length, so TTLs far past the pilots' paths are mostly wasted
+    lengths = [len(_hops(results, hostname, 1, max_hops)) for hostname, _ in pilot_targets]
+    reached = [length for length, (hostname, _) in zip(lengths, pilot_targets)
+               if length and results[(hostname, length)][2]]
+    horizon = min(max_hops, max(reached) + HORIZON_MARGIN) if pilots and reached else max_hops
+
+    # The other relays are probed from the last shared hop on, which confirms they go through it
+    checkpoint = len(shared) or 1
+    others = [(hostname, ip) for hostname, ip in targets if (hostname, ip) not in pilot_targets]
+    results.update(run([(hostname, ip, ttl) for hostname, ip in others for ttl in range(checkpoint, horizon + 1)]))
+    beyond = [(hostname, ip) for hostname, ip in others
+              if not any(results.get((hostname, ttl), (None, None, False))[2] for ttl in range(checkpoint, horizon + 1))]
+    diverted = [(hostname, ip) for hostname, ip in others
+                if shared and (hostname, checkpoint) in results and results[(hostname, checkpoint)][0] != shared[-1][0]]
+    if diverted:
+        emit(output_text, f"{len(diverted)} relay(s) left the shared path early, tracing them in full.")
+    results.update(run([(hostname, ip, ttl) for hostname, ip in diverted for ttl in range(1, checkpoint)] +
+                       [(hostname, ip, ttl) for hostname, ip in beyond for ttl in range(horizon + 1, max_hops + 1)]))
+
+    diverted = {hostname for hostname, _ in diverted}
+    for hostname, _ in targets:
+        if shared and hostname not in diverted:
+            hops = _hops(results, hostname, checkpoint, max_hops)
+            if hops:  # Nothing of its own was probed if the analysis was stopped
+                hops = shared[:-1] + hops
+        else:
+            hops = _hops(results, hostname, 1, max_hops)
+        while hops and hops[-1][0] is None:
+            hops.pop()  # Hops past the last router that answered
+        if hops:
+            tree.add_path(hostname, hops)
+    return tree
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Base directory of the application (the folder holding data/ and assets/)
+if getattr(sys, 'frozen', False):  
+    BASE_DIR = os.path.dirname(sys.executable) 
+else:
+    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.dirname(BASE_DIR)
+DATA_DIR = os.path.join(BASE_DIR, "data")
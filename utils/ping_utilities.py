@@ -1,7 +1,17 @@
+import os
+import re
+import shutil
 import subprocess
-import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from utils.probe_backends import icmp_available, icmp_probe, tcp_probe, udp_probe
+from utils.latency_stats import ProbeResult
+from utils.progress import emit
+from utils.tracing import span
 
 DEFAULT_TIMEOUT = 10000  # Default timeout for ping in milliseconds
+DEFAULT_MAX_WORKERS = 32  # Maximum number of pings in flight at once
+STOP_POLL_INTERVAL = 0.1  # Seconds between checks of the stop flag while waiting for pings
+PING_REPLY_TIME = re.compile(r"[=<](\d+(?:[.,]\d+)?) ?ms", re.IGNORECASE)  # "time=12ms", "Zeit<1ms", "time=12.3 ms"
 
 def parsePing(pingOutput):
     """
@@ -20,77 +30,218 @@ def parsePing(pingOutput):
     except Exception:
         return None, None, None
 
-def ping(addr, count, timeout=DEFAULT_TIMEOUT, ipv6=False):
+def parsePingSamples(pingOutput, count):
     """
-    Run the ping command and return the parsed latency values.
+    Parse the per-reply lines of the ping command output ("time=12ms", "Zeit=12ms", "time=12.3 ms").
+    Returns a list of `count` round-trip times in milliseconds, with None for lost probes.
+    """
+    samples = [float(value.replace(",", ".")) for value in PING_REPLY_TIME.findall(pingOutput)][:count]
+    return samples + [None] * (count - len(samples))
+
+def system_probe(addr, count, timeout=DEFAULT_TIMEOUT, ipv6=False):
+    """
+    Run the system ping command and return the round-trip time of each probe.
     The ping command is called with the specified `count` and `timeout` values.
-    Returns a tuple with (min_latency, avg_latency, max_latency).
     """
     # Create the ping command based on the parameters
-    pingCommand = ["ping", addr, "-n", str(count), "-w", str(timeout)]
+    if os.name == "nt":
+        pingCommand = ["ping", addr, "-n", str(count), "-w", str(timeout)]
+    else:
+        pingCommand = ["ping", addr, "-c", str(count), "-W", str(max(1, round(timeout / 1000)))]
     if ipv6:
         pingCommand.append("-6")
 
     # Display the constructed ping command in the terminal (optional for debugging)
     print(f"Executing Ping Command: {' '.join(pingCommand)}")
 
-    try:
+    kwargs = {}
+    if os.name == "nt":
         # Configure subprocess to hide the console window
         si = subprocess.STARTUPINFO()
         si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
         si.wShowWindow = subprocess.SW_HIDE  # Hide the window
+        kwargs["startupinfo"] = si
+
+    # Run the command and hide the console window
+    with span("ping process", host=addr):
+        pingProcess = subprocess.run(pingCommand, capture_output=True, **kwargs)
+
+    # A failed run means no reply arrived at all
+    if pingProcess.returncode != 0:
+        print(f"Ping command failed with return code: {pingProcess.returncode}")
+        return [None] * count
+
+    with span("parse ping output"):
+        return parsePingSamples(pingProcess.stdout.decode("utf-8", errors="ignore"), count)
+
+PROBE_BACKENDS = {
+    "icmp": icmp_probe,
+    "tcp": tcp_probe,
+    "udp": udp_probe,
+    "system": system_probe,
+}
+probe_backend = "auto"  # Backend used by ping() when none is given
+
+def set_probe_backend(name):
+    """Select the default probe backend: "auto" or one of PROBE_BACKENDS."""
+    global probe_backend
+    if name != "auto" and name not in PROBE_BACKENDS:
+        raise ValueError(f"Unknown probe backend: {name}")
+    probe_backend = name
+
+def resolve_backend(name=None, ipv6=False):
+    """
+    Return the probe function for a backend name.
+    "auto" prefers in-process ICMP, then the system ping binary, then TCP connect timing.
+    """
+    name = name or probe_backend
+    if name != "auto":
+        return PROBE_BACKENDS[name]
+    if icmp_available(ipv6):
+        return icmp_probe
+    if shutil.which("ping"):
+        return system_probe
+    return tcp_probe
+
+def probe(addr, count, timeout=DEFAULT_TIMEOUT, ipv6=False, backend=None):
+    """Return the round-trip time in milliseconds of each probe to `addr`, with None for lost probes."""
+    function = resolve_backend(backend, ipv6)
+    with span("probe", host=addr, backend=function.__name__, count=count):
+        return function(addr, count, timeout, ipv6)
+
+def summarize_samples(samples):
+    """Reduce probe samples to (min_latency, avg_latency, max_latency), or Nones if every probe was lost."""
+    received = [sample for sample in samples if sample is not None]
+    if not received:
+        return None, None, None
+    return min(received), sum(received) / len(received), max(received)
 
-        # Run the command and hide the console window
-        pingProcess = subprocess.run(pingCommand, capture_output=True, startupinfo=si)
-
-        # Check for unsuccessful execution
-        if pingProcess.returncode != 0:
-            print(f"Ping command failed with return code: {pingProcess.returncode}")
-            return None, None, None
-
-        # Parse and return the latency values
-        min_latency, avg_latency, max_latency = parsePing(pingProcess.stdout.decode("utf-8", errors="ignore"))
-        return min_latency, avg_latency, max_latency
+def ping(addr, count, timeout=DEFAULT_TIMEOUT, ipv6=False, backend=None):
+    """
+    Probe `addr` `count` times with the selected backend and return the latency values.
+    Returns a tuple with (min_latency, avg_latency, max_latency).
+    """
+    try:
+        return summarize_samples(probe(addr, count, timeout=timeout, ipv6=ipv6, backend=backend))
     except Exception as e:
         print(f"Error during ping execution: {e}")
         return None, None, None
 
 
 
-def get_latency_for_relays(relays, count=1, timeout=1000, output_text=None, stop_animation=None):
+def relay_target(relay, family="ipv4"):
     """
-    Ping each relay and return a dictionary with hostname as the key and average latency as the value.
-    Optionally, update the GUI console with progress using `output_text`.
-    The process can be stopped using `stop_animation`.
+    Return (hostname, ip) for a relay given as a dict or as a (hostname, distance, ip) tuple.
+    `family` ("ipv4" or "ipv6") selects the address of a dict; tuples carry a single address.
     """
-    latency_dict = {}
-    for relay in relays:
-        if stop_animation is not None and stop_animation.is_set():
-            print("Ping operation stopped by user.")  
-            break
+    # Check if relay is a tuple and has 3 elements (hostname, distance, ip)
+    if isinstance(relay, tuple) and len(relay) == 3:
+        hostname, _, ip = relay
+        return hostname, ip
+    # If relay is a dictionary, extract values normally
+    return relay.get("hostname", "Unknown"), relay.get(f"{family}_addr_in", None)
 
-        # Check if relay is a tuple and has 3 elements (hostname, distance, ip)
-        if isinstance(relay, tuple) and len(relay) == 3:
-            hostname, _, ip = relay  
-        else:
-            # If relay is a dictionary, extract values normally
-            hostname = relay.get("hostname", "Unknown")
-            ip = relay.get("ipv4_addr_in", None)  # Use the IPv4 address for pinging
 
-        # Check if we have an IP to ping
-        if ip:
-            min_latency, avg_latency, max_latency = ping(ip, count=count, timeout=timeout)
-            latency = avg_latency if avg_latency is not None else float('inf')
-            latency_dict[hostname] = latency
+def report_result(result, output_text=None):
+    """Report the result of one host as a "result" event (terminal and GUI console, or a progress callback)."""
+    stats = result.stats()
 
-            # Terminal output for each ping with detailed values
-            latency_display = f"Min: {min_latency} ms, Avg: {latency:.2f} ms, Max: {max_latency} ms" if latency != float('inf') else "N/A"
-            print(f"Ping {hostname} ({ip}): {latency_display}")  
+    # Detailed values for each host
+    if stats.received:
+        latency_display = (f"Min: {stats.min:.2f} ms, Avg: {stats.mean:.2f} ms, Max: {stats.max:.2f} ms, "
+                           f"Jitter: {stats.jitter:.2f} ms, Loss: {stats.loss:.0f}%")
+    else:
+        latency_display = "N/A"
+    emit(output_text, f"Ping {result.hostname} ({result.ip}): {latency_display}", kind="result", result=result)
 
-            # Update the GUI console if output_text is provided
-            if output_text is not None:
-                output_text.insert(tk.END, f"Ping {hostname}: {latency_display}\n")
-                output_text.see(tk.END)  # Auto-scroll
-                output_text.update_idletasks()  
 
-    return latency_dict
+def probe_targets(targets, count=1, timeout=1000, output_text=None, stop_animation=None,
+                  max_workers=DEFAULT_MAX_WORKERS, on_result=None, backend=None):
+    """
+    Probe (key, hostname, ip, ipv6) targets concurrently through one pool of at most `max_workers` probes and
+    return a dictionary with each key and its ProbeResult. Results are reported as soon as each target finishes,
+    through `output_text` (a GUI console or progress callback, see utils.progress) and/or `on_result(key, result)`.
+    The process can be stopped using `stop_animation`; probes already in flight are allowed to finish
+    but their results are discarded and no new probes are started.
+    """
+    results = {}
+    if not targets:
+        return results
+
+    def stopped():
+        return stop_animation is not None and stop_animation.is_set()
+
+    max_workers = max(1, min(max_workers, len(targets)))
+    pending = iter(targets)
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit_next():
+            # Keep the pool fed one target at a time so a stop request takes effect immediately
+            target = next(pending, None)
+            if target is not None:
+                future = executor.submit(probe, target[2], count, timeout=timeout, ipv6=target[3], backend=backend)
+                in_flight[future] = target
+
+        for _ in range(max_workers):
+            submit_next()
+
+        while in_flight:
+            done, _ = wait(in_flight, timeout=STOP_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            if stopped():
+                emit(output_text, "Ping operation stopped by user.")
+                for future in in_flight:
+                    future.cancel()
+                break
+
+            for future in done:
+                key, hostname, ip, _ = in_flight.pop(future)
+                try:
+                    samples = future.result()
+                except Exception as e:
+                    print(f"Error during ping of {hostname} ({ip}): {e}")
+                    samples = [None] * count
+
+                result = ProbeResult(hostname, ip, samples)
+                results[key] = result
+                report_result(result, output_text=output_text)
+                if on_result is not None:
+                    on_result(key, result)
+
+                submit_next()
+
+    return results
+
+
+def probe_relays(relays, count=1, timeout=1000, output_text=None, stop_animation=None,
+                 max_workers=DEFAULT_MAX_WORKERS, on_result=None, backend=None, family="ipv4"):
+    """
+    Probe the relays concurrently and return a dictionary with hostname as the key and a ProbeResult
+    holding every round-trip sample as the value.
+    At most `max_workers` hosts are probed at once, over the `family` ("ipv4" or "ipv6") address of each relay.
+    Results are reported as soon as each host finishes, through `output_text` and/or `on_result(result)`.
+    See probe_targets for how a stop request is handled.
+    """
+    targets = [relay_target(relay, family) for relay in relays]
+    targets = [(hostname, hostname, ip, family == "ipv6")
+               for hostname, ip in targets if ip]  # Skip relays without an IP to ping
+    callback = None
+    if on_result is not None:
+        callback = lambda hostname, result: on_result(result)
+    return probe_targets(targets, count=count, timeout=timeout, output_text=output_text, stop_animation=stop_animation,
+                         max_workers=max_workers, on_result=callback, backend=backend)
+
+
+def get_latency_for_relays(relays, count=1, timeout=1000, output_text=None, stop_animation=None,
+                           max_workers=DEFAULT_MAX_WORKERS, on_result=None):
+    """
+    Ping the relays concurrently and return a dictionary with hostname as the key and average latency as the value.
+    Hosts that never answered get float('inf'). `on_result(hostname, latency)` is called as each host finishes.
+    See probe_relays for the full per-probe samples.
+    """
+    callback = None
+    if on_result is not None:
+        callback = lambda result: on_result(result.hostname, result.latency)
+    results = probe_relays(relays, count=count, timeout=timeout, output_text=output_text,
+                           stop_animation=stop_animation, max_workers=max_workers, on_result=callback)
+    return {hostname: result.latency for hostname, result in results.items()}
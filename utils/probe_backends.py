@@ -0,0 +1,282 @@
+import os
+import socket
+import struct
+import itertools
+from time import perf_counter
+
+# ICMP message types
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+DEFAULT_TCP_PORT = 443  # OpenVPN/WireGuard-over-TCP port that Mullvad relays answer on
+DEFAULT_UDP_PORT = 33434  # Unused port, the relay answers with ICMP port unreachable
+PAYLOAD = b"mullvad-latency-tester"
+
+_identifiers = itertools.count((os.getpid() * 7919) & 0xFFFF)
+_icmp_support = {}
+
+
+def _family(ipv6):
+    return socket.AF_INET6 if ipv6 else socket.AF_INET
+
+
+def _seconds(timeout):
+    """Convert a ping timeout in milliseconds to seconds for socket timeouts."""
+    return max(timeout, 1) / 1000.0
+
+
+def next_identifier():
+    """Return a fresh 16-bit ICMP identifier for a probe session."""
+    return next(_identifiers) & 0xFFFF
+
+
+def checksum(data):
+    """Compute the Internet checksum (RFC 1071) of `data`."""
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def build_echo_request(identifier, sequence, payload=PAYLOAD, ipv6=False):
+    """Build an ICMP (or ICMPv6) echo request packet."""
+    icmp_type = ICMPV6_ECHO_REQUEST if ipv6 else ICMP_ECHO_REQUEST
+    header = struct.pack("!BBHHH", icmp_type, 0, 0, identifier & 0xFFFF, sequence & 0xFFFF)
+    if ipv6:
+        return header + payload  # The kernel fills in the ICMPv6 checksum
+    return struct.pack("!BBHHH", icmp_type, 0, checksum(header + payload), identifier & 0xFFFF, sequence & 0xFFFF) + payload
+
+
+def parse_echo_reply(packet, ipv6=False):
+    """
+    Parse an ICMP echo reply and return (identifier, sequence), or None if it is not an echo reply.
+    Some systems (e.g. macOS) include the IPv4 header on datagram ICMP sockets, so it is skipped if present.
+    """
+    if not ipv6 and len(packet) >= 20 and packet[0] >> 4 == 4:
+        packet = packet[(packet[0] & 0x0F) * 4:]
+    if len(packet) < 8:
+        return None
+    icmp_type, _, _, identifier, sequence = struct.unpack("!BBHHH", packet[:8])
+    if icmp_type != (ICMPV6_ECHO_REPLY if ipv6 else ICMP_ECHO_REPLY):
+        return None
+    return identifier, sequence
+
+
+def open_icmp_socket(ipv6=False):
+    """Open an unprivileged ICMP datagram socket (Linux ping_group_range, macOS)."""
+    proto = socket.IPPROTO_ICMPV6 if ipv6 else socket.IPPROTO_ICMP
+    return socket.socket(_family(ipv6), socket.SOCK_DGRAM, proto)
+
+
+def icmp_available(ipv6=False):
+    """Check once whether the OS allows unprivileged ICMP datagram sockets."""
+    if ipv6 not in _icmp_support:
+        try:
+            open_icmp_socket(ipv6).close()
+            _icmp_support[ipv6] = True
+        except OSError:
+            _icmp_support[ipv6] = False
+    return _icmp_support[ipv6]
+
+
+def icmp_probe(addr, count, timeout, ipv6=False):
+    """
+    Send `count` ICMP echo requests over a datagram socket.
+    Returns a list with one round-trip time in milliseconds per probe, or None for lost probes.
+    """
+    samples = []
+    identifier = next_identifier()
+    with open_icmp_socket(ipv6) as sock:
+        sock.connect((addr, 0))
+        for sequence in range(count):
+            sock.settimeout(_seconds(timeout))
+            start = perf_counter()
+            sock.send(build_echo_request(identifier, sequence, ipv6=ipv6))
+            deadline = start + _seconds(timeout)
+            rtt = None
+            try:
+                while True:
+                    reply = parse_echo_reply(sock.recv(2048), ipv6)
+                    now = perf_counter()
+                    # Linux rewrites the identifier to the socket's port, so only the sequence is matched
+                    if reply is not None and reply[1] == sequence:
+                        rtt = (now - start) * 1000
+                        break
+                    if now >= deadline:
+                        break
+                    sock.settimeout(deadline - now)
+            except socket.timeout:
+                pass
+            samples.append(rtt)
+    return samples
+
+
+def tcp_probe(addr, count, timeout, ipv6=False, port=DEFAULT_TCP_PORT):
+    """
+    Measure the TCP handshake time to `addr:port` `count` times.
+    A refused connection still counts as a reply since the host answered with a RST.
+    """
+    samples = []
+    for _ in range(count):
+        with socket.socket(_family(ipv6), socket.SOCK_STREAM) as sock:
+            sock.settimeout(_seconds(timeout))
+            start = perf_counter()
+            try:
+                sock.connect((addr, port))
+                rtt = (perf_counter() - start) * 1000
+            except ConnectionRefusedError:
+                rtt = (perf_counter() - start) * 1000
+            except OSError:
+                rtt = None
+            samples.append(rtt)
+    return samples
+
+
+def udp_probe(addr, count, timeout, ipv6=False, port=DEFAULT_UDP_PORT):
+    """
+    Send `count` UDP datagrams to `addr:port` and time the answer.
+    Either a reply datagram or an ICMP port unreachable (seen as a refused connection) counts as a reply.
+    """
+    samples = []
+    with socket.socket(_family(ipv6), socket.SOCK_DGRAM) as sock:
+        sock.connect((addr, port))
+        for sequence in range(count):
+            sock.settimeout(_seconds(timeout))
+            start = perf_counter()
+            try:
+                sock.send(struct.pack("!H", sequence) + PAYLOAD)
+                sock.recv(2048)
+                rtt = (perf_counter() - start) * 1000
+            except ConnectionRefusedError:
+                rtt = (perf_counter() - start) * 1000
+            except OSError:
+                rtt = None
+            samples.append(rtt)
+    return samples
+
+
+# TTL-limited probes (see utils.path_analysis)
+ICMP_TIME_EXCEEDED = 11
+ICMP_DEST_UNREACH = 3
+ICMPV6_TIME_EXCEEDED = 3
+ICMPV6_DEST_UNREACH = 1
+IP_RECVERR = getattr(socket, "IP_RECVERR", 11)
+IPV6_RECVERR = getattr(socket, "IPV6_RECVERR", 25)
+MSG_ERRQUEUE = getattr(socket, "MSG_ERRQUEUE", 0x2000)
+EXTENDED_ERR = struct.Struct("=IBBBBII")  # struct sock_extended_err, followed by the offender's sockaddr
+
+
+def _set_ttl(sock, ttl, ipv6):
+    if ipv6:
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_UNICAST_HOPS, ttl)
+    else:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_TTL, ttl)
+
+
+def _classify(icmp_type, ipv6):
+    """
+    Map an ICMP error type to "hop" (the TTL ran out on the way) or "final" (destination unreachable: sent by the
+    destination for the closed port, or by a router that won't forward the probe), None for anything else.
+    """
+    if icmp_type == (ICMPV6_TIME_EXCEEDED if ipv6 else ICMP_TIME_EXCEEDED):
+        return "hop"
+    if icmp_type == (ICMPV6_DEST_UNREACH if ipv6 else ICMP_DEST_UNREACH):
+        return "final"
+    return None
+
+
+def _recverr_hop_probe(addr, ttl, timeout, ipv6, port):
+    """
+    One TTL-limited UDP probe, reading the ICMP error from the socket's error queue (Linux, no privileges needed).
+    Returns (responder, rtt, final).
+    """
+    import select
+    with socket.socket(_family(ipv6), socket.SOCK_DGRAM) as sock:
+        _set_ttl(sock, ttl, ipv6)
+        if ipv6:
+            sock.setsockopt(socket.IPPROTO_IPV6, IPV6_RECVERR, 1)
+        else:
+            sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+        sock.connect((addr, port))
+        poller = select.poll()
+        poller.register(sock, select.POLLIN | select.POLLERR)
+        start = perf_counter()
+        sock.send(struct.pack("!H", ttl) + PAYLOAD)
+        deadline = start + _seconds(timeout)
+        while True:
+            remaining = deadline - perf_counter()
+            if remaining <= 0 or not poller.poll(remaining * 1000):
+                return None, None, False
+            rtt = (perf_counter() - start) * 1000
+            try:
+                _, ancillary, _, _ = sock.recvmsg(512, 512, MSG_ERRQUEUE)
+            except BlockingIOError:
+                ancillary = None
+            except OSError:
+                continue
+            if ancillary is None:
+                sock.recv(2048)  # An answer from the destination itself
+                return addr, rtt, True
+            for _, _, data in ancillary:
+                if len(data) < EXTENDED_ERR.size:
+                    continue
+                _, _, icmp_type, _, _, _, _ = EXTENDED_ERR.unpack_from(data)
+                offender = data[EXTENDED_ERR.size:]
+                responder = (socket.inet_ntop(socket.AF_INET6, offender[8:24]) if ipv6
+                             else socket.inet_ntop(socket.AF_INET, offender[4:8]))
+                kind = _classify(icmp_type, ipv6)
+                if kind is not None:
+                    return responder, rtt, kind == "final"
+
+
+def _raw_hop_probe(addr, ttl, timeout, ipv6, port):
+    """
+    One TTL-limited UDP probe, catching the ICMP error on a raw socket (root/administrator).
+    The error is matched to the probe by the UDP ports quoted in it. Returns (responder, rtt, final).
+    """
+    import select
+    proto = socket.IPPROTO_ICMPV6 if ipv6 else socket.IPPROTO_ICMP
+    with socket.socket(_family(ipv6), socket.SOCK_RAW, proto) as icmp, \
+            socket.socket(_family(ipv6), socket.SOCK_DGRAM) as sock:
+        _set_ttl(sock, ttl, ipv6)
+        sock.bind(("::" if ipv6 else "0.0.0.0", 0))
+        source_port = sock.getsockname()[1]
+        start = perf_counter()
+        sock.sendto(struct.pack("!H", ttl) + PAYLOAD, (addr, port))
+        deadline = start + _seconds(timeout)
+        while True:
+            remaining = deadline - perf_counter()
+            readable = select.select([icmp, sock], [], [], max(0.0, remaining))[0] if remaining > 0 else []
+            if not readable:
+                return None, None, False
+            rtt = (perf_counter() - start) * 1000
+            if sock in readable:
+                sock.recvfrom(2048)  # An answer from the destination itself
+                return addr, rtt, True
+            packet, source = icmp.recvfrom(2048)
+            # IPv4 raw sockets deliver the IP header, IPv6 ones start at the ICMPv6 header
+            message = packet if ipv6 else packet[(packet[0] & 0x0F) * 4:]
+            quoted = message[8:]  # The probe's IP header and the start of its UDP header
+            header = 40 if ipv6 else (quoted[0] & 0x0F) * 4 if quoted else 0
+            if len(message) < 8 or len(quoted) < header + 4:
+                continue
+            if struct.unpack_from("!HH", quoted, header) != (source_port, port):
+                continue  # The error belongs to another probe
+            kind = _classify(message[0], ipv6)
+            if kind is not None:
+                return source[0], rtt, kind == "final"
+
+
+def hop_probe(addr, ttl, count, timeout, ipv6=False, port=DEFAULT_UDP_PORT):
+    """
+    Send `count` UDP probes to `addr` with their TTL (hop limit) set to `ttl` and return one
+    (responder, rtt, final) tuple per probe: the address that answered (the router where the TTL ran out,
+    or `addr` itself), the round-trip time in milliseconds, and whether the probe got no further, because it
+    reached `addr` or a router reported `addr` unreachable. Lost probes give (None, None, False).
+    """
+    probe_once = _recverr_hop_probe if hasattr(socket, "MSG_ERRQUEUE") else _raw_hop_probe
+    return [probe_once(addr, ttl, timeout, ipv6, port) for _ in range(count)]
@@ -0,0 +1,93 @@
+import math
+from utils.ping_utilities import probe_relays, relay_target, report_result, DEFAULT_MAX_WORKERS
+from utils.progress import emit
+
+CONFIDENCE_Z = 1.96  # z-score of the 95% confidence interval used to drop hosts
+# Student's t critical values (95%, two-sided) for 1-9 degrees of freedom; few samples mean wide intervals
+T_CRITICAL_95 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262)
+MIN_STDDEV = 1.0  # Floor for the sample standard deviation in ms, so two near-identical samples aren't "certain"
+
+
+def confidence_interval(result):
+    """Return the 95% (lower, upper) confidence bounds of a host's mean latency, or None if it never answered."""
+    stats = result.stats()
+    if not stats.received:
+        return None
+    if stats.received == 1:
+        return -math.inf, math.inf  # A single sample says nothing about the spread
+    degrees = stats.received - 1
+    critical = T_CRITICAL_95[degrees - 1] if degrees <= len(T_CRITICAL_95) else CONFIDENCE_Z
+    # Sample (n - 1) standard deviation from the population one kept in the stats
+    stddev = stats.stddev * math.sqrt(stats.received / degrees)
+    half_width = critical * max(stddev, MIN_STDDEV) / math.sqrt(stats.received)
+    return stats.mean - half_width, stats.mean + half_width
+
+
+def adaptive_probe_relays(relays, count=5, timeout=1000, initial=2, budget=None,
+                          output_text=None, stop_animation=None, max_workers=DEFAULT_MAX_WORKERS, family="ipv4"):
+    """
+    Successive elimination scheduler on top of probe_relays.
+    Every host first gets `initial` probes. After each round, hosts whose confidence interval lies entirely
+    above the leader's are dropped, and the remaining contenders get another round of probes.
+    Probing stops when one contender is left, every contender has `count` samples (what the exhaustive scan
+    would have sent) or `budget` probes have been spent (default: `count` per host).
+    `family` ("ipv4" or "ipv6") selects the address probed, as in probe_relays.
+    Returns a dictionary with hostname as the key and a ProbeResult as the value, for every host probed.
+    """
+    targets = {}
+    for relay in relays:
+        hostname, ip = relay_target(relay, family)
+        if ip:
+            targets[hostname] = relay
+    if budget is None:
+        budget = count * len(targets)
+
+    def stopped():
+        return stop_animation is not None and stop_animation.is_set()
+
+    results = {}
+    contenders = list(targets)
+    spent = 0
+    round_number = 0
+    while contenders and not stopped():
+        round_number += 1
+        # Spread what is left of the budget over the contenders, but never beyond `count` samples per host
+        per_host = min(initial, (budget - spent) // len(contenders))
+        batch = {}
+        for hostname in contenders:
+            sent = len(results[hostname].samples) if hostname in results else 0
+            if min(per_host, count - sent) > 0:
+                batch.setdefault(min(per_host, count - sent), []).append(targets[hostname])
+        if not batch:
+            break
+
+        for probes, batch_relays in batch.items():
+            round_results = probe_relays(batch_relays, count=probes, timeout=timeout,
+                                         stop_animation=stop_animation, max_workers=max_workers, family=family)
+            for hostname, result in round_results.items():
+                if hostname in results:
+                    results[hostname].merge(result)
+                else:
+                    results[hostname] = result
+                spent += probes
+
+        # Drop every host that cannot beat the leader's upper bound
+        intervals = {hostname: confidence_interval(results[hostname]) for hostname in contenders if hostname in results}
+        answered = {hostname: interval for hostname, interval in intervals.items() if interval is not None}
+        if not answered:
+            break
+        leader_upper = min(upper for _, upper in answered.values())
+        dropped = [hostname for hostname in contenders if hostname not in answered or answered[hostname][0] > leader_upper]
+        contenders = [hostname for hostname in contenders if hostname not in dropped]
+        for hostname in dropped:
+            if hostname in results:
+                report_result(results[hostname], output_text=output_text)
+        emit(output_text, f"Round {round_number}: {len(contenders)} contender(s) left, {spent} probes sent.",
+             kind="round", contenders=len(contenders), spent=spent)
+        if len(contenders) <= 1:
+            break
+
+    for hostname in contenders:
+        if hostname in results:
+            report_result(results[hostname], output_text=output_text)
+    return results
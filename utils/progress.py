@@ -0,0 +1,33 @@
+class ProgressEvent:
+    """
+    One progress report from a long-running operation.
+    `kind` is "message" for plain log lines, "result" when a host finished (data["result"] holds the
+    ProbeResult), "round" after an adaptive scheduling round and "diff" after a relay list refresh.
+    """
+
+    __slots__ = ("kind", "message", "data")
+
+    def __init__(self, kind, message, data):
+        self.kind = kind
+        self.message = message
+        self.data = data
+
+    def __repr__(self):
+        return f"ProgressEvent({self.kind!r}, {self.message!r})"
+
+
+def emit(output, message, kind="message", **data):
+    """
+    Report progress to `output`, which is what the utils accept as `output_text`:
+    - None: print to the terminal
+    - a callable: called with a ProgressEvent, nothing is printed (library and CLI use)
+    - a Tk text widget: print to the terminal and append to the widget
+    """
+    if callable(output):
+        output(ProgressEvent(kind, message, data))
+        return
+    print(message)
+    if output is not None:
+        output.insert("end", message + "\n")
+        output.see("end")  # Auto-scroll
+        output.update_idletasks()
@@ -0,0 +1,49 @@
+from bisect import bisect_left, insort
+
+
+def sort_value(value):
+    """Make a column value orderable: missing values (None/NaN) sort after every real value."""
+    if value is None or value != value:
+        return (1, 0)
+    return (0, value)
+
+
+class IncrementalRanking:
+    """
+    Keys kept in order of a value that changes over time, e.g. hosts by score while results stream in.
+    Entries live in a sorted list, so update() finds a key's old and new position by binary search and
+    reports where it moved, letting a view move one row instead of re-sorting everything.
+    """
+
+    def __init__(self):
+        self._entries = []  # Sorted (sort value, key)
+        self._values = {}  # key -> sort value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return (key for _, key in self._entries)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def update(self, key, value):
+        """Set `key`'s value and return its new position (0 is the lowest value)."""
+        value = sort_value(value)
+        if key in self._values:
+            del self._entries[bisect_left(self._entries, (self._values[key], key))]
+        self._values[key] = value
+        insort(self._entries, (value, key))
+        return bisect_left(self._entries, (value, key))
+
+    def index(self, key):
+        return bisect_left(self._entries, (self._values[key], key))
+
+    def remove(self, key):
+        del self._entries[self.index(key)]
+        del self._values[key]
+
+    def clear(self):
+        self._entries = []
+        self._values = {}
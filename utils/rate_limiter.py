@@ -0,0 +1,53 @@
+import threading
+from time import monotonic, sleep
+
+EPSILON = 1e-9  # Tokens short by less than this count as there, or rounding in _refill could keep acquire() waiting
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens are added per second, up to `burst`.
+    acquire() blocks until enough tokens are available, so callers are paced at `rate` on average.
+    `clock` and `sleep` default to time.monotonic and time.sleep; tests pass a fake clock instead.
+    """
+
+    def __init__(self, rate, burst=1, clock=monotonic, sleep=sleep):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take `tokens` if they are available right now; returns whether they were taken."""
+        with self._lock:
+            self._refill(self._clock())
+            if self._tokens + EPSILON >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, stop_event=None):
+        """
+        Block until `tokens` are taken. Returns False if `stop_event` was set while waiting.
+        Requests larger than the burst size are allowed and simply wait longer.
+        """
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._refill(now)
+                if self._tokens + EPSILON >= min(tokens, self.burst):
+                    self._tokens -= tokens  # May go negative for large requests, which delays later callers
+                    return True
+                wait = (min(tokens, self.burst) - self._tokens) / self.rate
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    return False
+            else:
+                self._sleep(wait)
@@ -0,0 +1,167 @@
+from bisect import bisect_left
+from utils.relay_utilities import (HOSTNAME, TYPE, COUNTRY_CODE, COUNTRY_NAME, CITY_CODE, CITY_NAME,
+                                   PROVIDER, BANDWIDTH, OWNED, WIREGUARD, OPENVPN, BRIDGE)
+from utils.tracing import traced
+
+# Server type names shown in the GUI and the relay types used by the API
+SERVER_TYPES = {"WireGuard": WIREGUARD, "OpenVPN": OPENVPN, "Bridge": BRIDGE}
+# Relay fields read while indexing, in RelayCatalog._index argument order
+INDEXED_FIELDS = (HOSTNAME, COUNTRY_NAME, CITY_NAME, TYPE, PROVIDER, OWNED, BANDWIDTH, COUNTRY_CODE, CITY_CODE)
+
+
+class RelayCatalog:
+    """
+    Relay list with indexes built once, so dropdowns and filters don't rescan every relay.
+    Each index maps a key to the positions of the matching relays, in relay list order.
+    """
+
+    @traced("build relay index")
+    def __init__(self, relays):
+        self.relays = list(relays)
+        self._by_hostname = {}
+        self._by_country = {}
+        self._by_city = {}  # (country name, city name) -> positions
+        self._by_city_name = {}  # city name -> positions, for cities queried without their country
+        self._by_type = {}
+        self._by_provider = {}
+        self._by_owned = {True: [], False: []}
+        self._by_bandwidth = {}
+        self._country_codes = {}
+        self._city_codes = {}
+        self._cities = {}  # country name -> city names in relay list order
+        self._cities_by_type = {}  # (country name, type) -> city names
+        self._providers = {}  # (country name, city name) -> provider names
+
+        snapshot = getattr(relays, "snapshot", None)
+        if snapshot is not None:
+            # Snapshot relays are lazy; index straight from the columns instead of touching each relay
+            rows = zip(*(snapshot.column(name) for name in INDEXED_FIELDS))
+        else:
+            rows = ((relay[HOSTNAME], relay[COUNTRY_NAME], relay[CITY_NAME], relay.get(TYPE), relay.get(PROVIDER),
+                     relay.get(OWNED), relay.get(BANDWIDTH, 0), relay[COUNTRY_CODE], relay[CITY_CODE])
+                    for relay in self.relays)
+        for position, row in enumerate(rows):
+            self._index(position, *row)
+        self._bandwidths = sorted(self._by_bandwidth)
+        # Relays with at least self._bandwidths[i], so a bandwidth filter is sized without gathering its positions
+        self._at_least = [0] * (len(self._bandwidths) + 1)
+        for i in range(len(self._bandwidths) - 1, -1, -1):
+            self._at_least[i] = self._at_least[i + 1] + len(self._by_bandwidth[self._bandwidths[i]])
+        self._countries = sorted(self._by_country)
+
+    def _index(self, position, hostname, country, city, relay_type, provider, owned, bandwidth, country_code, city_code):
+        self._by_hostname[hostname] = position
+        self._by_country.setdefault(country, []).append(position)
+        self._by_city.setdefault((country, city), []).append(position)
+        self._by_city_name.setdefault(city, []).append(position)
+        self._by_type.setdefault(relay_type, []).append(position)
+        self._by_provider.setdefault(provider, []).append(position)
+        self._by_owned[bool(owned)].append(position)
+        self._by_bandwidth.setdefault(bandwidth, []).append(position)
+        self._country_codes.setdefault(country, country_code)
+        self._city_codes.setdefault((country, city), city_code)
+
+        cities = self._cities.setdefault(country, [])
+        if city not in cities:
+            cities.append(city)
+        typed_cities = self._cities_by_type.setdefault((country, relay_type), [])
+        if city not in typed_cities:
+            typed_cities.append(city)
+        providers = self._providers.setdefault((country, city), [])
+        if provider not in providers:
+            providers.append(provider)
+
+    def apply_diff(self, diff):
+        """
+        Return a new catalog with a relay list diff applied (see relay_utilities.diffRelays), which must be taken
+        against this catalog's relays. The catalog itself is left unchanged, so readers on other threads never
+        see it half updated.
+        """
+        changed = {relay[HOSTNAME]: relay for relay in diff["changed"]}
+        removed = {relay[HOSTNAME] for relay in diff["removed"]}
+        relays = [changed.get(relay[HOSTNAME], relay) for relay in self.relays if relay[HOSTNAME] not in removed]
+        return RelayCatalog(relays + diff["added"])
+
+    def __len__(self):
+        return len(self.relays)
+
+    def __iter__(self):
+        return iter(self.relays)
+
+    def get(self, hostname):
+        position = self._by_hostname.get(hostname)
+        return None if position is None else self.relays[position]
+
+    def countries(self):
+        """Country names sorted alphabetically."""
+        return list(self._countries)
+
+    def cities(self, country, relay_type=None):
+        """City names of a country in relay list order, optionally only those with relays of `relay_type`."""
+        if relay_type is None:
+            return list(self._cities.get(country, []))
+        return list(self._cities_by_type.get((country, relay_type), []))
+
+    def providers(self, country, city):
+        return list(self._providers.get((country, city), []))
+
+    def has_type(self, country, relay_type):
+        return bool(self._cities_by_type.get((country, relay_type)))
+
+    def country_code(self, country):
+        return self._country_codes.get(country)
+
+    def city_code(self, country, city):
+        return self._city_codes.get((country, city))
+
+    def _bandwidth_positions(self, min_bandwidth):
+        start = bisect_left(self._bandwidths, min_bandwidth)
+        return sorted(position for bandwidth in self._bandwidths[start:] for position in self._by_bandwidth[bandwidth])
+
+    def query(self, country=None, city=None, relay_type=None, provider=None, owned=None, min_bandwidth=None):
+        """
+        Return the relays matching every given filter, in relay list order.
+        `city` alone matches that city name in any country. `owned=True` keeps only Mullvad-owned relays, `owned=False` only rented ones.
+        The smallest matching index is walked and the other filters are checked per candidate,
+        so the cost is bounded by the most selective filter rather than the whole relay list.
+        """
+        candidates = []
+        if country is not None:
+            if city is not None:
+                candidates.append(self._by_city.get((country, city), []))
+            else:
+                candidates.append(self._by_country.get(country, []))
+        elif city is not None:
+            candidates.append(self._by_city_name.get(city, []))
+        if relay_type is not None:
+            candidates.append(self._by_type.get(relay_type, []))
+        if provider is not None:
+            candidates.append(self._by_provider.get(provider, []))
+        if owned is not None:
+            candidates.append(self._by_owned[bool(owned)])
+        if min_bandwidth:
+            # Bandwidth positions span several index lists and have to be sorted, so they are only gathered
+            # when no other filter is as selective
+            count = self._at_least[bisect_left(self._bandwidths, min_bandwidth)]
+            if not candidates or count < min(len(positions) for positions in candidates):
+                candidates.append(self._bandwidth_positions(min_bandwidth))
+        if not candidates:
+            return list(self.relays)
+
+        matches = []
+        for position in min(candidates, key=len):
+            relay = self.relays[position]
+            if country is not None and relay[COUNTRY_NAME] != country:
+                continue
+            if city is not None and relay[CITY_NAME] != city:
+                continue
+            if relay_type is not None and relay.get(TYPE) != relay_type:
+                continue
+            if provider is not None and relay.get(PROVIDER) != provider:
+                continue
+            if owned is not None and bool(relay.get(OWNED)) != bool(owned):
+                continue
+            if min_bandwidth and relay.get(BANDWIDTH, 0) < min_bandwidth:
+                continue
+            matches.append(relay)
+        return matches
@@ -0,0 +1,206 @@
+import sqlite3
+import threading
+from time import time
+from collections.abc import Mapping
+from utils.relay_utilities import ACTIVE
+from utils.latency_history import HISTORY_FILE
+from utils.ping_utilities import probe_relays, relay_target
+from utils.dual_stack import FAMILIES
+from utils.progress import emit
+
+CLOSED = "closed"  # Healthy, probed normally
+OPEN = "open"  # Stopped answering, skipped until the cooldown has passed
+HALF_OPEN = "half-open"  # Cooldown over, gets one cheap trial probe before being probed normally again
+
+FAILURE_THRESHOLD = 2  # Scans in a row without any reply before a relay's breaker opens
+COOLDOWN = 15 * 60  # Seconds an open relay is skipped before its next trial probe
+MAX_COOLDOWN = 24 * 3600  # The cooldown doubles after every failed trial, up to this
+TRIAL_TIMEOUT = 500  # Milliseconds allowed for the trial probe of a half-open relay
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS relay_health (
+    hostname TEXT NOT NULL,
+    family TEXT NOT NULL,  -- Address family the breaker is for, "ipv4" or "ipv6"
+    failures INTEGER NOT NULL,  -- Scans in a row without any reply
+    opened_at REAL,  -- When the breaker last opened, NULL while closed
+    cooldown REAL,  -- Seconds until the next trial, NULL while closed
+    PRIMARY KEY (hostname, family)
+);
+"""
+
+
+def _families(family):
+    """The address families a scan over `family` ("ipv4", "ipv6" or "dual") probes."""
+    return FAMILIES if family == "dual" else (family,)
+
+
+class RelayHealth:
+    """
+    Per-relay circuit breaker persisted next to the latency history, so dead relays found by one run are
+    not waited on again by the next. A relay has one breaker per address family, since its IPv6 address can be
+    unreachable while its IPv4 address answers. Only breakers with failures are stored; a missing row means closed.
+    """
+
+    def __init__(self, path=HISTORY_FILE, failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN,
+                 max_cooldown=MAX_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(relay_health)")]
+        if columns and "family" not in columns:
+            # Breakers from before they were kept per family; dropping them only costs a probe of each dead relay
+            with self._conn:
+                self._conn.execute("DROP TABLE relay_health")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _rows(self, hostnames, family):
+        with self._lock:
+            rows = self._conn.execute("SELECT hostname, failures, opened_at, cooldown FROM relay_health "
+                                      "WHERE family = ?", (family,)).fetchall()
+        hostnames = set(hostnames)
+        return {row[0]: row[1:] for row in rows if row[0] in hostnames}
+
+    def states(self, hostnames, now=None, family="ipv4"):
+        """Return a dictionary with hostname as the key and CLOSED, OPEN or HALF_OPEN as the value."""
+        now = time() if now is None else now
+        rows = self._rows(hostnames, family)
+        states = {}
+        for hostname in hostnames:
+            failures, opened_at, cooldown = rows.get(hostname, (0, None, None))
+            if opened_at is None:
+                states[hostname] = CLOSED
+            elif now - opened_at < cooldown:
+                states[hostname] = OPEN
+            else:
+                states[hostname] = HALF_OPEN
+        return states
+
+    def plan(self, relays, now=None, family="ipv4"):
+        """
+        Split relay dicts into (probe, trial, skipped) for a scan over `family` ("ipv4", "ipv6" or "dual"): relays
+        to probe normally, half-open relays that get one trial probe first, and relays not probed at all because
+        the API marks them inactive or their breakers are open. In a dual-stack scan the families of a relay are
+        planned separately, so a relay with one family closed and the other half-open is both probed and trialled.
+        """
+        return self._plan(relays, now, family)[:3]
+
+    def _plan(self, relays, now, family):
+        """plan(), plus the {family: {hostname: state}} dictionary it was made from."""
+        families = _families(family)
+        relays = [relay for relay in relays if any(relay_target(relay, name)[1] for name in families)]
+        hostnames = [relay_target(relay)[0] for relay in relays]
+        states = {name: self.states(hostnames, now, name) for name in families}
+        probe, trial, skipped = [], [], []
+        for relay in relays:
+            hostname = relay_target(relay)[0]
+            relay_states = {states[name][hostname] for name in families if relay_target(relay, name)[1]}
+            if isinstance(relay, Mapping) and not relay.get(ACTIVE, True):
+                skipped.append(relay)
+                continue
+            if CLOSED in relay_states:
+                probe.append(relay)
+            if HALF_OPEN in relay_states:
+                trial.append(relay)
+            if relay_states == {OPEN}:
+                skipped.append(relay)
+        return probe, trial, skipped, states
+
+    def record_results(self, results, now=None, family="ipv4"):
+        """
+        Update the `family` breakers from ProbeResults: any reply closes a breaker, a scan without one counts as
+        a failure, and a half-open breaker whose trial failed opens again for twice as long. A batch in which no relay answered at all is ignored, since then it is most likely our own
+        connection that is down.
+        """
+        now = time() if now is None else now
+        results = list(results)
+        if not any(result.stats().received for result in results):
+            return
+        rows = self._rows([result.hostname for result in results], family)
+        with self._lock, self._conn:
+            for result in results:
+                if result.stats().received:
+                    if result.hostname in rows:
+                        self._conn.execute("DELETE FROM relay_health WHERE hostname = ? AND family = ?",
+                                           (result.hostname, family))
+                    continue
+                failures, opened_at, cooldown = rows.get(result.hostname, (0, None, None))
+                if opened_at is not None and now - opened_at < cooldown:
+                    continue  # Still open, so this wasn't its trial; only a trial may extend the cooldown
+                failures += 1
+                if opened_at is not None:
+                    # A failed trial: stay open, and wait longer before the next one
+                    opened_at, cooldown = now, min(cooldown * 2, self.max_cooldown)
+                elif failures >= self.failure_threshold:
+                    opened_at, cooldown = now, self.cooldown
+                self._conn.execute("INSERT OR REPLACE INTO relay_health VALUES (?, ?, ?, ?, ?)",
+                                   (result.hostname, family, failures, opened_at, cooldown))
+
+
+_health = None
+_health_lock = threading.Lock()
+
+
+def get_health():
+    """Return the shared relay health store of the application, opening it on first use."""
+    global _health
+    with _health_lock:
+        if _health is None:
+            _health = RelayHealth()
+        return _health
+
+
+def guarded_probe(relays, count=1, timeout=1000, output_text=None, stop_animation=None, health=None,
+                  probe_function=probe_relays, family="ipv4", **options):
+    """
+    Probe relays through their circuit breakers: inactive and open relays are skipped, half-open relays get a
+    single probe with a short timeout, and only those that answer it are probed fully alongside the healthy ones.
+    `probe_function` is probe_relays or a scheduler with the same signature (e.g. adaptive_probe_relays); it is
+    passed `family` ("ipv4" or "ipv6") and `options`. With family "dual" it is a dual-stack prober like
+    utils.dual_stack.probe_dual_stack, which is passed the families to probe per relay as `families` and returns a
+    {family: ProbeResult} dictionary per relay; each family of a relay goes through its own breaker. The trial probes use the same family and `backend` option as the scan; relays
+    that answer them are closed by the scan's result, failed trials are recorded in the same batch as the scan.
+    Returns the results of the fully probed relays, like probe_function.
+    """
+    health = health or get_health()
+    families = _families(family)
+    to_probe, trial, skipped, states = health._plan(relays, time(), family)
+    if skipped:
+        emit(output_text, f"Skipping {len(skipped)} inactive or unresponsive server(s).")
+    # The families each relay is probed over in full: those with a closed breaker, and those whose trial answers
+    probed_families = {relay_target(relay)[0]: [name for name in families if relay_target(relay, name)[1]
+                                                and states[name][relay_target(relay)[0]] == CLOSED]
+                       for relay in to_probe}
+    failed_trials = {name: [] for name in families}  # Recorded along with the scan, see record_results
+    if trial:
+        emit(output_text, f"Checking {len(trial)} previously unresponsive server(s)...")
+        for name in families:
+            half_open = [relay for relay in trial if relay_target(relay, name)[1]
+                         and states[name][relay_target(relay)[0]] == HALF_OPEN]
+            if not half_open:
+                continue
+            trial_results = probe_relays(half_open, count=1, timeout=min(timeout, TRIAL_TIMEOUT), output_text=output_text,
+                                         stop_animation=stop_animation, backend=options.get("backend"), family=name)
+            failed_trials[name] = [result for result in trial_results.values() if not result.stats().received]
+            for hostname, result in trial_results.items():
+                if result.stats().received:
+                    probed_families.setdefault(hostname, []).append(name)
+        probing = {relay_target(relay)[0] for relay in to_probe}
+        to_probe += [relay for relay in trial
+                     if relay_target(relay)[0] in probed_families and relay_target(relay)[0] not in probing]
+
+    if family == "dual":
+        options["families"] = probed_families
+    else:
+        options["family"] = family
+    results = probe_function(to_probe, count=count, timeout=timeout, output_text=output_text,
+                             stop_animation=stop_animation, **options)
+    for name in families:
+        outcomes = [value[name] for value in results.values() if name in value] if family == "dual" else results.values()
+        health.record_results(list(outcomes) + failed_trials[name], family=name)
+    return results
@@ -0,0 +1,210 @@
+import os
+import sys
+import json
+import struct
+from array import array
+from collections.abc import Mapping
+from utils.relay_utilities import (RELAYS_FILE, HOSTNAME, TYPE, COUNTRY_CODE, COUNTRY_NAME, CITY_CODE, CITY_NAME,
+                                   IPV4, IPV6, PROVIDER, BANDWIDTH, OWNED, ACTIVE)
+
+SNAPSHOT_FILE = os.path.splitext(RELAYS_FILE)[0] + ".snapshot"
+MAGIC = b"MLVS"
+SNAPSHOT_VERSION = 2  # Version 1 had no presence bits, so absent flags and bandwidths were loaded as False and 0
+
+# Fields kept as columns of string-table indexes; everything else is only in the per-relay JSON
+STRING_COLUMNS = (HOSTNAME, TYPE, COUNTRY_CODE, COUNTRY_NAME, CITY_CODE, CITY_NAME, IPV4, IPV6, PROVIDER)
+FLAG_COLUMNS = (OWNED, ACTIVE)
+COLUMNS = STRING_COLUMNS + (BANDWIDTH,) + FLAG_COLUMNS
+# Bits of the flags byte set when the relay has the field as a column value; if not, the field is absent or,
+# when it isn't a bool (an int for the bandwidth), kept in the per-relay JSON
+PRESENT = {OWNED: 2, ACTIVE: 3, BANDWIDTH: 4}
+MISSING = 0xFFFFFFFF  # String index of a field the relay doesn't have
+NULL = 0xFFFFFFFE  # String index of a field that is null
+
+# magic, version, byte order, relay count, string count, source timestamp
+HEADER = struct.Struct("<4sHcxIId")
+BYTE_ORDER = b"L" if sys.byteorder == "little" else b"B"
+
+
+def writeSnapshot(relays, timestamp, path=None):
+    """
+    Write relays as a columnar snapshot: a string table shared by all columns (so every country, city,
+    provider and type name is stored once), one column of string indexes per field, bandwidth and flag
+    columns, and the JSON of the remaining fields of each relay for lazy materialization.
+    Written to SNAPSHOT_FILE unless `path` is given.
+    """
+    path = path or SNAPSHOT_FILE
+    strings = []
+    string_ids = {}
+
+    def intern(relay, name):
+        if name not in relay:
+            return MISSING
+        value = relay[name]
+        if value is None:
+            return NULL
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    def stored(relay):
+        """The flag and bandwidth fields of a relay that fit their column."""
+        fields = {name for name in FLAG_COLUMNS if isinstance(relay.get(name), bool)}
+        bandwidth = relay.get(BANDWIDTH)
+        if isinstance(bandwidth, int) and not isinstance(bandwidth, bool) and 0 <= bandwidth < MISSING:
+            fields.add(BANDWIDTH)
+        return fields
+
+    columns = [array("I", (intern(relay, name) for relay in relays)) for name in STRING_COLUMNS]
+    bandwidths = array("I")
+    flags = array("B")
+    blobs = []
+    for relay in relays:
+        fields = stored(relay)
+        bandwidths.append(relay[BANDWIDTH] if BANDWIDTH in fields else 0)
+        flags.append(sum(1 << bit for bit, name in enumerate(FLAG_COLUMNS) if name in fields and relay[name]) +
+                     sum(1 << PRESENT[name] for name in fields))
+        # Only the fields that aren't columns go in the per-relay JSON
+        blobs.append(json.dumps({key: value for key, value in relay.items()
+                                 if key not in STRING_COLUMNS and key not in fields},
+                                separators=(",", ":")).encode("utf-8"))
+    encoded = [string.encode("utf-8") for string in strings]
+
+    def offsets(chunks):
+        result = array("I", [0])
+        for chunk in chunks:
+            result.append(result[-1] + len(chunk))
+        return result
+
+    # Fixed-size sections first so they stay 4-byte aligned for zero-copy casts
+    sections = [offsets(encoded).tobytes(), offsets(blobs).tobytes()]
+    sections += [column.tobytes() for column in columns]
+    sections += [bandwidths.tobytes(), flags.tobytes(), b"".join(encoded), b"".join(blobs)]
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, SNAPSHOT_VERSION, BYTE_ORDER, len(relays), len(strings), timestamp))
+        for section in sections:
+            f.write(section)
+    os.replace(tmp_path, path)
+
+
+class RelaySnapshot:
+    """
+    Read-only view of a snapshot file. Columns are memoryview casts over the file contents,
+    strings are decoded on first use and full relay dicts are parsed only when a non-column field is read.
+    """
+
+    def __init__(self, data):
+        magic, version, byte_order, count, string_count, timestamp = HEADER.unpack_from(data)
+        if magic != MAGIC or version != SNAPSHOT_VERSION or byte_order != BYTE_ORDER:
+            raise ValueError("Unsupported relay snapshot")
+        self.count = count
+        self.timestamp = timestamp
+        view = memoryview(data)
+        position = HEADER.size
+
+        def take(length, fmt):
+            nonlocal position
+            size = length * struct.calcsize(fmt)
+            section = view[position:position + size].cast(fmt)
+            position += size
+            return section
+
+        self._string_offsets = take(string_count + 1, "I")
+        self._blob_offsets = take(count + 1, "I")
+        self._columns = {name: take(count, "I") for name in STRING_COLUMNS}
+        self._bandwidths = take(count, "I")
+        self._flags = take(count, "B")
+        self._strings_data = take(self._string_offsets[-1], "B")
+        self._blobs_data = take(self._blob_offsets[-1], "B")
+        self._strings = [None] * string_count
+
+    def string(self, index):
+        if index >= NULL:
+            return None
+        value = self._strings[index]
+        if value is None:
+            value = str(self._strings_data[self._string_offsets[index]:self._string_offsets[index + 1]], "utf-8")
+            self._strings[index] = value
+        return value
+
+    def has(self, position, name):
+        """Whether the relay's `name` field is stored in its column (else it is absent or in the relay JSON)."""
+        if name in PRESENT:
+            return bool(self._flags[position] >> PRESENT[name] & 1)
+        return self._columns[name][position] != MISSING
+
+    def value(self, position, name):
+        """Read one column field of a relay without materializing the relay; None if it isn't in the column."""
+        if name == BANDWIDTH:
+            return self._bandwidths[position] if self.has(position, name) else None
+        if name in FLAG_COLUMNS:
+            return bool(self._flags[position] >> FLAG_COLUMNS.index(name) & 1) if self.has(position, name) else None
+        return self.string(self._columns[name][position])
+
+    def column(self, name):
+        """
+        Return a whole column as a list of values, in relay order: like relay.get(name), except that
+        relays without a bandwidth in the column read as 0.
+        """
+        if name == BANDWIDTH:
+            return self._bandwidths.tolist()
+        if name in FLAG_COLUMNS:
+            bit, present = FLAG_COLUMNS.index(name), PRESENT[name]
+            return [bool(flags >> bit & 1) if flags >> present & 1 else None for flags in self._flags]
+        string = self.string
+        return [string(index) for index in self._columns[name]]
+
+    def materialize(self, position):
+        """Rebuild the full relay dict stored for `position`."""
+        start, end = self._blob_offsets[position], self._blob_offsets[position + 1]
+        relay = {name: self.value(position, name) for name in COLUMNS if self.has(position, name)}
+        relay.update(json.loads(bytes(self._blobs_data[start:end])))
+        return relay
+
+
+class SnapshotRelay(Mapping):
+    """A relay backed by a snapshot; column fields are read directly, other fields parse the full relay once."""
+    __slots__ = ("_snapshot", "_position", "_full")
+
+    def __init__(self, snapshot, position):
+        self._snapshot = snapshot
+        self._position = position
+        self._full = None
+
+    def _materialize(self):
+        if self._full is None:
+            self._full = self._snapshot.materialize(self._position)
+        return self._full
+
+    def __getitem__(self, key):
+        if key in COLUMNS and self._full is None:
+            value = self._snapshot.value(self._position, key)
+            if value is not None:
+                return value
+        return self._materialize()[key]  # Raises KeyError for missing fields
+
+    def __iter__(self):
+        return iter(self._materialize())
+
+    def __len__(self):
+        return len(self._materialize())
+
+    def __repr__(self):
+        return f"SnapshotRelay({self._snapshot.value(self._position, HOSTNAME)!r})"
+
+
+class LazyRelays(list):
+    """List of SnapshotRelay objects, so code expecting the relay list works unchanged."""
+
+    def __init__(self, snapshot):
+        super().__init__(SnapshotRelay(snapshot, position) for position in range(snapshot.count))
+        self.snapshot = snapshot
+
+
+def loadSnapshot(path=None):
+    """Load a snapshot file (SNAPSHOT_FILE by default) and return it as a LazyRelays list."""
+    with open(path or SNAPSHOT_FILE, "rb") as f:
+        return LazyRelays(RelaySnapshot(f.read()))
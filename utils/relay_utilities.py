@@ -1,7 +1,8 @@
 import os
 import json
-import requests
+import tempfile
 from time import time
+from utils.tracing import span
 
 # Relay attributes
 TIMESTAMP_INDEX = 0
@@ -16,44 +17,162 @@ IPV6 = "ipv6_addr_in"
 PROVIDER = "provider"
 BANDWIDTH = "network_port_speed"
 OWNED = "owned"
+ACTIVE = "active"
 
 WIREGUARD = "wireguard"
 OPENVPN = "openvpn"
 BRIDGE = "bridge"
 
 RELAYS_LINK = "https://api.mullvad.net/www/relays/all/"
-RELAYS_FILE = os.path.join(os.getenv("TEMP"), "mulpingData.json")  # File path for Windows
+RELAYS_FILE = os.path.join(tempfile.gettempdir(), "mulpingData.json")  # %TEMP% on Windows
+CACHE_VERSION = 2  # Version 1 was a bare list with the timestamp as element 0
+MAX_AGE = 43200  # Cached relays older than 12 hours are revalidated with the API
+REQUEST_TIMEOUT = 10  # Seconds to wait for the relay API
 
-def fetchRelays():
-    """Fetch the latest relays from the Mullvad API and save them locally."""
+_session = None
+
+def getSession():
+    """Return the shared HTTP session so connections to the API are reused."""
+    global _session
+    if _session is None:
+        import requests  # Imported on first use so the package starts quickly
+        _session = requests.Session()
+    return _session
+
+def readCache():
+    """Read the relay cache file and return its contents as a dict, converting the old list format."""
+    with open(RELAYS_FILE, "r") as f:
+        cache = json.loads(f.read())
+    if isinstance(cache, list):
+        if not cache or not isinstance(cache[TIMESTAMP_INDEX], (float, int)):
+            raise ValueError("Invalid relay cache")
+        return {"version": CACHE_VERSION, "timestamp": cache[TIMESTAMP_INDEX], "etag": None,
+                "last_modified": None, "relays": cache[TIMESTAMP_INDEX + 1:]}
+    if cache.get("version") != CACHE_VERSION:
+        raise ValueError("Unsupported relay cache version")
+    return cache
+
+def writeCache(cache):
+    """Write the relay cache atomically so a crash never leaves a truncated file behind."""
+    tmp_file = RELAYS_FILE + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp_file, RELAYS_FILE)
+
+    # Keep the fast-start snapshot in step with the cache
+    from utils.relay_snapshot import writeSnapshot
+    try:
+        writeSnapshot(cache["relays"], cache["timestamp"])
+    except Exception as e:
+        print(f"Failed to write relay snapshot: {e}")
+
+def diffRelays(old_relays, new_relays):
+    """
+    Compare two relay lists by hostname.
+    Returns a dict with the "added" and "changed" relays (new versions) and the "removed" relays (old versions).
+    """
+    old_by_hostname = {relay[HOSTNAME]: relay for relay in old_relays}
+    new_by_hostname = {relay[HOSTNAME]: relay for relay in new_relays}
+    return {
+        "added": [relay for hostname, relay in new_by_hostname.items() if hostname not in old_by_hostname],
+        "removed": [relay for hostname, relay in old_by_hostname.items() if hostname not in new_by_hostname],
+        "changed": [relay for hostname, relay in new_by_hostname.items()
+                    if hostname in old_by_hostname and old_by_hostname[hostname] != relay],
+    }
+
+def refreshRelays():
+    """
+    Revalidate the cached relays with the Mullvad API using ETag / Last-Modified.
+    Returns (relays, diff) where diff lists what changed compared to the cache (see diffRelays).
+    If the API can't be reached, the cached relays are returned unchanged (or [] without a cache).
+    """
+    try:
+        cache = readCache()
+    except Exception:
+        cache = None
+
+    headers = {}
+    if cache is not None:
+        if cache.get("etag"):
+            headers["If-None-Match"] = cache["etag"]
+        if cache.get("last_modified"):
+            headers["If-Modified-Since"] = cache["last_modified"]
+
+    old_relays = cache["relays"] if cache is not None else []
     try:
-        relays = requests.get(f"{RELAYS_LINK}").json()
-    except:
-        return []
-    relays.insert(TIMESTAMP_INDEX, time())  # Insert current timestamp at the beginning
-    with open(RELAYS_FILE, "w") as f:
-        json.dump(relays, f) 
-    del relays[TIMESTAMP_INDEX]
+        with span("fetch relays"):
+            response = getSession().get(RELAYS_LINK, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 304 and cache is not None:
+            relays = old_relays  # Unchanged since the last download
+        else:
+            response.raise_for_status()
+            relays = response.json()
+    except Exception as e:
+        print(f"Failed to fetch relays: {e}")
+        return old_relays, diffRelays([], [])
+
+    writeCache({
+        "version": CACHE_VERSION,
+        "timestamp": time(),
+        "etag": response.headers.get("ETag") or (cache or {}).get("etag"),
+        "last_modified": response.headers.get("Last-Modified") or (cache or {}).get("last_modified"),
+        "relays": relays,
+    })
+    if relays is old_relays:
+        return relays, diffRelays([], [])
+    return relays, diffRelays(old_relays, relays)
+
+def fetchRelays():
+    """Fetch the latest relays from the Mullvad API (conditionally) and save them locally."""
+    relays, _ = refreshRelays()
     return relays
 
 def loadRelays():
     """Load relays from the local file if available and not older than 12 hours."""
-    with open(RELAYS_FILE, "r") as f:
-        relays = json.loads(f.read())
-    if not isinstance(relays[TIMESTAMP_INDEX], (float, int)):
-        raise Exception
-    if time() - relays[TIMESTAMP_INDEX] >= 43200:  # Check if data is older than 12 hours
-        raise Exception
-    del relays[TIMESTAMP_INDEX]
-    return relays
+    cache = readCache()
+    if time() - cache["timestamp"] >= MAX_AGE:  # Check if data is older than 12 hours
+        raise Exception("Relay cache is outdated")
+    return cache["relays"]
+
+def loadCachedRelays():
+    """
+    Return (relays, timestamp) from the snapshot or the cache file whatever their age, without touching the network,
+    so the relays from the last run can be shown while fresh ones are fetched. Returns ([], None) without a cache.
+    """
+    from utils.relay_snapshot import loadSnapshot
+    try:
+        with span("load relay snapshot"):
+            relays = loadSnapshot()
+        return relays, relays.snapshot.timestamp
+    except Exception:
+        pass
+    try:
+        with span("load relays"):
+            cache = readCache()
+        return cache["relays"], cache["timestamp"]
+    except Exception:
+        return [], None
 
 def getRelays():
-    """Retrieve relays by loading from file or fetching from the API if not available or outdated."""
-    if os.path.isfile(RELAYS_FILE):
-        try:
-            relays = loadRelays()
-        except:
+    """
+    Retrieve relays by loading from file or fetching from the API if not available or outdated.
+    The binary snapshot is tried first since it loads without parsing the JSON dump.
+    """
+    from utils.relay_snapshot import loadSnapshot
+    try:
+        with span("load relay snapshot"):
+            relays = loadSnapshot()
+        if time() - relays.snapshot.timestamp < MAX_AGE:
+            return relays
+    except Exception:
+        pass
+
+    with span("load relays"):
+        if os.path.isfile(RELAYS_FILE):
+            try:
+                relays = loadRelays()
+            except:
+                relays = fetchRelays()
+        else:
             relays = fetchRelays()
-    else:
-        relays = fetchRelays()
     return relays
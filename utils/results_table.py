@@ -0,0 +1,129 @@
+from tkinter import ttk
+from utils.relay_utilities import HOSTNAME, CITY_NAME, PROVIDER, BANDWIDTH
+from utils.latency_stats import score_balanced, score_result
+from utils.ranking import IncrementalRanking
+
+# (column id, heading, width); "rank" is the position by the selected scoring function
+COLUMNS = (
+    ("rank", "#", 40),
+    ("hostname", "Server", 130),
+    ("city", "City", 100),
+    ("provider", "Provider", 90),
+    ("bandwidth", "Gbps", 50),
+    ("distance", "km", 60),
+    ("min", "Min", 60),
+    ("median", "Median", 60),
+    ("p99", "p99", 60),
+    ("jitter", "Jitter", 60),
+    ("loss", "Loss %", 60),
+)
+
+
+def format_ms(value):
+    return f"{value:.2f}" if value is not None and value == value else ""
+
+
+class ResultsTable:
+    """
+    ttk.Treeview of probe results that stays sorted while results stream in.
+    Each result moves a single row to the position found by IncrementalRanking, so an update costs a
+    binary search and one Treeview move rather than a full re-sort. Must only be used from the Tk main loop;
+    workers hand results over through utils.event_queue and apply() takes them in batches.
+    """
+
+    def __init__(self, parent, height=10):
+        self.tree = ttk.Treeview(parent, columns=[column for column, _, _ in COLUMNS], show="headings", height=height)
+        for column, heading, width in COLUMNS:
+            self.tree.heading(column, text=heading, command=lambda column=column: self.sort_by(column))
+            self.tree.column(column, width=width, anchor="w" if column in ("hostname", "city", "provider") else "e")
+        self.score = score_balanced
+        self.sort_column = "rank"
+        self.descending = False
+        self.relays = {}
+        self.distances = {}
+        self.rows = {}  # hostname -> {column: sortable value}
+        self.ranking = IncrementalRanking()
+
+    def grid(self, **options):
+        self.tree.grid(**options)
+
+    def start(self, relays, distances=None, score=score_balanced):
+        """Clear the table for a new scan of `relays`; `distances` maps hostname -> km when the location is known."""
+        self.tree.delete(*self.tree.get_children())
+        self.relays = {relay[HOSTNAME]: relay for relay in relays}
+        self.distances = distances or {}
+        self.score = score
+        self.rows = {}
+        self.ranking.clear()
+
+    def _row(self, result):
+        relay = self.relays.get(result.hostname, {})
+        stats = result.stats()
+        return {
+            "rank": score_result(result, self.score),
+            "hostname": result.hostname,
+            "city": relay.get(CITY_NAME),
+            "provider": relay.get(PROVIDER),
+            "bandwidth": relay.get(BANDWIDTH),
+            "distance": self.distances.get(result.hostname),
+            "min": stats.min if stats.received else None,
+            "median": stats.median if stats.received else None,
+            "p99": stats.p99 if stats.received else None,
+            "jitter": stats.jitter if stats.received else None,
+            "loss": stats.loss,
+        }
+
+    def _display(self, row):
+        return (
+            "",  # Filled in by _renumber
+            row["hostname"],
+            row["city"] or "",
+            row["provider"] or "",
+            row["bandwidth"] if row["bandwidth"] is not None else "",
+            f"{row['distance']:.0f}" if row["distance"] is not None else "",
+            format_ms(row["min"]),
+            format_ms(row["median"]),
+            format_ms(row["p99"]),
+            format_ms(row["jitter"]),
+            f"{row['loss']:.0f}",
+        )
+
+    def _position(self, index):
+        return len(self.ranking) - 1 - index if self.descending else index
+
+    def apply(self, results):
+        """Insert or update the rows of a batch of ProbeResults, keeping the current sort order."""
+        latest = {result.hostname: result for result in results}  # A host reported twice in a batch is drawn once
+        first = None  # Lowest position whose row changed; the rows above it keep their rank
+        for hostname, result in latest.items():
+            row = self.rows[hostname] = self._row(result)
+            old = self._position(self.ranking.index(hostname)) if hostname in self.ranking else None
+            position = self._position(self.ranking.update(hostname, row[self.sort_column]))
+            if self.tree.exists(hostname):
+                self.tree.item(hostname, values=self._display(row))
+                self.tree.move(hostname, "", position)
+            else:
+                self.tree.insert("", position, iid=hostname, values=self._display(row))
+            # A move shifts the rows between its old and new position, an insert every row after it
+            changed = position if old is None else min(old, position)
+            first = changed if first is None else min(first, changed)
+        if first is not None:
+            self._renumber(first)
+
+    def _renumber(self, first=0):
+        # The rank column shows the position by score; only meaningful while sorted by it
+        if self.sort_column != "rank":
+            return
+        for position, hostname in enumerate(self.tree.get_children()[first:], start=first + 1):
+            self.tree.set(hostname, "rank", position)
+
+    def sort_by(self, column):
+        """Sort by a column (clicking it again reverses the order); this one change re-sorts every row."""
+        self.descending = not self.descending if column == self.sort_column else False
+        self.sort_column = column
+        self.ranking.clear()
+        for hostname, row in self.rows.items():
+            self.ranking.update(hostname, row[column])
+        for index, hostname in enumerate(self.ranking):
+            self.tree.move(hostname, "", self._position(index))
+        self._renumber()
@@ -1,30 +1,38 @@
 import os
-import requests
+import math
 import json
-from geopy.distance import geodesic
-from utils.relay_utilities import fetchRelays
+from utils.geo_utilities import EARTH_RADIUS_KM, SPHERE_ERROR
+from utils.spatial_index import SpatialIndex
+from utils.geocoding import (NominatimGeocoder, GazetteerGeocoder, ChainGeocoder, geocode_cities, city_key,
+                             write_json_atomic)
+from utils.relay_utilities import getRelays
 from utils.ping_utilities import ping
-import sys
+from utils.latency_history import get_history
+from utils.latency_model import fit_from_history, rank_by_prediction
+from utils.relay_health import get_health, guarded_probe
+from utils.paths import DATA_DIR
+from utils.progress import emit
+from utils.tracing import span, traced
 
-if getattr(sys, 'frozen', False):  
-    BASE_DIR = os.path.dirname(sys.executable) 
-else:
-    BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-BASE_DIR = os.path.dirname(BASE_DIR)
-COORDINATES_FILE = os.path.join(BASE_DIR, "data", "coordinates.json")
+COORDINATES_FILE = os.path.join(DATA_DIR, "coordinates.json")
+# Optional offline gazetteers consulted before Nominatim
+GAZETTEER_FILES = [os.path.join(DATA_DIR, "gazetteer.json"), os.path.join(DATA_DIR, "gazetteer.csv")]
+_default_geocoder = None
+
+# Spatial index over the city coordinates, rebuilt only when coordinates.json changes
+_city_index = None
+_city_index_mtime = None
 
 
 # Helper function to print messages to GUI or console
 def gui_print(message, output_text=None):
-    print(message)  
-    if output_text is not None:
-        output_text.insert("end", message + "\n")  
-        output_text.see("end")  
-        output_text.update_idletasks()  
+    emit(output_text, message)
 
 # Fetch the current location based on Mullvad's API
+@traced("location lookup")
 def fetch_current_location(output_text=None):
     try:
+        import requests  # Imported on first use so the package starts quickly
         response = requests.get("https://am.i.mullvad.net/json", timeout=5)  
         if response.status_code == 200:
             data = response.json()
@@ -46,33 +54,49 @@ def load_coordinates(output_text=None):
 
 def save_coordinates(coordinates, output_text=None):
     try:
-        with open(COORDINATES_FILE, "w") as file:
-            json.dump(coordinates, file, indent=4)
+        write_json_atomic(COORDINATES_FILE, coordinates)
         print(f"Coordinates saved successfully at {COORDINATES_FILE}.") 
+        invalidate_city_index()
     except Exception as e:
         print(f"Failed to save coordinates: {e}")  
 
 
 
+def get_default_geocoder():
+    """Offline gazetteer files in data/ (if any) first, then Nominatim, sharing one session and rate limit."""
+    global _default_geocoder
+    if _default_geocoder is None:
+        gazetteers = [GazetteerGeocoder(path) for path in GAZETTEER_FILES if os.path.exists(path)]
+        _default_geocoder = ChainGeocoder(*gazetteers, NominatimGeocoder())
+    return _default_geocoder
+
 # Update coordinates using OpenStreetMap API if not present in coordinates.json
-def update_coordinates(relays_data, output_text=None):
+def update_coordinates(relays_data, output_text=None, geocoder=None):
+    """
+    Geocode every city of `relays_data` that is missing from coordinates.json.
+    Cities are deduplicated before any request, looked up concurrently under the geocoder's rate limit,
+    and each result is saved as soon as it arrives.
+    """
     coordinates = load_coordinates(output_text)
-    updated = False
+    missing = [(relay['country_name'], relay['city_name']) for relay in relays_data
+               if city_key(relay['country_name'], relay['city_name']) not in coordinates]
+    if not missing:
+        gui_print("No new coordinates were added.", output_text)
+        return
 
-    for relay in relays_data:
-        city_key = f"{relay['country_name']}-{relay['city_name']}"
-        if city_key not in coordinates:
-            gui_print(f"Fetching coordinates for {city_key}", output_text)
-            coords = fetch_coordinates_from_osm(relay['city_name'], relay['country_name'], output_text)
-            if coords:
-                coordinates[city_key] = coords
-                updated = True
-                gui_print(f"Coordinates for {city_key} added: {coords}", output_text)
-            else:
-                gui_print(f"Failed to fetch coordinates for {city_key}", output_text)
-
-    if updated:
-        save_coordinates(coordinates, output_text)
+    def on_result(key, coords, error):
+        if coords:
+            coordinates[key] = list(coords)
+            save_coordinates(coordinates, output_text)
+            gui_print(f"Coordinates for {key} added: {coords}", output_text)
+        elif error is not None:
+            gui_print(f"Failed to fetch coordinates for {key}: {error}", output_text)
+        else:
+            gui_print(f"No coordinates found for {key}", output_text)
+
+    gui_print(f"Fetching coordinates for {len(set(missing))} cities", output_text)
+    found = geocode_cities(missing, geocoder or get_default_geocoder(), on_result=on_result)
+    if found:
         gui_print("Coordinates updated successfully.", output_text)
     else:
         gui_print("No new coordinates were added.", output_text)
@@ -80,30 +104,96 @@ def update_coordinates(relays_data, output_text=None):
 # Fetch coordinates using OpenStreetMap API
 def fetch_coordinates_from_osm(city, country, output_text=None):
     try:
-        # Use Nominatim API to fetch the coordinates with a timeout
-        response = requests.get(
-            "https://nominatim.openstreetmap.org/search",
-            params={"city": city, "country": country, "format": "json"},
-            timeout=5  # Set a 5 second timeout for the request
-        )
-        data = response.json()
-        if data and len(data) > 0:
-            return float(data[0]["lat"]), float(data[0]["lon"])
+        return get_default_geocoder().geocode(city, country)
     except Exception as e:
         gui_print(f"Failed to fetch coordinates from OpenStreetMap: {e}", output_text)
     return None
 
-# Calculate distance from the current location to each relay
-def calculate_distances(current_location, relays_data, output_text=None):
-    coordinates = load_coordinates(output_text)
-    distances = []
+def invalidate_city_index():
+    global _city_index
+    _city_index = None
+
+@traced("city index")
+def get_city_index(output_text=None):
+    """Return (coordinates, SpatialIndex over the cities), loading coordinates.json only when it changed."""
+    global _city_index, _city_index_mtime
+    try:
+        mtime = os.path.getmtime(COORDINATES_FILE)
+    except OSError:
+        mtime = None
+    if _city_index is None or mtime != _city_index_mtime:
+        coordinates = load_coordinates(output_text)
+        _city_index = (coordinates, SpatialIndex(coordinates.items()))
+        _city_index_mtime = mtime
+    return _city_index
+
+def group_relays_by_city(relays_data):
+    """Return {city_key: [relays]} keeping the relay order."""
+    city_relays = {}
     for relay in relays_data:
-        city_key = f"{relay['country_name']}-{relay['city_name']}"
-        if city_key in coordinates:
-            relay_coords = coordinates[city_key]
-            distance = geodesic(current_location, relay_coords).kilometers
+        city_relays.setdefault(f"{relay['country_name']}-{relay['city_name']}", []).append(relay)
+    return city_relays
+
+def _rank_cities(location, city_relays, coordinates, index, top_k, exact):
+    """Return [(city_key, km)] holding at least the `top_k` closest relays (all cities if None), closest first."""
+    has_relays = city_relays.__contains__
+    if top_k is None:
+        ranked = index.within(*location, math.pi * EARTH_RADIUS_KM, accept=has_relays)
+    else:
+        # Each city has at least one relay, so the k closest cities always hold the k closest relays
+        ranked = index.nearest(*location, top_k, accept=has_relays)
+        covered = 0
+        for position, (city_key, distance) in enumerate(ranked):
+            covered += len(city_relays[city_key])
+            if covered >= top_k:
+                ranked = ranked[:position + 1]
+                break
+        if exact and ranked:
+            # Anything within the sphere's error of the k-th distance could still make it after refinement
+            ranked = index.within(*location, ranked[-1][1] * (1 + 2 * SPHERE_ERROR), accept=has_relays)
+
+    if exact:
+        from geopy.distance import geodesic  # Only needed for the exact refinement
+        ranked = sorted(((city_key, geodesic(location, coordinates[city_key]).kilometers) for city_key, _ in ranked),
+                        key=lambda x: x[1])
+    return ranked
+
+def _closest_relays(location, city_relays, coordinates, index, top_k, exact):
+    distances = []
+    for city_key, distance in _rank_cities(location, city_relays, coordinates, index, top_k, exact):
+        for relay in city_relays[city_key]:
             distances.append((relay['hostname'], distance, relay['ipv4_addr_in']))
-    return sorted(distances, key=lambda x: x[1])  # Sort by distance
+    return distances[:top_k]
+
+# Calculate distance from the current location to each relay
+@traced("distance ranking")
+def calculate_distances(current_location, relays_data, output_text=None, top_k=None, exact=True):
+    """
+    Return (hostname, distance in km, ip) for every relay with known coordinates, sorted by distance.
+    Cities are looked up in a spatial index, so with `top_k` only the cities near the location are visited.
+    With `exact`, cities that could be in the top k are re-measured with the WGS-84 geodesic and re-ranked,
+    so the result matches ranking everything by geodesic.
+    """
+    coordinates, index = get_city_index(output_text)
+    return _closest_relays(tuple(current_location), group_relays_by_city(relays_data), coordinates, index, top_k, exact)
+
+def batch_calculate_distances(locations, relays_data, top_k=10, exact=True, output_text=None):
+    """
+    Rank relays for many locations in one call, e.g. a list of office sites.
+    `locations` is a dict of name -> (lat, lon); returns a dict of name -> calculate_distances result.
+    """
+    coordinates, index = get_city_index(output_text)
+    city_relays = group_relays_by_city(relays_data)
+    return {name: _closest_relays(tuple(location), city_relays, coordinates, index, top_k, exact)
+            for name, location in locations.items()}
+
+def find_relays_within(location, relays_data, radius_km, output_text=None):
+    """Return (hostname, great-circle km, ip) for every relay within `radius_km` of `location`, closest first."""
+    coordinates, index = get_city_index(output_text)
+    city_relays = group_relays_by_city(relays_data)
+    return [(relay['hostname'], distance, relay['ipv4_addr_in'])
+            for city_key, distance in index.within(*location, radius_km, accept=city_relays.__contains__)
+            for relay in city_relays[city_key]]
 
 # Function to calculate latency (ping) for each server using the imported ping function
 def get_server_latency(ip_address, count=1, timeout=1000, output_text=None):
@@ -114,22 +204,46 @@ def get_server_latency(ip_address, count=1, timeout=1000, output_text=None):
         gui_print(f"Failed to calculate latency for {ip_address}: {e}", output_text)
         return None
 
+# Probe the relays the latency model expects to be fastest from a location
+def probe_closest_servers(current_location, relays_data, top_k=10, count=1, timeout=1000, output_text=None,
+                          stop_animation=None):
+    """
+    Return [(relay, great-circle km, predicted ms, ProbeResult or None)] for the `top_k` relays with the
+    lowest predicted latency, in predicted order. Without history the prediction ranks by distance.
+    Inactive relays and relays whose circuit breaker is open are left out.
+    """
+    gui_print("Calculating distances to closest servers...", output_text)
+    distances = {hostname: distance for hostname, distance, _ in
+                 calculate_distances(current_location, relays_data, output_text, exact=False)}
+
+    history = get_history()
+    health = get_health()
+    with span("latency model"):
+        model = fit_from_history(history, relays_data, distances)
+        ranked = rank_by_prediction(model, relays_data, distances)
+    to_probe, trial, _ = health.plan([relay for relay, _, _ in ranked])
+    live = {relay['hostname'] for relay in to_probe + trial}
+    candidates = [entry for entry in ranked if entry[0]['hostname'] in live][:top_k]
+    gui_print(f"Probing {len(candidates)} servers ({model.points} relays in the latency model)...", output_text)
+
+    # Ping the candidates concurrently and remember the results
+    results = guarded_probe([relay for relay, _, _ in candidates], count=count, timeout=timeout,
+                            output_text=output_text, stop_animation=stop_animation, health=health)
+    history.record_results(results.values())
+    return [(relay, distance, predicted, results.get(relay['hostname'])) for relay, distance, predicted in candidates]
+
 # Main function to get closest servers with latency without updating coordinates
 def find_closest_servers(output_text=None):
-    relays_data = fetchRelays()
+    relays_data = getRelays()  # Cached relays, revalidated with the API when outdated
 
     current_location = fetch_current_location(output_text)
     if not current_location or current_location == (None, None):
         gui_print("Could not get current location. Exiting...", output_text)
         return
 
-    gui_print("Calculating distances to closest servers...", output_text)
-    distances = calculate_distances(current_location, relays_data, output_text)
+    closest = probe_closest_servers(current_location, relays_data, output_text=output_text)
     gui_print("\nClosest servers based on current location and latency:\n", output_text)
-
-    for hostname, distance, ip in distances[:10]:  # Show top 10 closest servers
-        latency = get_server_latency(ip, output_text=output_text)  # Calculate latency for each server
+    for relay, distance, predicted, result in closest:
+        latency = result.stats().mean if result is not None else None
         latency_display = f"{latency:.2f} ms" if latency is not None else "N/A"
-        gui_print(f"{hostname} - {distance:.2f} km - {latency_display}", output_text)
-
-
+        gui_print(f"{relay['hostname']} - {distance:.2f} km - predicted {predicted:.2f} ms - {latency_display}", output_text)
@@ -0,0 +1,97 @@
+import heapq
+from utils.geo_utilities import unit_vector, chord_to_km, km_to_chord
+
+
+class SpatialIndex:
+    """
+    k-d tree over points on the globe, stored as 3D unit vectors so there is no seam at the antimeridian
+    or distortion near the poles. Straight-line (chord) distance between unit vectors orders points the
+    same way as great-circle distance, so queries work on chords and convert to km at the end.
+    """
+
+    def __init__(self, points):
+        """`points` is an iterable of (key, (lat, lon))."""
+        self.keys = []
+        self.vectors = []
+        for key, (lat, lon) in points:
+            self.keys.append(key)
+            self.vectors.append(unit_vector(lat, lon))
+        # Nodes are (point index, split axis, left child, right child); children are node indexes or -1
+        self._nodes = []
+        self._root = self._build(list(range(len(self.vectors))), 0)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _build(self, indexes, depth):
+        if not indexes:
+            return -1
+        axis = depth % 3
+        indexes.sort(key=lambda index: self.vectors[index][axis])
+        middle = len(indexes) // 2
+        node = len(self._nodes)
+        self._nodes.append(None)
+        left = self._build(indexes[:middle], depth + 1)
+        right = self._build(indexes[middle + 1:], depth + 1)
+        self._nodes[node] = (indexes[middle], axis, left, right)
+        return node
+
+    def _squared_chord(self, vector, index):
+        point = self.vectors[index]
+        return (vector[0] - point[0]) ** 2 + (vector[1] - point[1]) ** 2 + (vector[2] - point[2]) ** 2
+
+    def nearest(self, lat, lon, k=1, accept=None):
+        """
+        Return up to `k` (key, great-circle km) pairs closest to (lat, lon), closest first.
+        `accept(key)` can exclude points without rebuilding the index.
+        """
+        vector = unit_vector(lat, lon)
+        best = []  # Max-heap of (-squared chord, index), holding the k closest so far
+
+        def visit(node):
+            if node == -1:
+                return
+            index, axis, left, right = self._nodes[node]
+            difference = vector[axis] - self.vectors[index][axis]
+            near, far = (left, right) if difference < 0 else (right, left)
+            visit(near)
+            if accept is None or accept(self.keys[index]):
+                squared = self._squared_chord(vector, index)
+                if len(best) < k:
+                    heapq.heappush(best, (-squared, index))
+                elif squared < -best[0][0]:
+                    heapq.heapreplace(best, (-squared, index))
+            # The far side can only hold closer points if the splitting plane is within the current k-th distance
+            if len(best) < k or difference * difference < -best[0][0]:
+                visit(far)
+
+        if k > 0:
+            visit(self._root)
+        return [(self.keys[index], chord_to_km(max(-negative, 0.0) ** 0.5)) for negative, index in sorted(best, reverse=True)]
+
+    def within(self, lat, lon, radius_km, accept=None):
+        """Return every (key, great-circle km) pair within `radius_km` of (lat, lon), closest first."""
+        vector = unit_vector(lat, lon)
+        limit = km_to_chord(radius_km) ** 2
+        found = []
+
+        def visit(node):
+            if node == -1:
+                return
+            index, axis, left, right = self._nodes[node]
+            difference = vector[axis] - self.vectors[index][axis]
+            near, far = (left, right) if difference < 0 else (right, left)
+            visit(near)
+            if accept is None or accept(self.keys[index]):
+                squared = self._squared_chord(vector, index)
+                if squared <= limit:
+                    found.append((squared, index))
+            if difference * difference <= limit:
+                visit(far)
+
+        visit(self._root)
+        return [(self.keys[index], chord_to_km(squared ** 0.5)) for squared, index in sorted(found)]
+
+    def batch_nearest(self, locations, k=1, accept=None):
+        """Run `nearest` for many (lat, lon) locations; returns one result list per location."""
+        return [self.nearest(lat, lon, k, accept) for lat, lon in locations]
@@ -0,0 +1,176 @@
+import os
+import json
+import atexit
+import threading
+from time import perf_counter_ns
+
+TRACE_ENV = "MULLVAD_TRACE"  # Set to a file name to trace the whole run and write a Chrome trace there at exit
+
+enabled = False
+_events = []  # (name, thread id, start ns, duration ns, args); list.append is atomic, so no lock is needed
+_origin = perf_counter_ns()
+
+
+class _NullSpan:
+    """What span() returns while tracing is off: entering and leaving it does nothing."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("name", "args", "start")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _events.append((self.name, threading.get_ident(), self.start, perf_counter_ns() - self.start, self.args))
+        return False
+
+
+def span(name, **args):
+    """
+    Time a block: `with span("probe", host=ip): ...`. While tracing is disabled this returns a shared
+    no-op object, so instrumented hot paths only pay for one function call.
+    """
+    if not enabled:
+        return NULL_SPAN
+    return _Span(name, args)
+
+
+def record(name, start, **args):
+    """Record a span that began at `start` (a perf_counter_ns() value) and ends now, for spans across callbacks."""
+    if enabled:
+        _events.append((name, threading.get_ident(), start, perf_counter_ns() - start, args))
+
+
+def traced(name):
+    """Decorator timing every call of a function as a span named `name`."""
+    def decorator(function):
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _Span(name, None):
+                return function(*args, **kwargs)
+        wrapper.__name__ = function.__name__
+        wrapper.__doc__ = function.__doc__
+        wrapper.__wrapped__ = function
+        return wrapper
+    return decorator
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    """Drop the recorded spans."""
+    global _events
+    _events = []
+
+
+def chrome_trace():
+    """The recorded spans in the Chrome trace event format (load it in chrome://tracing or Perfetto)."""
+    pid = os.getpid()
+    return {
+        "traceEvents": [
+            {"name": name, "ph": "X", "pid": pid, "tid": tid, "ts": (start - _origin) / 1000, "dur": duration / 1000,
+             "args": args or {}}
+            for name, tid, start, duration, args in list(_events)
+        ],
+        "displayTimeUnit": "ms",
+    }
+
+
+def summary():
+    """Per span name: count, total, mean and max duration in milliseconds, slowest total first."""
+    totals = {}
+    for name, _, _, duration, _ in list(_events):
+        entry = totals.setdefault(name, [0, 0, 0])
+        entry[0] += 1
+        entry[1] += duration
+        entry[2] = max(entry[2], duration)
+    return {
+        name: {"count": count, "total_ms": total / 1e6, "mean_ms": total / count / 1e6, "max_ms": longest / 1e6}
+        for name, (count, total, longest) in sorted(totals.items(), key=lambda item: -item[1][1])
+    }
+
+
+def write_trace(path):
+    """Write the Chrome trace to `path`, with the summary next to it when `path` ends in .json."""
+    with open(path, "w") as file:
+        json.dump(chrome_trace(), file)
+    if path.endswith(".json"):
+        with open(path[:-len(".json")] + ".summary.json", "w") as file:
+            json.dump(summary(), file, indent=2)
+
+
+class profile:
+    """
+    Opt-in cProfile around a block: `with profile("scan.prof"): ...` writes pstats data to the file
+    (open it with `python -m pstats scan.prof`); without a path the 25 most expensive calls are printed.
+    Threads started inside the block (e.g. probe workers) get their own profiler, merged into the same stats;
+    threads that were already running are not profiled.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._profilers = []  # Of the worker threads
+
+    def _profile_thread(self, frame, event, arg):
+        """threading.setprofile hook: runs first in every new thread and replaces itself with a profiler."""
+        import sys
+        import cProfile
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return  # Python 3.12+ runs one profiler at a time, and that one already sees every thread
+        self._profilers.append(profiler)
+
+    def __enter__(self):
+        import cProfile  # Only loaded when profiling is asked for
+        self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        threading.setprofile(self._profile_thread)
+        return self.profiler
+
+    def __exit__(self, *exc):
+        import pstats
+        threading.setprofile(None)
+        self.profiler.disable()
+        stats = pstats.Stats(self.profiler)
+        for profiler in list(self._profilers):
+            profiler.disable()  # Workers still running stop adding to the stats
+            stats.add(profiler)
+        if self.path:
+            stats.dump_stats(self.path)
+        else:
+            stats.sort_stats("cumulative").print_stats(25)
+        return False
+
+
+if os.environ.get(TRACE_ENV):
+    enable()
+    atexit.register(write_trace, os.environ[TRACE_ENV])